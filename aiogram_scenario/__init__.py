@@ -1,7 +1,21 @@
-from .fsm import (FiniteStateMachine, FSMTrigger, FSMMiddleware,
-                  AbstractState, BaseStatesGroup)
-from .registrars import MainRegistrar, Registrar
-from . import exceptions
+from .helpers import make_lazy_module
 
 
 __version__ = "0.9.0"
+
+# public names are imported on first access to keep the package import cheap
+make_lazy_module(globals(), {
+    "FiniteStateMachine": ".fsm",
+    "FSMTrigger": ".fsm",
+    "FSMMiddleware": ".fsm",
+    "SequencingMiddleware": ".fsm",
+    "AbstractState": ".fsm",
+    "LazyState": ".fsm",
+    "BaseStatesGroup": ".fsm",
+    "FSMScope": ".fsm",
+    "MainRegistrar": ".registrars",
+    "Registrar": ".registrars",
+    "StatesRouter": ".routing",
+    "RegistrationPlan": ".registration_plan",
+    "exceptions": None
+})
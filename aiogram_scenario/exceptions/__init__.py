@@ -1 +1 @@
-from . import base, fsm, magazine, state, transition, transitions_storage, other
+from . import base, fsm, magazine, state, transition, transitions_storage, registration, other
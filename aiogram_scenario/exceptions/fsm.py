@@ -11,6 +11,11 @@ class InvalidFSMStorage(FSMStorageError):
     pass
 
 
+class StorageUnavailableError(FSMStorageError):
+
+    pass
+
+
 class TransitionAddingError(ScenarioError):
 
     pass
@@ -34,3 +39,18 @@ class ImportTransitionsError(ScenarioError):
 class TransitionsChronologyError(ScenarioError):
 
     pass
+
+
+class ScenarioValidationError(ScenarioError):
+
+    pass
+
+
+class ScenarioArtifactError(ScenarioError):
+
+    pass
+
+
+class TimeoutsSchedulerError(ScenarioError):
+
+    pass
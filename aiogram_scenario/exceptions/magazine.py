@@ -9,3 +9,14 @@ class MagazineError(ScenarioError):
 class MagazineIsNotLoadedError(MagazineError):
 
     pass
+
+
+class MagazineVersionConflictError(MagazineError):
+
+    pass
+
+
+class MagazineCommitConflictError(MagazineVersionConflictError):
+
+    # the commit of a transition is rejected before its hooks are run, so the transition can be repeated
+    pass
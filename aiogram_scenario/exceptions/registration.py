@@ -0,0 +1,6 @@
+from .base import ScenarioError
+
+
+class RegistrationPlanError(ScenarioError):
+
+    pass
@@ -26,3 +26,8 @@ class TransitionLockingError(TransitionError):
         return f"transition from '{self.source_state}' to '{self.destination_state}' " \
                f"for (user_id={self.user_id}, chat_id={self.chat_id}) is not possible " \
                f"because there is an active lock!"
+
+
+class TransitionRateLimitError(TransitionError):
+
+    pass
@@ -0,0 +1,11 @@
+from .base import ScenarioError
+
+
+class TransitionsStorageError(ScenarioError):
+
+    pass
+
+
+class TransitionsValidationError(TransitionsStorageError):
+
+    pass
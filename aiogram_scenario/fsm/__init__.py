@@ -1,5 +1,14 @@
-from .fsm import FiniteStateMachine
-from .trigger import FSMTrigger
-from .middleware import FSMMiddleware
-from .state import AbstractState
-from .states_group import BaseStatesGroup
+from aiogram_scenario.helpers import make_lazy_module
+
+
+# public names are imported on first access to keep the package import cheap
+make_lazy_module(globals(), {
+    "FiniteStateMachine": ".fsm",
+    "FSMScope": ".scope",
+    "FSMTrigger": ".trigger",
+    "FSMMiddleware": ".middleware",
+    "SequencingMiddleware": ".middleware",
+    "AbstractState": ".state",
+    "LazyState": ".state",
+    "BaseStatesGroup": ".states_group"
+})
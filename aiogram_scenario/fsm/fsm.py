@@ -1,13 +1,25 @@
-from typing import Optional, List, Callable, Collection, Dict, Set
+from typing import Optional, List, Callable, Collection, Dict, Set, Tuple, Awaitable, Union
+import contextlib
+import functools
+import asyncio
 import logging
+import random
+import time
 
 from .state import AbstractState
+from .scope import FSMScope, resolve_address
 from aiogram_scenario import exceptions, helpers
 from aiogram_scenario.helpers import EVENT_UNION_TYPE
 from aiogram_scenario.fsm.storages.base import BaseStorage, Magazine
 from aiogram_scenario.fsm.transitions.locking import TransitionsLocksStorage
 from aiogram_scenario.transitions_storages.base import AbstractTransitionsStorage
 from aiogram_scenario.fsm.transitions.keeper import TransitionsKeeper
+from aiogram_scenario.fsm.transitions.artifact import read_scenario_artifact
+from aiogram_scenario.fsm.transitions.analysis import TransitionsGraph
+from aiogram_scenario.fsm.timeouts.base import BaseTimeoutsScheduler, StateTimeout
+from aiogram_scenario.fsm.transitions.journal import (TransitionsJournal, TransitionRecord, BACK_TRIGGER,
+                                                      TIMEOUT_TRIGGER, CHRONOLOGY_TRIGGER)
+from aiogram_scenario.fsm.transitions.funnel import FunnelAggregator
 
 
 logger = logging.getLogger(__name__)
@@ -15,13 +27,40 @@ logger = logging.getLogger(__name__)
 
 class FiniteStateMachine:
 
-    def __init__(self, storage: BaseStorage, *, initial_state: Optional[AbstractState] = None):
+    def __init__(self, storage: BaseStorage, *,
+                 initial_state: Optional[AbstractState] = None,
+                 scope: Optional[FSMScope] = None,
+                 transactional: bool = False,
+                 optimistic: bool = False,
+                 conflict_retries: int = 3,
+                 conflict_backoff: float = 0.01,
+                 max_conflict_backoff: float = 0.5,
+                 timeouts_scheduler: Optional[BaseTimeoutsScheduler] = None,
+                 states_fallback: Optional[Dict[str, Optional[str]]] = None,
+                 transitions_journal: Optional[TransitionsJournal] = None,
+                 funnel_aggregator: Optional[FunnelAggregator] = None):
 
         if not isinstance(storage, BaseStorage):
             raise exceptions.fsm.InvalidFSMStorage("invalid storage type! Try to choose from the ones "
                                                    "suggested here: aiogram_scenario.fsm.storages")
 
+        # the scope belongs to the storage, a machine may only confirm it
+        if scope is not None and scope is not storage.scope:
+            raise ValueError(f"scope {scope} differs from the scope of the storage {storage.scope}, "
+                             "set it when the storage is created!")
+
         self._storage = storage
+        self._scope = storage.scope
+        self._transactional = transactional
+        self._optimistic = optimistic
+        self._conflict_retries = conflict_retries
+        self._conflict_backoff = conflict_backoff
+        self._max_conflict_backoff = max_conflict_backoff
+        self._timeouts_scheduler = timeouts_scheduler
+        # old state name: new state name, unknown states degrade to the initial one if it is set
+        self._states_fallback = states_fallback
+        self._transitions_journal = transitions_journal
+        self._funnel_aggregator = funnel_aggregator
         self._initial_state = initial_state
         self._locks_storage = TransitionsLocksStorage()
         self._transitions_keeper = TransitionsKeeper()
@@ -40,6 +79,16 @@ class FiniteStateMachine:
 
         return self._transitions_keeper.states
 
+    @property
+    def storage(self) -> BaseStorage:
+
+        return self._storage
+
+    @property
+    def scope(self) -> FSMScope:
+
+        return self._scope
+
     def set_initial_state(self, state: AbstractState) -> None:
 
         if self._initial_state is not None:
@@ -53,22 +102,18 @@ class FiniteStateMachine:
         logger.debug(f"Added initial state for FSM: '{self._initial_state}'!")
 
     def add_transition(self, source_state: AbstractState,
-                       trigger_func: Callable,
+                       trigger_func: Union[Callable, str],
                        destination_state: AbstractState) -> None:
 
         for state in (source_state, destination_state):
-            if state.is_initial and (state is not self.initial_state):
-                raise exceptions.fsm.TransitionAddingError(
-                    f"source state '{source_state}' is defined as initial state, but it is different "
-                    f"from the set initial state of the machine ('{self.initial_state}')!"
-                )
+            self._check_initial_state(state)
             if self._states_mapping.get(state.raw_value) is None:
                 self._states_mapping[state.raw_value] = state
 
         self._transitions_keeper.add_transition(source_state, trigger_func, destination_state)
 
     def remove_transition(self, source_state: AbstractState,
-                          trigger_func: Callable,
+                          trigger_func: Union[Callable, str],
                           destination_state: AbstractState) -> None:
 
         self._transitions_keeper.remove_transition(source_state, trigger_func, destination_state)
@@ -86,7 +131,10 @@ class FiniteStateMachine:
                                  context_kwargs: dict,
                                  magazine: Optional[Magazine] = None,
                                  user_id: Optional[int] = None,
-                                 chat_id: Optional[int] = None) -> None:
+                                 chat_id: Optional[int] = None,
+                                 trigger: Optional[str] = None) -> None:
+
+        chat_id, user_id = self._resolve_address(user_id=user_id, chat_id=chat_id)
 
         if magazine is not None:
             if not magazine.is_loaded:
@@ -95,43 +143,147 @@ class FiniteStateMachine:
             magazine = self._storage.get_magazine(chat=chat_id, user=user_id)
             await magazine.load()
 
-        with self._locks_storage.acquire(source_state, destination_state, user_id=user_id, chat_id=chat_id):
+        if self._optimistic:  # the magazine version is checked instead of a process-local lock
+            lock_context = contextlib.nullcontext()
+        else:
+            lock_context = self._locks_storage.acquire(source_state, destination_state,
+                                                       user_id=user_id, chat_id=chat_id)
+
+        with lock_context:
             logger.debug(f"Started transition from '{source_state}' to '{destination_state}' "
                          f"({user_id=}, {chat_id=})...")
 
             exit_kwargs, enter_kwargs = [helpers.get_existing_kwargs(method, check_varkw=True, **context_kwargs)
                                          for method in (source_state.process_exit, destination_state.process_enter)]
 
-            await source_state.process_exit(event, **exit_kwargs)
-            logger.debug(f"Produced exit from state '{source_state}' ({user_id=}, {chat_id=})!")
-            await destination_state.process_enter(event, **enter_kwargs)
-            logger.debug(f"Produced enter to state '{destination_state}' ({user_id=}, {chat_id=})!")
-            await magazine.push(destination_state.raw_value)
+            if self._transactional or self._optimistic:
+                await self._process_transactional_transition(source_state, destination_state,
+                                                             event=event, magazine=magazine,
+                                                             exit_kwargs=exit_kwargs, enter_kwargs=enter_kwargs,
+                                                             context_kwargs=context_kwargs)
+            elif source_state.independent_hooks and destination_state.independent_hooks:
+                await self._process_concurrent_transition(source_state, destination_state,
+                                                          event=event, magazine=magazine,
+                                                          exit_kwargs=exit_kwargs, enter_kwargs=enter_kwargs)
+            else:
+                await source_state.process_exit(event, **exit_kwargs)
+                logger.debug(f"Produced exit from state '{source_state}' ({user_id=}, {chat_id=})!")
+                await destination_state.process_enter(event, **enter_kwargs)
+                logger.debug(f"Produced enter to state '{destination_state}' ({user_id=}, {chat_id=})!")
+                await magazine.push(destination_state.raw_value)
             logger.debug(f"State '{destination_state}' is set ({user_id=}, {chat_id=})!")
 
+        if self._timeouts_scheduler is not None:
+            await self._update_timeout(destination_state, user_id=user_id, chat_id=chat_id)
+        if self._transitions_journal is not None or self._funnel_aggregator is not None:
+            self._record_transition(TransitionRecord(timestamp=time.time(), chat=chat_id, user=user_id,
+                                                     source=source_state.raw_value,
+                                                     destination=destination_state.raw_value,
+                                                     trigger=trigger))
+
         logger.debug(f"Transition to '{destination_state}' ({user_id=}, {chat_id=}) completed!")
 
     def import_transitions(self, storage: AbstractTransitionsStorage, *,
                            states: Collection[AbstractState],
-                           triggers_funcs: Collection[Callable]) -> None:
+                           triggers_funcs: Optional[Collection[Callable]] = None) -> None:
+
+        for source_state, trigger_func, destination_state in self._read_transitions(storage, states=states,
+                                                                                    triggers_funcs=triggers_funcs):
+            self.add_transition(
+                source_state=source_state,
+                trigger_func=trigger_func,
+                destination_state=destination_state
+            )
+
+    def reload_transitions(self, storage: AbstractTransitionsStorage, *,
+                           states: Collection[AbstractState],
+                           triggers_funcs: Optional[Collection[Callable]] = None) -> None:
+
+        # transitions are validated before anything is changed, an invalid graph keeps the current one working
+        transitions = self._read_transitions(storage, states=states, triggers_funcs=triggers_funcs)
+
+        transitions_keeper = TransitionsKeeper()
+        states_mapping = self._states_mapping.copy()  # users may still be in the states removed from the graph
+        for source_state, trigger_func, destination_state in transitions:
+            for state in (source_state, destination_state):
+                self._check_initial_state(state)
+                states_mapping[state.raw_value] = state
+            transitions_keeper.add_transition(source_state, trigger_func, destination_state)
+
+        # the new graph is swapped by reference, transitions that already resolved their states finish on the old one
+        self._transitions_keeper = transitions_keeper
+        self._states_mapping = states_mapping
+
+        logger.info(f"Transitions are reloaded from {storage.__class__.__name__} "
+                    f"({len(transitions_keeper.states)} states)!")
+
+    def _read_transitions(self, storage: AbstractTransitionsStorage, *,
+                          states: Collection[AbstractState],
+                          triggers_funcs: Optional[Collection[Callable]] = None
+                          ) -> List[Tuple[AbstractState, Union[Callable, str], AbstractState]]:
 
         if not states:
             raise exceptions.fsm.ImportTransitionsError("no states!")
-        if not triggers_funcs:
+        if triggers_funcs is not None and not triggers_funcs:
             raise exceptions.fsm.ImportTransitionsError("no triggers funcs!")
 
         transitions = storage.read()
         states_mapping = {str(state): state for state in states}
-        triggers_funcs_mapping = {trigger.__name__: trigger for trigger in triggers_funcs}
+        if triggers_funcs is None:  # triggers are matched by names, states modules are not imported
+            triggers_funcs_mapping = None
+        else:
+            triggers_funcs_mapping = {trigger.__name__: trigger for trigger in triggers_funcs}
+
+        # all unknown names are reported at once, before any transition is added
+        errors = []
+        for source_state, source_transitions in transitions.items():
+            if source_state not in states_mapping:
+                errors.append(f"state '{source_state}' is not provided")
+            for trigger_func, destination_state in source_transitions.items():
+                if triggers_funcs_mapping is not None and trigger_func not in triggers_funcs_mapping:
+                    errors.append(f"trigger '{trigger_func}' of state '{source_state}' is not provided")
+                if destination_state not in states_mapping:
+                    errors.append(f"state '{destination_state}' is not provided")
+        if errors:
+            raise exceptions.fsm.ImportTransitionsError("transitions cannot be imported:\n" +
+                                                        "\n".join(dict.fromkeys(errors)))
+
+        return [
+            (states_mapping[source_state],
+             trigger_func if triggers_funcs_mapping is None else triggers_funcs_mapping[trigger_func],
+             states_mapping[destination_state])
+            for source_state, source_transitions in transitions.items()
+            for trigger_func, destination_state in source_transitions.items()
+        ]
+
+    def load_scenario_artifact(self, filename: str, *,
+                               states: Collection[AbstractState],
+                               triggers_funcs: Optional[Collection[Callable]] = None) -> None:
+
+        graph = read_scenario_artifact(filename)
+        states_mapping = {str(state): state for state in states}
+        try:
+            graph_states = [states_mapping[i] for i in graph.states]
+            if triggers_funcs is None:  # triggers are matched by names
+                graph_triggers = graph.triggers
+            else:
+                triggers_funcs_mapping = {trigger.__name__: trigger for trigger in triggers_funcs}
+                graph_triggers = [triggers_funcs_mapping[i] for i in graph.triggers]
+        except KeyError as error:
+            raise exceptions.fsm.ImportTransitionsError(f"'{error.args[0]}' from the scenario artifact "
+                                                        f"is not provided!")
+
+        transitions = {}
+        for source_index, trigger_index, destination_index in graph.transitions:
+            source_state = graph_states[source_index]
+            if source_state not in transitions:
+                transitions[source_state] = {}
+            transitions[source_state][graph_triggers[trigger_index]] = graph_states[destination_index]
 
-        for source_state in transitions.keys():
-            for trigger_func in transitions[source_state].keys():
-                destination_state = transitions[source_state][trigger_func]
-                self.add_transition(
-                    source_state=states_mapping[source_state],
-                    trigger_func=triggers_funcs_mapping[trigger_func],
-                    destination_state=states_mapping[destination_state]
-                )
+        if self._initial_state is None:
+            self.set_initial_state(states_mapping[graph.initial_state])
+        self._transitions_keeper.load_transitions(transitions)
+        self._states_mapping.update({state.raw_value: state for state in graph_states})
 
     def export_transitions(self, storage: AbstractTransitionsStorage) -> None:
 
@@ -141,18 +293,52 @@ class FiniteStateMachine:
 
         storage.write(serialized_transitions)
 
+    def get_transitions_graph(self) -> TransitionsGraph:
+
+        return TransitionsGraph.from_keeper(self._transitions_keeper)
+
     async def execute_next_transition(self, trigger_func: Callable, *,
                                       event: EVENT_UNION_TYPE,
                                       context_kwargs: dict,
                                       user_id: Optional[int] = None,
                                       chat_id: Optional[int] = None) -> None:
 
+        await self._retry_on_conflict(functools.partial(
+            self._execute_next_transition,
+            trigger_func,
+            event=event,
+            context_kwargs=context_kwargs,
+            user_id=user_id,
+            chat_id=chat_id
+        ))
+
+    async def execute_back_transition(self, *, event: EVENT_UNION_TYPE,
+                                      context_kwargs: dict,
+                                      user_id: Optional[int] = None,
+                                      chat_id: Optional[int] = None) -> None:
+
+        await self._retry_on_conflict(functools.partial(
+            self._execute_back_transition,
+            event=event,
+            context_kwargs=context_kwargs,
+            user_id=user_id,
+            chat_id=chat_id
+        ))
+
+    async def _execute_next_transition(self, trigger_func: Callable, *,
+                                       event: EVENT_UNION_TYPE,
+                                       context_kwargs: dict,
+                                       user_id: Optional[int] = None,
+                                       chat_id: Optional[int] = None) -> None:
+
+        chat_id, user_id = self._resolve_address(user_id=user_id, chat_id=chat_id)
         magazine = self._storage.get_magazine(chat=chat_id, user=user_id)
         await magazine.load()
 
-        source_state = self._states_mapping[magazine.current_state]
+        source_state = self._get_state(magazine.current_state, user_id=user_id, chat_id=chat_id)
         try:
-            destination_state = self._transitions_keeper[source_state][trigger_func]
+            source_transitions = self._transitions_keeper[source_state]
+            destination_state = source_transitions.get(trigger_func) or source_transitions[trigger_func.__name__]
         except KeyError:
             raise exceptions.transition.TransitionError(f"no next transition are defined for '{source_state}' state "
                                                         f"({user_id=}, {chat_id=})!")
@@ -164,14 +350,16 @@ class FiniteStateMachine:
             context_kwargs=context_kwargs,
             magazine=magazine,
             user_id=user_id,
-            chat_id=chat_id
+            chat_id=chat_id,
+            trigger=trigger_func.__name__
         )
 
-    async def execute_back_transition(self, *, event: EVENT_UNION_TYPE,
-                                      context_kwargs: dict,
-                                      user_id: Optional[int] = None,
-                                      chat_id: Optional[int] = None) -> None:
+    async def _execute_back_transition(self, *, event: EVENT_UNION_TYPE,
+                                       context_kwargs: dict,
+                                       user_id: Optional[int] = None,
+                                       chat_id: Optional[int] = None) -> None:
 
+        chat_id, user_id = self._resolve_address(user_id=user_id, chat_id=chat_id)
         magazine = self._storage.get_magazine(chat=chat_id, user=user_id)
         await magazine.load()
 
@@ -181,8 +369,8 @@ class FiniteStateMachine:
             raise exceptions.transition.TransitionError("there are not enough states in the "
                                                         f"magazine to return ({user_id=}, {chat_id=})!")
 
-        source_state = self._states_mapping[magazine.current_state]
-        destination_state = self._states_mapping[penultimate_state]
+        source_state = self._get_state(magazine.current_state, user_id=user_id, chat_id=chat_id)
+        destination_state = self._get_state(penultimate_state, user_id=user_id, chat_id=chat_id)
 
         await self.execute_transition(
             source_state=source_state,
@@ -191,7 +379,8 @@ class FiniteStateMachine:
             context_kwargs=context_kwargs,
             magazine=magazine,
             user_id=user_id,
-            chat_id=chat_id
+            chat_id=chat_id,
+            trigger=BACK_TRIGGER
         )
 
     async def set_transitions_chronology(self, states: List[AbstractState], *,
@@ -199,20 +388,229 @@ class FiniteStateMachine:
                                          chat_id: Optional[int] = None,
                                          check: bool = True) -> None:
 
+        chat_id, user_id = self._resolve_address(user_id=user_id, chat_id=chat_id)
+
         if check:
-            for i in range(len(states)):
-                if i == (len(states) - 1):
-                    break
-                source_state = states[i]
-                destination_state = states[i + 1]
-                if destination_state not in self._transitions_keeper[source_state].values():
+            for source_state, destination_state in zip(states, states[1:]):
+                if not self._transitions_keeper.has_transition(source_state, destination_state):
                     raise exceptions.fsm.TransitionsChronologyError(f"from '{source_state}' state it is impossible "
                                                                     f"to get into '{destination_state}' state "
                                                                     f"({user_id=}, {chat_id=})!")
 
         magazine = self._storage.get_magazine(chat=chat_id, user=user_id)
-        for state in states:
-            magazine.set(state.raw_value)
+        magazine.replace([state.raw_value for state in states])
         await magazine.commit()
+        if self._timeouts_scheduler is not None and states:
+            await self._update_timeout(states[-1], user_id=user_id, chat_id=chat_id)
+        if self._transitions_journal is not None or self._funnel_aggregator is not None:
+            timestamp = time.time()  # shared by the records, so the journal replays them as one chronology
+            for source_state, destination_state in zip([None, *states], states):
+                self._record_transition(TransitionRecord(
+                    timestamp=timestamp, chat=chat_id, user=user_id,
+                    source=source_state.raw_value if source_state is not None else None,
+                    destination=destination_state.raw_value, trigger=CHRONOLOGY_TRIGGER
+                ))
 
         logger.debug(f"Chronology of transitions '{magazine.states}' set ({user_id=}, {chat_id=})!")
+
+    async def touch_timeout(self, *, user_id: Optional[int] = None,
+                            chat_id: Optional[int] = None) -> None:
+
+        if self._timeouts_scheduler is None or (user_id is None and chat_id is None):
+            return
+
+        chat_id, user_id = self._resolve_address(user_id=user_id, chat_id=chat_id)
+        await self._timeouts_scheduler.touch(chat=chat_id, user=user_id)
+
+    async def process_expired_timeouts(self, *, limit: int = 100, retry_delay: float = 5.0) -> int:
+
+        if self._timeouts_scheduler is None:
+            raise exceptions.fsm.TimeoutsSchedulerError("timeouts scheduler is not set!")
+
+        addresses = await self._timeouts_scheduler.pop_expired(limit=limit)
+        results = await asyncio.gather(*(self._process_timeout(user_id=user_id, chat_id=chat_id)
+                                         for chat_id, user_id in addresses), return_exceptions=True)
+        for (chat_id, user_id), result in zip(addresses, results):
+            if isinstance(result, Exception):  # popped already, so it is returned to be retried
+                logger.error(f"Timeout transition failed, it is retried in {retry_delay}s ({user_id=}, {chat_id=})!",
+                             exc_info=result)
+                await self._timeouts_scheduler.reschedule(chat=chat_id, user=user_id, timeout=retry_delay)
+
+        return len(addresses)
+
+    async def run_timeouts_worker(self, *, interval: float = 1.0, limit: int = 100, retry_delay: float = 5.0) -> None:
+
+        # a single loop serves the timeouts of all users
+        while True:
+            try:
+                if await self.process_expired_timeouts(limit=limit, retry_delay=retry_delay) >= limit:
+                    continue  # there may be more expired timeouts right away
+                next_deadline = await self._timeouts_scheduler.get_next_deadline()
+            except Exception:  # noqa, the worker must survive temporary failures of the scheduler backend
+                logger.exception("Processing of expired timeouts failed!")
+                next_deadline = None
+
+            if next_deadline is None:
+                delay = interval
+            else:
+                delay = min(max(next_deadline - time.time(), 0), interval)
+            await asyncio.sleep(delay)
+
+    async def _process_timeout(self, *, user_id: Union[str, int], chat_id: Union[str, int]) -> None:
+
+        magazine = self._storage.get_magazine(chat=chat_id, user=user_id)
+        await magazine.load()
+
+        try:
+            source_state = self._get_state(magazine.current_state, user_id=user_id, chat_id=chat_id)
+        except KeyError:  # unknown state without a fallback
+            return
+        if source_state.is_initial or source_state.timeout is None:
+            return  # the state was changed without rescheduling
+
+        logger.debug(f"State '{source_state}' timed out ({user_id=}, {chat_id=})!")
+        await self.execute_transition(
+            source_state=source_state,
+            destination_state=self.initial_state,
+            event=StateTimeout(chat_id=chat_id, user_id=user_id, state=str(source_state)),
+            context_kwargs={},
+            magazine=magazine,
+            user_id=user_id,
+            chat_id=chat_id,
+            trigger=TIMEOUT_TRIGGER
+        )
+
+    async def _update_timeout(self, state: AbstractState, *,
+                              user_id: Optional[int],
+                              chat_id: Optional[int]) -> None:
+
+        if state.timeout is None or state.is_initial:
+            await self._timeouts_scheduler.cancel(chat=chat_id, user=user_id)
+        else:
+            await self._timeouts_scheduler.schedule(chat=chat_id, user=user_id, timeout=state.timeout)
+            logger.debug(f"Timeout of state '{state}' is scheduled in {state.timeout}s ({user_id=}, {chat_id=})!")
+
+    async def _retry_on_conflict(self, transition_func: Callable[[], Awaitable[None]]) -> None:
+
+        for attempt in range(self._conflict_retries + 1):
+            try:
+                return await transition_func()
+            except exceptions.magazine.MagazineCommitConflictError:
+                # only a commit rejected before the hooks is retried, other conflicts propagate as they are
+                if attempt == self._conflict_retries:
+                    raise
+                delay = min(self._conflict_backoff * (2 ** attempt), self._max_conflict_backoff)
+                delay *= random.uniform(0.5, 1)  # jitter to spread competing workers apart
+                logger.debug(f"Magazine version conflict, transition will be retried in {delay:.3f}s "
+                             f"(attempt {attempt + 1}/{self._conflict_retries})...")
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    async def _process_concurrent_transition(source_state: AbstractState,
+                                             destination_state: AbstractState, *,
+                                             event: EVENT_UNION_TYPE,
+                                             magazine: Magazine,
+                                             exit_kwargs: dict,
+                                             enter_kwargs: dict) -> None:
+
+        previous_states = magazine.states.copy()
+        exit_result, enter_result, push_result = await asyncio.gather(
+            source_state.process_exit(event, **exit_kwargs),
+            destination_state.process_enter(event, **enter_kwargs),
+            magazine.push(destination_state.raw_value),
+            return_exceptions=True
+        )
+        logger.debug(f"Produced concurrent exit from state '{source_state}' "
+                     f"and enter to state '{destination_state}'!")
+
+        errors = [i for i in (exit_result, enter_result, push_result) if isinstance(i, BaseException)]
+        if not errors:
+            return
+
+        try:
+            await magazine.restore(previous_states, commit=not isinstance(push_result, BaseException))
+        except Exception as restore_error:  # the error of the transition itself is the one to raise
+            logger.error(f"Magazine of failed transition from '{source_state}' to '{destination_state}' "
+                         f"is not rolled back: {restore_error!r}!")
+        else:
+            logger.debug(f"Transition from '{source_state}' to '{destination_state}' "
+                         f"failed, magazine rolled back to {previous_states}!")
+
+        raise errors[0]
+
+    @staticmethod
+    async def _process_transactional_transition(source_state: AbstractState,
+                                                destination_state: AbstractState, *,
+                                                event: EVENT_UNION_TYPE,
+                                                magazine: Magazine,
+                                                exit_kwargs: dict,
+                                                enter_kwargs: dict,
+                                                context_kwargs: dict) -> None:
+
+        previous_states = magazine.states.copy()
+        try:
+            await magazine.push(destination_state.raw_value, compare_version=True)
+        except exceptions.magazine.MagazineVersionConflictError as e:  # nothing is done yet, so it can be repeated
+            raise exceptions.magazine.MagazineCommitConflictError(str(e)) from e
+        logger.debug(f"Magazine optimistically committed for transition from '{source_state}' "
+                     f"to '{destination_state}' (version={magazine.version})!")
+
+        is_exited = False
+        try:
+            await source_state.process_exit(event, **exit_kwargs)
+            is_exited = True
+            await destination_state.process_enter(event, **enter_kwargs)
+        except Exception:
+            try:
+                await magazine.restore(previous_states, compare_version=True)
+            except Exception as restore_error:  # e.g. the magazine is changed concurrently, compensate anyway
+                logger.error(f"Magazine of failed transition from '{source_state}' to '{destination_state}' "
+                             f"is not rolled back: {restore_error!r}!")
+            else:
+                logger.debug(f"Transition from '{source_state}' to '{destination_state}' "
+                             f"failed, magazine rolled back to {previous_states}!")
+            if is_exited:
+                compensation_kwargs = helpers.get_existing_kwargs(source_state.process_exit_compensation,
+                                                                  check_varkw=True, **context_kwargs)
+                await source_state.process_exit_compensation(event, **compensation_kwargs)
+                logger.debug(f"Produced exit compensation for state '{source_state}'!")
+            raise
+
+    def _record_transition(self, record: TransitionRecord) -> None:
+
+        # both only update in-process structures, nothing is awaited on the hot path
+        if self._transitions_journal is not None:
+            self._transitions_journal.record(record)
+        if self._funnel_aggregator is not None:
+            self._funnel_aggregator.record(record)
+
+    def _check_initial_state(self, state: AbstractState) -> None:
+
+        if state.is_initial and (state is not self.initial_state):
+            raise exceptions.fsm.TransitionAddingError(
+                f"state '{state}' is defined as initial state, but it is different "
+                f"from the set initial state of the machine ('{self.initial_state}')!"
+            )
+
+    def _get_state(self, raw_value: Optional[str], *,
+                   user_id: Optional[int],
+                   chat_id: Optional[int]) -> AbstractState:
+
+        state = self._states_mapping.get(raw_value)
+        if state is not None:
+            return state
+        if self._states_fallback is None:
+            return self._states_mapping[raw_value]  # KeyError as before, without a fallback
+
+        new_raw_value = self._states_fallback.get(raw_value)
+        state = self._states_mapping.get(new_raw_value) if new_raw_value is not None else None
+        if state is None:
+            state = self.initial_state
+        logger.warning(f"Unknown state '{raw_value}' is replaced with '{state}' ({user_id=}, {chat_id=})!")
+
+        return state
+
+    def _resolve_address(self, *, user_id: Optional[int],
+                         chat_id: Optional[int]) -> Tuple[Optional[int], Optional[int]]:
+
+        return resolve_address(self._scope, chat_id=chat_id, user_id=user_id)
@@ -1,21 +1,66 @@
+from typing import Optional, Tuple, List, Dict, Hashable
+from dataclasses import dataclass
+import contextvars
+import asyncio
+import logging
+
 from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.types import Update
 
 from .fsm import FiniteStateMachine
-from .trigger import FSMTrigger
+from .trigger import FSMTrigger, UPDATE_TYPES, get_current_user_id, get_current_chat_id
+from .scope import FSMScope, resolve_address
+from .unit_of_work import FSMUnitOfWork, _current_unit_of_work
+from .rate_limits.limiter import TransitionsRateLimiter
+from aiogram_scenario.helpers import EVENT_UNION_TYPE
+
+
+logger = logging.getLogger(__name__)
+_is_sequenced_update = contextvars.ContextVar("is_sequenced_update", default=False)
 
 
 class FSMMiddleware(BaseMiddleware):
 
-    def __init__(self, fsm: FiniteStateMachine, trigger_arg: str = "fsm"):
+    def __init__(self, fsm: FiniteStateMachine, trigger_arg: str = "fsm",
+                 unit_of_work_arg: Optional[str] = None,
+                 rate_limiter: Optional[TransitionsRateLimiter] = None):
 
         super().__init__()
         self._fsm = fsm
-        self._trigger = FSMTrigger(self._fsm)
+        self._trigger = FSMTrigger(self._fsm, rate_limiter=rate_limiter)
         self._trigger_arg = trigger_arg
+        self._unit_of_work_arg = unit_of_work_arg  # None - units of work are not created
+
+    async def on_pre_process_update(self, update: Update, _):
+
+        if self._unit_of_work_arg is None:
+            return
+
+        chat_id, user_id = _get_update_address(update)
+        if chat_id is None and user_id is None:
+            return
+
+        # nothing is read until the unit of work is used by a handler
+        _current_unit_of_work.set(FSMUnitOfWork(self._fsm.storage, chat=chat_id, user=user_id))
+
+    async def on_post_process_update(self, *_):
+
+        unit_of_work = _current_unit_of_work.get()
+        if unit_of_work is not None:
+            _current_unit_of_work.set(None)
+            await unit_of_work.commit()
+
+    async def on_pre_process_error(self, *_):
+
+        unit_of_work = _current_unit_of_work.get()
+        if unit_of_work is not None:  # changes of the failed update are discarded
+            unit_of_work.rollback()
 
     async def on_process(self, _, data: dict):
 
         self._setup_trigger(data)
+        await self._fsm.touch_timeout(user_id=get_current_user_id(), chat_id=get_current_chat_id())
 
     async def on_process_error(self, _, exception: Exception, data: dict):  # noqa
 
@@ -42,3 +87,195 @@ class FSMMiddleware(BaseMiddleware):
     def _setup_trigger(self, data: dict) -> None:
 
         data[self._trigger_arg] = self._trigger
+        if self._unit_of_work_arg is not None:
+            data[self._unit_of_work_arg] = _current_unit_of_work.get()
+
+
+@dataclass()
+class SequencingStats:
+
+    queued_updates: int = 0
+    processed_updates: int = 0
+    failed_updates: int = 0
+    throttled_updates: int = 0  # updates that waited for free space in a full queue
+    active_keys: int = 0
+    busy_workers: int = 0
+    max_queue_size: int = 0  # the largest per-key queue observed
+
+
+def _get_update_event(update: Update) -> Optional[EVENT_UNION_TYPE]:
+
+    for event_type_attr in UPDATE_TYPES:
+        event = getattr(update, event_type_attr)
+        if event is not None:
+            return event
+
+    return None
+
+
+def _get_update_address(update: Update) -> Tuple[Optional[int], Optional[int]]:
+
+    event = _get_update_event(update)
+    if event is None:
+        return None, None
+
+    user = getattr(event, "from_user", None) or getattr(event, "user", None)
+    chat = getattr(event, "chat", None)
+    if chat is None and getattr(event, "message", None) is not None:
+        chat = event.message.chat
+
+    return (chat.id if chat is not None else None), (user.id if user is not None else None)
+
+
+@dataclass()
+class _AddressQueue:
+
+    updates: asyncio.Queue
+    pending_updates: int = 0  # queued and being put, the queue is dropped only when there are none
+
+
+# Must be set up before other middlewares: updates are re-dispatched from per-address queues,
+# so the middlewares that run earlier would see "pre_process_update" twice. A fixed pool of workers
+# takes addresses with queued updates in turn and processes one update of the address at a time,
+# so only updates of the same address wait for each other.
+class SequencingMiddleware(BaseMiddleware):
+
+    def __init__(self, *, workers: int = 64,
+                 max_queue_size: int = 100,
+                 scope: FSMScope = FSMScope.USER_IN_CHAT):
+
+        super().__init__()
+        self._workers = workers
+        self._max_queue_size = max_queue_size  # of an address
+        self._scope = scope
+        self._queues: Dict[Hashable, _AddressQueue] = {}
+        self._ready_keys: Optional[asyncio.Queue] = None  # addresses with queued updates, each one at most once
+        self._worker_tasks: List[asyncio.Task] = []
+        self._watcher_task: Optional[asyncio.Task] = None
+        self._drained: Optional[asyncio.Event] = None  # set when no address has queued updates
+        self._stats = SequencingStats()
+
+    @property
+    def stats(self) -> SequencingStats:
+
+        return self._stats
+
+    async def on_pre_process_update(self, update: Update, _):
+
+        if _is_sequenced_update.get():
+            return
+
+        chat_id, user_id = _get_update_address(update)
+        if chat_id is None and user_id is None:  # nothing to order by
+            return
+
+        key = resolve_address(self._scope, chat_id=chat_id, user_id=user_id)
+        ready_keys = self._get_ready_keys()
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = _AddressQueue(updates=asyncio.Queue(maxsize=self._max_queue_size))
+            self._stats.active_keys += 1
+            self._drained.clear()
+        queue.pending_updates += 1
+        if queue.pending_updates == 1:
+            ready_keys.put_nowait(key)
+
+        if queue.updates.full():  # only updates of this address wait
+            self._stats.throttled_updates += 1
+            logger.debug(f"Queue for {key} is full, update {update.update_id} waits for free space...")
+        await queue.updates.put(update)
+        self._stats.queued_updates += 1
+        self._stats.max_queue_size = max(self._stats.max_queue_size, queue.updates.qsize())
+
+        raise CancelHandler()
+
+    async def on_shutdown(self, _) -> None:
+
+        # for «executor.on_shutdown», e.g. with webhooks; with polling the workers stop with the dispatcher anyway
+        await self.close()
+
+    async def close(self, timeout: Optional[float] = None) -> None:
+
+        if self._ready_keys is None:  # nothing has been started
+            return
+
+        try:
+            await asyncio.wait_for(self._drained.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Sequencing is stopped with {self._stats.queued_updates} queued updates dropped!")
+
+        tasks = list(self._worker_tasks)
+        if self._watcher_task is not asyncio.current_task():  # the watcher closes the middleware itself
+            tasks.append(self._watcher_task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._worker_tasks.clear()
+        self._watcher_task = None
+        self._queues.clear()
+        self._ready_keys = None
+        self._drained = None
+
+    def _get_ready_keys(self) -> asyncio.Queue:
+
+        # workers are started lazily to be bound to the running loop
+        if self._ready_keys is None:
+            self._ready_keys = asyncio.Queue()
+            self._drained = asyncio.Event()
+            self._drained.set()
+            self._worker_tasks = [asyncio.create_task(self._run_worker()) for _ in range(self._workers)]
+            self._watcher_task = asyncio.create_task(self._close_on_dispatcher_close())
+
+        return self._ready_keys
+
+    async def _close_on_dispatcher_close(self) -> None:
+
+        # polling is stopped, so no updates come any more: the queued ones are processed and the workers stopped
+        await self.manager.dispatcher.wait_closed()
+        await self.close()
+
+    async def _run_worker(self) -> None:
+
+        _is_sequenced_update.set(True)
+        dispatcher = self.manager.dispatcher
+
+        while True:
+            key = await self._ready_keys.get()
+            queue = self._queues[key]
+            update = await queue.updates.get()  # the update may still be being put
+            self._stats.queued_updates -= 1
+            self._stats.busy_workers += 1
+            try:
+                await dispatcher.updates_handler.notify(update)
+                await _wait_handlers_tasks(_get_update_event(update))
+            except Exception:  # noqa
+                self._stats.failed_updates += 1
+                logger.exception(f"Failed to process sequenced update {update.update_id} for {key}!")
+            else:
+                self._stats.processed_updates += 1
+            finally:
+                self._stats.busy_workers -= 1
+
+            queue.pending_updates -= 1
+            if queue.pending_updates:  # the address goes to the end of the line, so others are not starved
+                self._ready_keys.put_nowait(key)
+            else:
+                del self._queues[key]
+                self._stats.active_keys -= 1
+                if not self._queues:
+                    self._drained.set()
+
+
+async def _wait_handlers_tasks(event: EVENT_UNION_TYPE) -> None:
+
+    # A handler registered with «run_task» only starts a task with the event and returns, so the next update
+    # of the address could overtake it. Such tasks are found by the event they got and waited for;
+    # they have been started by now, so their frames hold their arguments.
+    handlers_tasks = []
+    for task in asyncio.all_tasks():
+        frame = getattr(task.get_coro(), "cr_frame", None)
+        if not task.done() and frame is not None and any(value is event for value in frame.f_locals.values()):
+            handlers_tasks.append(task)
+
+    if handlers_tasks:
+        await asyncio.wait(handlers_tasks)
@@ -0,0 +1,100 @@
+from typing import Dict, List, Optional, Any, Callable
+from dataclasses import dataclass
+import asyncio
+import inspect
+import logging
+import time
+
+from aiogram_scenario.fsm.storages.base import BaseStorage, MagazineRecord
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass()
+class MigrationStats:
+
+    scanned_magazines: int = 0
+    migrated_magazines: int = 0
+    conflicted_magazines: int = 0  # changed concurrently, the next run will pick them up
+    batches: int = 0
+    cursor: Any = None  # cursor of the next batch, used to resume an interrupted migration
+
+
+def migrate_magazine_states(states: List[Optional[str]], mapping: Dict[str, Optional[str]]) -> List[Optional[str]]:
+
+    # renamed states get new names, removed ones (mapped to None) are dropped,
+    # states that became repeated are collapsed the same way as «Magazine.set» does
+    new_states = []
+    states_indexes = {}
+    for state in states:
+        if state is not None and state in mapping:
+            state = mapping[state]
+            if state is None:
+                continue
+
+        state_index = states_indexes.get(state)
+        if state_index is None:
+            states_indexes[state] = len(new_states)
+            new_states.append(state)
+        else:
+            for removed_state in new_states[state_index + 1:]:
+                del states_indexes[removed_state]
+            del new_states[state_index + 1:]
+
+    if not new_states or new_states[0] is not None:  # the initial state always opens the magazine
+        new_states.insert(0, None)
+
+    return new_states
+
+
+class StatesMigration:
+
+    def __init__(self, storage: BaseStorage, mapping: Dict[str, Optional[str]], *,
+                 batch_size: int = 500,
+                 max_batches_per_second: Optional[float] = None):
+
+        self._storage = storage
+        self._mapping = mapping  # old state name: new state name (None - the state is removed)
+        self._batch_size = batch_size
+        self._min_batch_interval = 1 / max_batches_per_second if max_batches_per_second else 0
+
+    async def run(self, *, cursor: Any = None,
+                  on_batch: Optional[Callable[[MigrationStats], Any]] = None) -> MigrationStats:
+
+        stats = MigrationStats(cursor=cursor)
+        while True:
+            started_at = time.monotonic()
+            next_cursor, records = await self._storage.scan_magazine_records(cursor=stats.cursor,
+                                                                             batch_size=self._batch_size)
+
+            migrated_records = []
+            for record in records:
+                states = migrate_magazine_states(record.states, self._mapping)
+                if states != record.states:
+                    migrated_records.append(MagazineRecord(chat=record.chat, user=record.user,
+                                                           states=states, version=record.version))
+            written = await self._storage.write_magazine_records(migrated_records)
+
+            stats.scanned_magazines += len(records)
+            stats.migrated_magazines += written
+            stats.conflicted_magazines += len(migrated_records) - written
+            stats.batches += 1
+            stats.cursor = next_cursor
+            logger.debug(f"Migrated {written} of {len(records)} magazines in batch {stats.batches} "
+                         f"(next cursor: {next_cursor})!")
+
+            if on_batch is not None:  # e.g. to save the cursor for resuming
+                result = on_batch(stats)
+                if inspect.isawaitable(result):
+                    await result
+            if next_cursor is None:
+                break
+
+            delay = self._min_batch_interval - (time.monotonic() - started_at)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        logger.info(f"Migration of magazines completed: {stats}!")
+
+        return stats
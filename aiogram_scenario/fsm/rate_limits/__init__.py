@@ -0,0 +1,11 @@
+from aiogram_scenario.helpers import make_lazy_module
+
+
+# backends are imported on first access, so unused ones (and their drivers) are never loaded
+make_lazy_module(globals(), {
+    "RateLimit": ".base",
+    "BaseTokenBuckets": ".base",
+    "TransitionsRateLimiter": ".limiter",
+    "MemoryTokenBuckets": ".memory",
+    "RedisTokenBuckets": ".redis"
+})
@@ -0,0 +1,24 @@
+from abc import ABC, abstractmethod
+from typing import Union
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class RateLimit:
+
+    rate: float  # tokens added per second
+    burst: int = 1  # capacity of the bucket, i.e. transitions allowed at once
+
+    def __post_init__(self):
+
+        if self.rate <= 0 or self.burst < 1:
+            raise ValueError(f"invalid rate limit ({self.rate=}, {self.burst=})!")
+
+
+class BaseTokenBuckets(ABC):
+
+    @abstractmethod
+    async def acquire(self, *, chat: Union[str, int], user: Union[str, int], name: str, limit: RateLimit) -> bool:
+
+        # takes a token from the bucket of the address, False if the bucket is empty
+        pass
@@ -0,0 +1,90 @@
+from typing import Optional, Dict, Tuple, Union, Callable, Awaitable
+import asyncio
+import logging
+
+from .base import BaseTokenBuckets, RateLimit
+from aiogram_scenario import exceptions
+
+
+logger = logging.getLogger(__name__)
+
+
+class TransitionsRateLimiter:
+
+    # Checked by the trigger before the machine touches the storage. A limit is looked up by the trigger name
+    # («back» for returns), then by the current state, then the default one is used; each found limit
+    # has its own bucket per address. Repeated requests of a transition that is still in progress
+    # are coalesced: they wait for it instead of executing it once more, do not take tokens and get its error.
+
+    def __init__(self, buckets: BaseTokenBuckets, *,
+                 default_limit: Optional[RateLimit] = None,
+                 triggers_limits: Optional[Dict[str, RateLimit]] = None,
+                 states_limits: Optional[Dict[Optional[str], RateLimit]] = None,
+                 coalesce: bool = True):
+
+        self._buckets = buckets
+        self._default_limit = default_limit
+        self._triggers_limits = triggers_limits or {}
+        self._states_limits = states_limits or {}
+        self._coalesce = coalesce
+        self._transitions_in_progress: Dict[Tuple, asyncio.Future] = {}
+
+    def get_limit(self, *, trigger: str, state: Optional[str] = None) -> Tuple[Optional[str], Optional[RateLimit]]:
+
+        # returns the name of the bucket and the limit
+        limit = self._triggers_limits.get(trigger)
+        if limit is not None:
+            return f"trigger:{trigger}", limit
+        limit = self._states_limits.get(state)
+        if limit is not None:
+            return f"state:{state}", limit
+        if self._default_limit is not None:
+            return "default", self._default_limit
+
+        return None, None
+
+    def is_state_dependent(self, trigger: str) -> bool:
+
+        # the state has to be read only if it may select the limit
+        return bool(self._states_limits) and trigger not in self._triggers_limits
+
+    async def execute(self, transition: Callable[[], Awaitable[None]], *,
+                      chat: Union[str, int],
+                      user: Union[str, int],
+                      trigger: str,
+                      state: Optional[str] = None) -> None:
+
+        key = (chat, user, trigger)
+        transition_in_progress = self._transitions_in_progress.get(key) if self._coalesce else None
+        if transition_in_progress is not None:
+            logger.debug(f"Transition by trigger '{trigger}' is coalesced with the one in progress "
+                         f"(user_id={user}, chat_id={chat})!")
+            # the waiter gets the result of the first request, its error included, and can't cancel it
+            return await asyncio.shield(transition_in_progress)
+
+        if not self._coalesce:
+            return await self._execute(transition, chat=chat, user=user, trigger=trigger, state=state)
+
+        # registered before the token is taken, so concurrent duplicates are coalesced from the start
+        transition_in_progress = asyncio.ensure_future(self._execute(transition, chat=chat, user=user,
+                                                                     trigger=trigger, state=state))
+        self._transitions_in_progress[key] = transition_in_progress
+        try:
+            await transition_in_progress
+        finally:
+            if self._transitions_in_progress.get(key) is transition_in_progress:
+                del self._transitions_in_progress[key]
+
+    async def _execute(self, transition: Callable[[], Awaitable[None]], *,
+                       chat: Union[str, int],
+                       user: Union[str, int],
+                       trigger: str,
+                       state: Optional[str]) -> None:
+
+        bucket_name, limit = self.get_limit(trigger=trigger, state=state)
+        if limit is not None and not await self._buckets.acquire(chat=chat, user=user, name=bucket_name, limit=limit):
+            raise exceptions.transition.TransitionRateLimitError(f"transition by trigger '{trigger}' exceeds "
+                                                                 f"the rate limit {limit} (user_id={user}, "
+                                                                 f"chat_id={chat})!")
+
+        await transition()
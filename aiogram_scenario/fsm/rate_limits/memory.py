@@ -0,0 +1,38 @@
+from typing import Union, Dict, Tuple
+import time
+
+from .base import BaseTokenBuckets, RateLimit
+
+
+class MemoryTokenBuckets(BaseTokenBuckets):
+
+    # Only buckets that are not full are worth keeping: when there are too many of them,
+    # the refilled ones are dropped, as a new bucket starts full anyway.
+
+    def __init__(self, *, max_buckets: int = 100000):
+
+        self._max_buckets = max_buckets
+        self._buckets: Dict[Tuple, Tuple[float, float, float]] = {}  # key: (tokens, updated at, time to refill)
+
+    async def acquire(self, *, chat: Union[str, int], user: Union[str, int], name: str, limit: RateLimit) -> bool:
+
+        key = (chat, user, name)
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            tokens = float(limit.burst)
+        else:
+            tokens = min(limit.burst, bucket[0] + (now - bucket[1]) * limit.rate)
+
+        is_allowed = tokens >= 1
+        if is_allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now, now + (limit.burst - tokens) / limit.rate)
+        if len(self._buckets) > self._max_buckets:
+            self._drop_full_buckets(now)
+
+        return is_allowed
+
+    def _drop_full_buckets(self, now: float) -> None:
+
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if bucket[2] > now}
@@ -0,0 +1,46 @@
+from typing import Union
+import time
+
+from aiogram.contrib.fsm_storage import redis
+
+from .base import BaseTokenBuckets, RateLimit
+
+
+RATE_LIMIT_KEY = "rate_limit"
+
+# KEYS: bucket key; ARGV: rate, burst, now
+ACQUIRE_TOKEN_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or burst
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(now - updated_at, 0) * rate)
+local is_allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    is_allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', ARGV[3])
+redis.call('EXPIRE', KEYS[1], math.ceil((burst - tokens) / rate) + 1)
+return is_allowed
+"""
+
+
+class RedisTokenBuckets(BaseTokenBuckets):
+
+    # a bucket lives only until it is refilled, its key is of the address, so it shares the slot of the magazine
+
+    def __init__(self, storage: redis.RedisStorage2):
+
+        self._storage = storage
+
+    async def acquire(self, *, chat: Union[str, int], user: Union[str, int], name: str, limit: RateLimit) -> bool:
+
+        redis_ = await self._storage.redis()
+        is_allowed = await redis_.eval(ACQUIRE_TOKEN_SCRIPT,
+                                       keys=[self._storage.generate_key(chat, user, f"{RATE_LIMIT_KEY}:{name}")],
+                                       args=[limit.rate, limit.burst, time.time()])
+
+        return bool(int(is_allowed))
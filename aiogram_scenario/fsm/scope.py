@@ -0,0 +1,24 @@
+from typing import Optional, Tuple
+from enum import Enum
+
+
+class FSMScope(Enum):
+
+    USER_IN_CHAT = "user_in_chat"  # magazine and lock per (chat, user)
+    CHAT = "chat"  # one magazine and one lock per chat
+    USER = "user"  # one magazine and one lock per user (for all chats)
+
+
+def resolve_address(scope: FSMScope, *,
+                    chat_id: Optional[int] = None,
+                    user_id: Optional[int] = None) -> Tuple[Optional[int], Optional[int]]:
+
+    if chat_id is None and user_id is None:
+        raise ValueError("'user' or 'chat' parameter is required but no one is provided!")
+
+    if scope is FSMScope.CHAT:
+        chat_id = user_id = chat_id if chat_id is not None else user_id
+    elif scope is FSMScope.USER:
+        chat_id = user_id = user_id if user_id is not None else chat_id
+
+    return chat_id, user_id
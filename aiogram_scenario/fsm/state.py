@@ -1,11 +1,21 @@
 from abc import ABC, abstractmethod
 from typing import Optional
+import importlib
+import logging
+
+from aiogram_scenario import helpers
+
+
+logger = logging.getLogger(__name__)
 
 
 class AbstractState(ABC):
 
     __slots__ = ("name", "_is_initial")
 
+    independent_hooks: bool = False  # hooks can run concurrently with each other and the magazine commit
+    timeout: Optional[float] = None  # seconds of inactivity after which the user is returned to the initial state
+
     def __init__(self, is_initial: bool = False):
 
         self.name = self.__class__.__name__
@@ -33,6 +43,10 @@ class AbstractState(ABC):
 
         pass
 
+    async def process_exit_compensation(self, *args, **kwargs) -> None:
+
+        pass
+
     @abstractmethod
     def register_handlers(self, *args, **reg_kwargs) -> None:
 
@@ -50,3 +64,72 @@ class AbstractState(ABC):
             return None
         else:
             return str(self)
+
+
+class LazyState(AbstractState):
+
+    def __init__(self, reference: str, *,
+                 package: Optional[str] = None,
+                 is_initial: bool = False):
+
+        super().__init__(is_initial=is_initial)
+        self.name = reference.rsplit(":", 1)[-1]
+        self._reference = reference  # "module:ClassName", module may be relative to the package
+        self._package = package
+        self._state: Optional[AbstractState] = None
+
+    @property
+    def reference(self) -> str:
+
+        return self._reference
+
+    @property
+    def package(self) -> Optional[str]:
+
+        return self._package
+
+    @property
+    def is_loaded(self) -> bool:
+
+        return self._state is not None
+
+    @property
+    def state(self) -> AbstractState:
+
+        if self._state is None:
+            module_name, class_name = self._reference.rsplit(":", 1)
+            module = importlib.import_module(module_name, package=self._package)
+            self._state = getattr(module, class_name)(is_initial=self._is_initial)
+            logger.debug(f"State '{self}' is loaded from '{self._reference}'!")
+
+        return self._state
+
+    @property
+    def independent_hooks(self) -> bool:
+
+        return self.state.independent_hooks
+
+    @property
+    def timeout(self) -> Optional[float]:
+
+        return self.state.timeout
+
+    async def process_enter(self, *args, **kwargs) -> None:
+
+        method = self.state.process_enter
+        await method(*args, **helpers.get_existing_kwargs(method, check_varkw=True, **kwargs))
+
+    async def process_exit(self, *args, **kwargs) -> None:
+
+        method = self.state.process_exit
+        await method(*args, **helpers.get_existing_kwargs(method, check_varkw=True, **kwargs))
+
+    async def process_exit_compensation(self, *args, **kwargs) -> None:
+
+        method = self.state.process_exit_compensation
+        await method(*args, **helpers.get_existing_kwargs(method, check_varkw=True, **kwargs))
+
+    def register_handlers(self, *args, **reg_kwargs) -> None:
+
+        method = self.state.register_handlers
+        method(*args, **helpers.get_existing_kwargs(method, **reg_kwargs))
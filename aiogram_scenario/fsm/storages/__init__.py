@@ -1 +1,14 @@
-from .base import BaseStorage
+from aiogram_scenario.helpers import make_lazy_module
+
+
+# backends are imported on first access, so unused ones (and their drivers) are never loaded
+make_lazy_module(globals(), {
+    "BaseStorage": ".base",
+    "MemoryStorage": ".memory",
+    "RedisStorage": ".redis",
+    "RedisClusterStorage": ".redis_cluster",
+    "MongoStorage": ".mongo",
+    "ResilientStorage": ".resilient",
+    "FaultInjectingStorage": ".testing",
+    "StorageConformanceKit": ".testing"
+})
@@ -1,18 +1,36 @@
 from abc import ABC, abstractmethod
-from typing import Union, List, Optional
+from typing import Union, List, Optional, Tuple, NamedTuple, Any, Dict
+import asyncio
 import logging
 
 import aiogram
 
 from aiogram_scenario import exceptions
+from aiogram_scenario.fsm.scope import FSMScope, resolve_address
 
 
 logger = logging.getLogger(__name__)
 
 
+class MagazineRecord(NamedTuple):
+
+    chat: Union[str, int]
+    user: Union[str, int]
+    states: List[Optional[str]]
+    version: int
+
+
+class AddressRecord(NamedTuple):
+
+    states: List[Optional[str]]
+    version: int
+    data: Dict
+    bucket: Dict
+
+
 class Magazine:
 
-    __slots__ = ("_storage", "_user_id", "_chat_id", "_states")
+    __slots__ = ("_storage", "_user_id", "_chat_id", "_states", "_version")
 
     def __init__(self, storage: "BaseStorage", *,
                  user_id: Optional[int] = None,
@@ -25,6 +43,7 @@ class Magazine:
         self._user_id = user_id
         self._chat_id = chat_id
         self._states: Optional[List[Optional[str]]] = None
+        self._version: Optional[int] = None
 
     def __str__(self):
 
@@ -38,9 +57,14 @@ class Magazine:
 
     async def load(self) -> None:
 
-        self._states = await self._storage.get_magazine_states(chat=self._chat_id, user=self._user_id)
+        states, version = await self._storage.get_magazine_record(chat=self._chat_id, user=self._user_id)
+        self.set_record(states, version)
+
+    def set_record(self, states: List[Optional[str]], version: int) -> None:
+
+        self._states, self._version = states, version
 
-        logger.debug(f"States loaded into the magazine: {self._states}, "
+        logger.debug(f"States loaded into the magazine: {self._states} (version={self._version}), "
                      f"(user_id={self._user_id}, chat_id={self._chat_id})!")
 
     def set(self, state: Optional[str]) -> None:
@@ -54,24 +78,68 @@ class Magazine:
 
         logger.debug(f"Magazine set state: '{state}' (user_id={self._user_id}, chat_id={self._chat_id})!")
 
-    async def commit(self) -> None:
+    def replace(self, states: List[Optional[str]]) -> None:
+
+        # same result as calling «set» for each state on an empty magazine, but in linear time
+        new_states = []
+        states_indexes = {}
+        for state in states:
+            state_index = states_indexes.get(state)
+            if state_index is None:
+                states_indexes[state] = len(new_states)
+                new_states.append(state)
+            else:
+                for removed_state in new_states[state_index + 1:]:
+                    del states_indexes[removed_state]
+                del new_states[state_index + 1:]
+        self._states = new_states
+
+        logger.debug(f"Magazine replaced states: {self._states} (user_id={self._user_id}, chat_id={self._chat_id})!")
+
+    async def commit(self, *, compare_version: bool = False) -> None:
+
+        if compare_version:
+            if self._version is None:
+                raise exceptions.magazine.MagazineIsNotLoadedError("version was not loaded!")
+            self._version = await self._storage.compare_and_set_magazine_states(
+                chat=self._chat_id,
+                user=self._user_id,
+                states=self._states,
+                version=self._version
+            )
+        else:
+            self._version = await self._storage.set_magazine_states(chat=self._chat_id, user=self._user_id,
+                                                                    states=self._states)
+        logger.debug(f"Magazine has committed states {self._states} (version={self._version}) to storage "
+                     f"(user_id={self._user_id}, chat_id={self._chat_id})!")
+
+    async def restore(self, states: List[Optional[str]], *,
+                      commit: bool = True,
+                      compare_version: bool = False) -> None:
 
-        await self._storage.set_magazine_states(chat=self._chat_id, user=self._user_id, states=self._states)
-        logger.debug(f"Magazine has committed states {self._states} to storage "
+        self._states = states.copy()
+        if commit:
+            await self.commit(compare_version=compare_version)
+        logger.debug(f"Magazine restored states {self._states} "
                      f"(user_id={self._user_id}, chat_id={self._chat_id})!")
 
-    async def push(self, state: Optional[str]) -> None:
+    async def push(self, state: Optional[str], *, compare_version: bool = False) -> None:
 
         if not self.is_loaded:
             await self.load()
         self.set(state)
-        await self.commit()
+        await self.commit(compare_version=compare_version)
 
     @property
     def is_loaded(self) -> bool:
 
         return self._states is not None
 
+    @property
+    def version(self) -> Optional[int]:
+
+        return self._version
+
     @property
     def states(self) -> List[Optional[str]]:
 
@@ -97,20 +165,93 @@ class Magazine:
 
 class BaseStorage(aiogram.dispatcher.storage.BaseStorage, ABC):
 
+    # the scope is fixed on creation, as a storage may be shared by several machines
+    _scope: FSMScope = FSMScope.USER_IN_CHAT
+
+    def __init__(self, *args, scope: FSMScope = FSMScope.USER_IN_CHAT, **kwargs):
+
+        super().__init__(*args, **kwargs)
+        self._scope = scope
+
+    @property
+    def scope(self) -> FSMScope:
+
+        return self._scope
+
+    def resolve_scope_address(self, *, chat: Union[str, int, None] = None,
+                              user: Union[str, int, None] = None) -> Tuple[Union[str, int], Union[str, int]]:
+
+        chat, user = resolve_address(self._scope, chat_id=chat, user_id=user)
+        return self.check_address(chat=chat, user=user)
+
     @abstractmethod
     async def set_magazine_states(self, *, chat: Union[str, int, None] = None,
                                   user: Union[str, int, None] = None,
-                                  states: List[Optional[str]]) -> None:
+                                  states: List[Optional[str]]) -> int:
 
         pass
 
     @abstractmethod
+    async def compare_and_set_magazine_states(self, *, chat: Union[str, int, None] = None,
+                                              user: Union[str, int, None] = None,
+                                              states: List[Optional[str]],
+                                              version: int) -> int:
+
+        pass
+
+    @abstractmethod
+    async def get_magazine_record(self, *, chat: Union[str, int, None] = None,
+                                  user: Union[str, int, None] = None) -> Tuple[List[Optional[str]], int]:
+
+        pass
+
     async def get_magazine_states(self, *, chat: Union[str, int, None] = None,
                                   user: Union[str, int, None] = None) -> List[Optional[str]]:
 
-        pass
+        states, _ = await self.get_magazine_record(chat=chat, user=user)
+        return states
 
     def get_magazine(self, *, chat: Union[str, int, None] = None,
                      user: Union[str, int, None] = None) -> Magazine:
 
         return Magazine(self, user_id=user, chat_id=chat)
+
+    async def scan_magazine_records(self, *, cursor: Any = None,
+                                    batch_size: int = 100) -> Tuple[Any, List[MagazineRecord]]:
+
+        # returns the cursor of the next batch (None when the scan is over) and records of the current one
+        raise NotImplementedError(f"{self.__class__.__name__} does not support scanning of magazines!")
+
+    async def write_magazine_records(self, records: List[MagazineRecord]) -> int:
+
+        # records are written only if their versions are still actual, the number of written ones is returned
+        raise NotImplementedError(f"{self.__class__.__name__} does not support batch writing of magazines!")
+
+    async def get_address_record(self, *, chat: Union[str, int, None] = None,
+                                 user: Union[str, int, None] = None,
+                                 magazine_chat: Union[str, int, None] = None,
+                                 magazine_user: Union[str, int, None] = None) -> AddressRecord:
+
+        # The magazine is read by its own address when it is shared by the scope (by the one of the record
+        # if it is not passed), backends override it to read everything in a single round trip.
+        if magazine_chat is None and magazine_user is None:
+            magazine_chat, magazine_user = chat, user
+
+        reads = [self.get_magazine_record(chat=magazine_chat, user=magazine_user), self.get_data(chat=chat, user=user)]
+        if self.has_bucket():
+            reads.append(self.get_bucket(chat=chat, user=user))
+        (states, version), data, *bucket = await asyncio.gather(*reads)
+        return AddressRecord(states=states, version=version, data=data, bucket=bucket[0] if bucket else {})
+
+    async def set_address_record(self, *, chat: Union[str, int, None] = None,
+                                 user: Union[str, int, None] = None,
+                                 data: Optional[Dict] = None,
+                                 bucket: Optional[Dict] = None) -> None:
+
+        # only passed fields are written, backends override it to write them in a single round trip
+        writes = []
+        if data is not None:
+            writes.append(self.set_data(chat=chat, user=user, data=data))
+        if bucket is not None:
+            writes.append(self.set_bucket(chat=chat, user=user, bucket=bucket))
+        await asyncio.gather(*writes)
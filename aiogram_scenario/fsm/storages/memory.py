@@ -1,8 +1,17 @@
-from typing import Union, List, AnyStr, Optional
+from typing import Union, List, AnyStr, Optional, Tuple, Any
+from dataclasses import dataclass, field
 
 from aiogram.contrib.fsm_storage import memory
 
-from aiogram_scenario.fsm.storages.base import BaseStorage
+from aiogram_scenario.fsm.storages.base import BaseStorage, MagazineRecord
+from aiogram_scenario import exceptions
+
+
+@dataclass(frozen=True)
+class _ScanCursor:
+
+    addresses: List[Tuple[str, str]] = field(repr=False)
+    offset: int = 0
 
 
 class MemoryStorage(BaseStorage, memory.MemoryStorage):
@@ -13,7 +22,7 @@ class MemoryStorage(BaseStorage, memory.MemoryStorage):
         if chat_id not in self.data:
             self.data[chat_id] = {}
         if user_id not in self.data[chat_id]:
-            self.data[chat_id][user_id] = {"magazine": [None], "data": {}, "bucket": {}}
+            self.data[chat_id][user_id] = {"magazine": [None], "magazine_version": 0, "data": {}, "bucket": {}}
 
         return chat_id, user_id
 
@@ -22,7 +31,7 @@ class MemoryStorage(BaseStorage, memory.MemoryStorage):
                         user: Union[str, int, None] = None,
                         state: Optional[AnyStr] = None):
 
-        chat, user = self.resolve_address(chat=chat, user=user)
+        chat, user = self.resolve_scope_address(chat=chat, user=user)
         magazine = self.get_magazine(chat=chat, user=user)
         await magazine.push(state)
 
@@ -31,20 +40,75 @@ class MemoryStorage(BaseStorage, memory.MemoryStorage):
                         user: Union[str, int, None] = None,
                         default: Optional[str] = None) -> Optional[str]:
 
-        chat, user = self.resolve_address(chat=chat, user=user)
+        chat, user = self.resolve_scope_address(chat=chat, user=user)
         magazine = self.get_magazine(user=user, chat=chat)
         await magazine.load()
         return magazine.current_state
 
     async def set_magazine_states(self, *, chat: Union[str, int, None] = None,
                                   user: Union[str, int, None] = None,
-                                  states: List[Optional[str]]) -> None:
+                                  states: List[Optional[str]]) -> int:
+
+        chat, user = self.resolve_address(chat=chat, user=user)
+        record = self.data[chat][user]
+        record["magazine"] = states.copy()
+        record["magazine_version"] = record.get("magazine_version", 0) + 1
+
+        return record["magazine_version"]
+
+    async def compare_and_set_magazine_states(self, *, chat: Union[str, int, None] = None,
+                                              user: Union[str, int, None] = None,
+                                              states: List[Optional[str]],
+                                              version: int) -> int:
 
         chat, user = self.resolve_address(chat=chat, user=user)
-        self.data[chat][user]["magazine"] = states.copy()
+        record = self.data[chat][user]
+        current_version = record.get("magazine_version", 0)
+        if current_version != version:
+            raise exceptions.magazine.MagazineVersionConflictError(
+                f"magazine version {version} is outdated, current is {current_version} ({user=}, {chat=})!"
+            )
+        record["magazine"] = states.copy()
+        record["magazine_version"] = current_version + 1
+
+        return record["magazine_version"]
 
-    async def get_magazine_states(self, *, chat: Union[str, int, None] = None,
-                                  user: Union[str, int, None] = None) -> List[Optional[str]]:
+    async def get_magazine_record(self, *, chat: Union[str, int, None] = None,
+                                  user: Union[str, int, None] = None) -> Tuple[List[Optional[str]], int]:
 
         chat, user = self.resolve_address(chat=chat, user=user)
-        return self.data[chat][user]["magazine"].copy()
+        record = self.data[chat][user]
+        return record["magazine"].copy(), record.get("magazine_version", 0)
+
+    async def scan_magazine_records(self, *, cursor: Any = None,
+                                    batch_size: int = 100) -> Tuple[Any, List[MagazineRecord]]:
+
+        # the addresses are listed once per scan, the cursor carries them to the next batches
+        # (an offset, e.g. a saved one, starts a new listing)
+        if not isinstance(cursor, _ScanCursor):
+            cursor = _ScanCursor(addresses=[(chat, user) for chat, users in self.data.items() for user in users.keys()],
+                                 offset=cursor or 0)
+        batch_end = cursor.offset + batch_size
+        records = [
+            MagazineRecord(chat=chat, user=user, states=self.data[chat][user]["magazine"].copy(),
+                           version=self.data[chat][user].get("magazine_version", 0))
+            for chat, user in cursor.addresses[cursor.offset:batch_end]
+            if user in self.data.get(chat, {})  # may be reset during the scan
+        ]
+        next_cursor = _ScanCursor(addresses=cursor.addresses, offset=batch_end) \
+            if batch_end < len(cursor.addresses) else None
+
+        return next_cursor, records
+
+    async def write_magazine_records(self, records: List[MagazineRecord]) -> int:
+
+        written = 0
+        for record in records:
+            try:
+                await self.compare_and_set_magazine_states(chat=record.chat, user=record.user,
+                                                           states=record.states, version=record.version)
+            except exceptions.magazine.MagazineVersionConflictError:
+                continue
+            written += 1
+
+        return written
@@ -1,9 +1,12 @@
-from typing import Union, List, Optional, AnyStr
+from typing import Union, List, Optional, AnyStr, Tuple, Any
 
 from aiogram.contrib.fsm_storage import mongo
 from aiogram.contrib.fsm_storage.mongo import DATA, BUCKET
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 
-from aiogram_scenario.fsm.storages.base import BaseStorage
+from aiogram_scenario.fsm.storages.base import BaseStorage, MagazineRecord
+from aiogram_scenario import exceptions
 
 
 MAGAZINE = "aiogram_magazine"
@@ -16,7 +19,7 @@ class MongoStorage(BaseStorage, mongo.MongoStorage):
                         user: Union[str, int, None] = None,
                         state: Optional[AnyStr] = None):
 
-        chat, user = self.check_address(chat=chat, user=user)
+        chat, user = self.resolve_scope_address(chat=chat, user=user)
         magazine = self.get_magazine(user=user, chat=chat)
         await magazine.push(state)
 
@@ -24,27 +27,81 @@ class MongoStorage(BaseStorage, mongo.MongoStorage):
                         user: Union[str, int, None] = None,
                         default: Optional[str] = None) -> Optional[str]:
 
-        chat, user = self.check_address(chat=chat, user=user)
+        chat, user = self.resolve_scope_address(chat=chat, user=user)
         magazine = self.get_magazine(user=user, chat=chat)
         await magazine.load()
         return magazine.current_state
 
     async def set_magazine_states(self, *, chat: Union[str, int, None] = None,
                                   user: Union[str, int, None] = None,
-                                  states: List[Optional[str]]) -> None:
+                                  states: List[Optional[str]]) -> int:
 
         chat, user = self.check_address(chat=chat, user=user)
         db = await self.get_db()
-        await db[MAGAZINE].update_one(filter={'chat': chat, 'user': user},
-                                      update={'$set': {'magazine': states}}, upsert=True)
+        result = await db[MAGAZINE].find_one_and_update(filter={'chat': chat, 'user': user},
+                                                        update={'$set': {'magazine': states},
+                                                                '$inc': {'version': 1}},
+                                                        upsert=True, return_document=ReturnDocument.AFTER)
+        return result['version']
 
-    async def get_magazine_states(self, *, chat: Union[str, int, None] = None,
-                                  user: Union[str, int, None] = None) -> List[Optional[str]]:
+    async def compare_and_set_magazine_states(self, *, chat: Union[str, int, None] = None,
+                                              user: Union[str, int, None] = None,
+                                              states: List[Optional[str]],
+                                              version: int) -> int:
+
+        chat, user = self.check_address(chat=chat, user=user)
+        db = await self.get_db()
+        # documents written before versioning have no 'version' field and are treated as version 0
+        version_filter = version if version else {'$in': [0, None]}
+        try:
+            result = await db[MAGAZINE].update_one(filter={'chat': chat, 'user': user, 'version': version_filter},
+                                                   update={'$set': {'magazine': states, 'version': version + 1}},
+                                                   upsert=not version)
+        except DuplicateKeyError:  # the document exists, but with a different version
+            result = None
+
+        if result is None or (result.matched_count == 0 and result.upserted_id is None):
+            raise exceptions.magazine.MagazineVersionConflictError(
+                f"magazine version {version} is outdated ({user=}, {chat=})!"
+            )
+
+        return version + 1
+
+    async def get_magazine_record(self, *, chat: Union[str, int, None] = None,
+                                  user: Union[str, int, None] = None) -> Tuple[List[Optional[str]], int]:
 
         chat, user = self.check_address(chat=chat, user=user)
         db = await self.get_db()
         result = await db[MAGAZINE].find_one(filter={'chat': chat, 'user': user})
-        return result.get('magazine') if result else [None]
+        if result:
+            return result.get('magazine'), result.get('version', 0)
+        return [None], 0
+
+    async def scan_magazine_records(self, *, cursor: Any = None,
+                                    batch_size: int = 100) -> Tuple[Any, List[MagazineRecord]]:
+
+        db = await self.get_db()
+        query = {} if cursor is None else {'_id': {'$gt': cursor}}
+        documents = await db[MAGAZINE].find(query).sort('_id', 1).limit(batch_size).to_list(length=batch_size)
+        records = [MagazineRecord(chat=i['chat'], user=i['user'], states=i.get('magazine'), version=i.get('version', 0))
+                   for i in documents]
+        next_cursor = documents[-1]['_id'] if len(documents) == batch_size else None
+
+        return next_cursor, records
+
+    async def write_magazine_records(self, records: List[MagazineRecord]) -> int:
+
+        if not records:
+            return 0
+
+        db = await self.get_db()
+        # documents written before versioning have no 'version' field and are treated as version 0
+        requests = [UpdateOne(filter={'chat': i.chat, 'user': i.user, 'version': i.version or {'$in': [0, None]}},
+                              update={'$set': {'magazine': i.states, 'version': i.version + 1}})
+                    for i in records]
+        result = await db[MAGAZINE].bulk_write(requests, ordered=False)
+
+        return result.modified_count
 
     async def reset_all(self, full=True):
 
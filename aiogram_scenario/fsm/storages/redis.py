@@ -1,12 +1,43 @@
-from typing import Union, List, Optional, AnyStr
+from typing import Union, List, Optional, AnyStr, Tuple, Any, Dict
 
 from aiogram.contrib.fsm_storage import redis
 from aiogram.utils import json
 
-from aiogram_scenario.fsm.storages.base import BaseStorage
+from aiogram_scenario.fsm.storages.base import BaseStorage, MagazineRecord, AddressRecord
+from aiogram_scenario import exceptions
 
 
 STATE_MAGAZINE_KEY = "magazine"
+STATE_MAGAZINE_VERSION_KEY = "magazine_version"
+
+# KEYS: magazine key, version key; ARGV: states, ttl (0 - without expiration)
+SET_MAGAZINE_SCRIPT = """
+local version = redis.call('INCR', KEYS[2])
+if tonumber(ARGV[2]) > 0 then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+    redis.call('EXPIRE', KEYS[2], ARGV[2])
+else
+    redis.call('SET', KEYS[1], ARGV[1])
+end
+return version
+"""
+
+# KEYS: magazine key, version key; ARGV: states, ttl (0 - without expiration), expected version
+COMPARE_AND_SET_MAGAZINE_SCRIPT = """
+local version = tonumber(redis.call('GET', KEYS[2]) or '0')
+if version ~= tonumber(ARGV[3]) then
+    return -1
+end
+version = version + 1
+if tonumber(ARGV[2]) > 0 then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+    redis.call('SET', KEYS[2], version, 'EX', ARGV[2])
+else
+    redis.call('SET', KEYS[1], ARGV[1])
+    redis.call('SET', KEYS[2], version)
+end
+return version
+"""
 
 
 class RedisStorage(BaseStorage, redis.RedisStorage2):
@@ -15,7 +46,7 @@ class RedisStorage(BaseStorage, redis.RedisStorage2):
                         user: Union[str, int, None] = None,
                         state: Optional[AnyStr] = None):
 
-        chat, user = self.check_address(chat=chat, user=user)
+        chat, user = self.resolve_scope_address(chat=chat, user=user)
         magazine = self.get_magazine(chat=chat, user=user)
         await magazine.push(state)
 
@@ -23,27 +54,141 @@ class RedisStorage(BaseStorage, redis.RedisStorage2):
                         user: Union[str, int, None] = None,
                         default: Optional[str] = None) -> Optional[str]:
 
-        chat, user = self.check_address(chat=chat, user=user)
+        chat, user = self.resolve_scope_address(chat=chat, user=user)
         magazine = self.get_magazine(user=user, chat=chat)
         await magazine.load()
         return magazine.current_state
 
     async def set_magazine_states(self, *, chat: Union[str, int, None] = None,
                                   user: Union[str, int, None] = None,
-                                  states: List[Optional[str]]) -> None:
+                                  states: List[Optional[str]]) -> int:
 
         chat, user = self.check_address(chat=chat, user=user)
-        key = self.generate_key(chat, user, STATE_MAGAZINE_KEY)
         redis_ = await self.redis()
-        await redis_.set(key, json.dumps(states), expire=self._state_ttl)
+        version = await redis_.eval(SET_MAGAZINE_SCRIPT,
+                                    keys=self._get_magazine_keys(chat, user),
+                                    args=[json.dumps(states), self._state_ttl or 0])
+        return int(version)
 
-    async def get_magazine_states(self, *, chat: Union[str, int, None] = None,
-                                  user: Union[str, int, None] = None) -> List[Optional[str]]:
+    async def compare_and_set_magazine_states(self, *, chat: Union[str, int, None] = None,
+                                              user: Union[str, int, None] = None,
+                                              states: List[Optional[str]],
+                                              version: int) -> int:
 
         chat, user = self.check_address(chat=chat, user=user)
-        key = self.generate_key(chat, user, STATE_MAGAZINE_KEY)
         redis_ = await self.redis()
-        raw_result = await redis_.get(key, encoding='utf8')
-        if raw_result:
-            return json.loads(raw_result)
-        return [None]
+        new_version = int(await redis_.eval(COMPARE_AND_SET_MAGAZINE_SCRIPT,
+                                            keys=self._get_magazine_keys(chat, user),
+                                            args=[json.dumps(states), self._state_ttl or 0, version]))
+        if new_version == -1:
+            raise exceptions.magazine.MagazineVersionConflictError(
+                f"magazine version {version} is outdated ({user=}, {chat=})!"
+            )
+
+        return new_version
+
+    async def get_magazine_record(self, *, chat: Union[str, int, None] = None,
+                                  user: Union[str, int, None] = None) -> Tuple[List[Optional[str]], int]:
+
+        chat, user = self.check_address(chat=chat, user=user)
+        return await self._read_magazine_record(await self.redis(), chat, user)
+
+    async def scan_magazine_records(self, *, cursor: Any = None,
+                                    batch_size: int = 100) -> Tuple[Any, List[MagazineRecord]]:
+
+        next_cursor, records = await self._scan_magazine_records(await self.redis(), cursor or 0, batch_size)
+        return (next_cursor or None), records
+
+    async def write_magazine_records(self, records: List[MagazineRecord]) -> int:
+
+        if not records:
+            return 0
+
+        redis_ = await self.redis()
+        pipeline = redis_.pipeline()
+        for record in records:
+            pipeline.eval(COMPARE_AND_SET_MAGAZINE_SCRIPT,
+                          keys=self._get_magazine_keys(record.chat, record.user),
+                          args=[json.dumps(record.states), self._state_ttl or 0, record.version])
+
+        return sum(int(version) != -1 for version in await pipeline.execute())
+
+    async def get_address_record(self, *, chat: Union[str, int, None] = None,
+                                 user: Union[str, int, None] = None,
+                                 magazine_chat: Union[str, int, None] = None,
+                                 magazine_user: Union[str, int, None] = None) -> AddressRecord:
+
+        chat, user = self.check_address(chat=chat, user=user)
+        if magazine_chat is None and magazine_user is None:
+            magazine_chat, magazine_user = chat, user
+        else:
+            magazine_chat, magazine_user = self.check_address(chat=magazine_chat, user=magazine_user)
+        redis_ = await self.redis()
+        raw_states, raw_version, raw_data, raw_bucket = await redis_.mget(
+            *self._get_magazine_keys(magazine_chat, magazine_user),
+            self.generate_key(chat, user, redis.STATE_DATA_KEY),
+            self.generate_key(chat, user, redis.STATE_BUCKET_KEY),
+            encoding='utf8'
+        )
+        return AddressRecord(states=json.loads(raw_states) if raw_states else [None],
+                             version=int(raw_version) if raw_version else 0,
+                             data=json.loads(raw_data) if raw_data else {},
+                             bucket=json.loads(raw_bucket) if raw_bucket else {})
+
+    async def set_address_record(self, *, chat: Union[str, int, None] = None,
+                                 user: Union[str, int, None] = None,
+                                 data: Optional[Dict] = None,
+                                 bucket: Optional[Dict] = None) -> None:
+
+        chat, user = self.check_address(chat=chat, user=user)
+        redis_ = await self.redis()
+        transaction = redis_.multi_exec()
+        for key, value, ttl in ((redis.STATE_DATA_KEY, data, self._data_ttl),
+                                (redis.STATE_BUCKET_KEY, bucket, self._bucket_ttl)):
+            if value is None:  # not changed
+                continue
+            key = self.generate_key(chat, user, key)
+            if value:
+                transaction.set(key, json.dumps(value), expire=ttl or 0)
+            else:
+                transaction.delete(key)
+        await transaction.execute()
+
+    async def _scan_magazine_records(self, redis_, cursor: int,
+                                     batch_size: int) -> Tuple[int, List[MagazineRecord]]:
+
+        # SCAN walks the keys of a single node, the records are read from the same one
+        next_cursor, keys = await redis_.scan(cursor, match=self.generate_key("*", "*", STATE_MAGAZINE_KEY),
+                                              count=batch_size)
+        addresses = [self._parse_magazine_key(key.decode() if isinstance(key, bytes) else key) for key in keys]
+
+        records = []
+        if addresses:
+            pipeline = redis_.pipeline()
+            for chat, user in addresses:
+                pipeline.mget(*self._get_magazine_keys(chat, user), encoding='utf8')
+            for (chat, user), (raw_states, raw_version) in zip(addresses, await pipeline.execute()):
+                if raw_states:  # the key may expire between the scan and the reading
+                    records.append(MagazineRecord(chat=chat, user=user, states=json.loads(raw_states),
+                                                  version=int(raw_version) if raw_version else 0))
+
+        return int(next_cursor), records
+
+    async def _read_magazine_record(self, redis_, chat: Union[str, int],
+                                    user: Union[str, int]) -> Tuple[List[Optional[str]], int]:
+
+        raw_states, raw_version = await redis_.mget(*self._get_magazine_keys(chat, user), encoding='utf8')
+        states = json.loads(raw_states) if raw_states else [None]
+        version = int(raw_version) if raw_version else 0
+        return states, version
+
+    @staticmethod
+    def _parse_magazine_key(key: str) -> Tuple[str, str]:
+
+        _, chat, user, _ = key.rsplit(":", 3)
+        return chat, user
+
+    def _get_magazine_keys(self, chat: Union[str, int], user: Union[str, int]) -> List[str]:
+
+        return [self.generate_key(chat, user, STATE_MAGAZINE_KEY),
+                self.generate_key(chat, user, STATE_MAGAZINE_VERSION_KEY)]
@@ -0,0 +1,187 @@
+from typing import Union, Optional, Tuple, Sequence, Any, List
+import asyncio
+
+from aiogram_scenario.fsm.storages.base import BaseStorage, MagazineRecord, AddressRecord
+from aiogram_scenario.fsm.storages.redis import RedisStorage
+
+
+ADDRESS_KEY_PARTS_NUMBER = 3  # chat, user, field
+
+
+class RedisClusterStorage(RedisStorage):
+
+    # All keys of an address (magazine, its version, data and bucket) share a hash tag, so they are kept
+    # in one slot of Redis Cluster: scripts, MGET and transactions over them remain valid there.
+    # Connections are made to a cluster (by «aioredis_cluster»), to Sentinel-monitored nodes,
+    # or to a single node as «RedisStorage» does.
+
+    def __init__(self, *args,
+                 cluster_nodes: Optional[Sequence] = None,
+                 sentinels: Optional[Sequence] = None,
+                 service_name: Optional[str] = None,
+                 read_from_replicas: bool = False,
+                 pool_min_size: int = 1,
+                 pool_max_size: int = 10,
+                 connect_timeout: Optional[float] = None,
+                 **kwargs):
+
+        if cluster_nodes is not None and sentinels is not None:
+            raise ValueError("cluster nodes and sentinels cannot be used together!")
+        if sentinels is not None and service_name is None:
+            raise ValueError("service name of the sentinels is not specified!")
+
+        if cluster_nodes is None and sentinels is None:
+            # a single node is connected by «RedisStorage», its pool always starts with one connection
+            if pool_min_size != 1:
+                raise ValueError("minimal pool size is supported only with cluster nodes or sentinels!")
+            kwargs.setdefault("pool_size", pool_max_size)
+            if connect_timeout is not None:
+                kwargs.setdefault("create_connection_timeout", connect_timeout)
+
+        super().__init__(*args, **kwargs)
+        self._cluster_nodes = cluster_nodes
+        self._sentinels = sentinels
+        self._service_name = service_name
+        self._read_from_replicas = read_from_replicas
+        self._pool_min_size = pool_min_size
+        self._pool_max_size = pool_max_size
+        self._connect_timeout = connect_timeout
+        self._sentinel = None
+        self._master = None
+        self._replica = None
+        self._connections_lock: Optional[asyncio.Lock] = None
+
+    async def redis(self):
+
+        if self._cluster_nodes is None and self._sentinels is None:
+            return await super().redis()
+
+        async with self._get_connections_lock():
+            if self._master is None or self._master.closed:
+                self._master = await self._create_master()
+
+        return self._master
+
+    async def replica(self):
+
+        # falls back to the master when reading from replicas is disabled or there are no replicas
+        if not self._read_from_replicas or self._sentinels is None:
+            return await self.redis()
+
+        async with self._get_connections_lock():
+            if self._replica is None or self._replica.closed:
+                sentinel = await self._get_sentinel()
+                self._replica = sentinel.slave_for(self._service_name)
+
+        return self._replica
+
+    async def get_state(self, *, chat: Union[str, int, None] = None,
+                        user: Union[str, int, None] = None,
+                        default: Optional[str] = None) -> Optional[str]:
+
+        # a replica may lag behind, so only this read goes there: transitions still load magazines from the master
+        if not self._read_from_replicas:
+            return await super().get_state(chat=chat, user=user, default=default)
+
+        chat, user = self.resolve_scope_address(chat=chat, user=user)
+        states, _ = await self._read_magazine_record(await self.replica(), chat, user)
+        return states[-1]
+
+    async def get_address_record(self, *, chat: Union[str, int, None] = None,
+                                 user: Union[str, int, None] = None,
+                                 magazine_chat: Union[str, int, None] = None,
+                                 magazine_user: Union[str, int, None] = None) -> AddressRecord:
+
+        # keys of a magazine shared by the scope are in another slot, so they can't be read by the same MGET
+        if self._cluster_nodes is not None and (magazine_chat, magazine_user) not in ((None, None), (chat, user)):
+            return await BaseStorage.get_address_record(self, chat=chat, user=user,
+                                                        magazine_chat=magazine_chat, magazine_user=magazine_user)
+
+        return await super().get_address_record(chat=chat, user=user,
+                                                magazine_chat=magazine_chat, magazine_user=magazine_user)
+
+    async def scan_magazine_records(self, *, cursor: Any = None,
+                                    batch_size: int = 100) -> Tuple[Any, List[MagazineRecord]]:
+
+        if self._cluster_nodes is None:  # a single master
+            return await super().scan_magazine_records(cursor=cursor, batch_size=batch_size)
+
+        # SCAN walks a single node, so the masters are scanned one by one: the cursor is (master index, node cursor)
+        masters = sorted(await (await self.redis()).all_masters(), key=lambda master: str(master.address))
+        master_index, node_cursor = cursor or (0, 0)
+        node_cursor, records = await self._scan_magazine_records(masters[master_index], node_cursor, batch_size)
+        if node_cursor == 0:
+            master_index += 1
+        next_cursor = (master_index, node_cursor) if master_index < len(masters) else None
+
+        return next_cursor, records
+
+    def generate_key(self, *parts) -> str:
+
+        if len(parts) != ADDRESS_KEY_PARTS_NUMBER:
+            return super().generate_key(*parts)
+
+        chat, user, field = parts
+        return ":".join((*self._prefix, f"{{{chat}:{user}}}", str(field)))
+
+    async def close(self):
+
+        for connection in (self._master, self._replica, self._sentinel):
+            if connection is not None:
+                connection.close()
+
+        if self._cluster_nodes is None and self._sentinels is None:
+            await super().close()
+
+    async def wait_closed(self):
+
+        for connection in (self._master, self._replica, self._sentinel):
+            if connection is not None:
+                await connection.wait_closed()
+        self._master = self._replica = self._sentinel = None
+
+        if self._cluster_nodes is None and self._sentinels is None:
+            await super().wait_closed()
+
+    @staticmethod
+    def _parse_magazine_key(key: str) -> Tuple[str, str]:
+
+        chat, user = key[key.index("{") + 1:key.rindex("}")].split(":", 1)
+        return chat, user
+
+    async def _create_master(self):
+
+        if self._cluster_nodes is not None:
+            try:
+                import aioredis_cluster
+            except ImportError:
+                raise ImportError("«aioredis_cluster» is required to connect to Redis Cluster!") from None
+
+            return await aioredis_cluster.create_redis_cluster(self._cluster_nodes,
+                                                               pool_minsize=self._pool_min_size,
+                                                               pool_maxsize=self._pool_max_size,
+                                                               connect_timeout=self._connect_timeout)
+
+        sentinel = await self._get_sentinel()
+        return sentinel.master_for(self._service_name)
+
+    async def _get_sentinel(self):
+
+        if self._sentinel is None:
+            import aioredis.sentinel
+
+            self._sentinel = await aioredis.sentinel.create_sentinel(self._sentinels,
+                                                                     minsize=self._pool_min_size,
+                                                                     maxsize=self._pool_max_size,
+                                                                     timeout=self._connect_timeout)
+
+        return self._sentinel
+
+    def _get_connections_lock(self) -> asyncio.Lock:
+
+        # created lazily to be bound to the running loop
+        if self._connections_lock is None:
+            self._connections_lock = asyncio.Lock()
+
+        return self._connections_lock
+
@@ -0,0 +1,379 @@
+from typing import Union, List, Optional, Tuple, Any, Dict, AnyStr, Type, Callable, Awaitable
+from dataclasses import dataclass
+import asyncio
+import logging
+import random
+import time
+
+from aiogram_scenario.fsm.storages.base import BaseStorage, MagazineRecord, AddressRecord
+from aiogram_scenario.fsm.scope import FSMScope
+from aiogram_scenario import exceptions
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_RETRY_EXCEPTIONS = (OSError, asyncio.TimeoutError)  # connection errors of the drivers are based on OSError
+
+
+@dataclass()
+class StorageMetrics:
+
+    calls: int = 0
+    failures: int = 0  # failed attempts, including retried ones
+    retries: int = 0
+    timeouts: int = 0
+    rejections: int = 0  # calls failed fast by the open circuit
+    in_flight: int = 0
+    max_in_flight: int = 0
+    waiting: int = 0  # calls waiting for a free slot when the concurrency is limited
+    total_wait_time: float = 0.0
+
+
+class CircuitBreaker:
+
+    # Opens after «failure_threshold» consecutive failures; once «reset_timeout» passes, one trial call
+    # is let through (half-open): its success closes the circuit, its failure opens it again.
+    # A trial call that never reported back (e.g. cancelled) is replaced by another one after «reset_timeout».
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, *, failure_threshold: int = 5, reset_timeout: float = 30.0):
+
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_started_at: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at >= self._reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow_call(self) -> bool:
+
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN:
+            now = time.monotonic()
+            if self._trial_started_at is None or now - self._trial_started_at >= self._reset_timeout:
+                self._trial_started_at = now
+                return True
+        return False
+
+    def record_success(self) -> None:
+
+        if self._opened_at is not None:
+            logger.info("Storage circuit is closed!")
+        self._failures = 0
+        self._opened_at = None
+        self._trial_started_at = None
+
+    def record_failure(self) -> None:
+
+        self._failures += 1
+        if self._opened_at is not None or self._failures >= self._failure_threshold:
+            if self._opened_at is None:
+                logger.warning(f"Storage circuit is opened after {self._failures} consecutive failures!")
+            self._opened_at = time.monotonic()
+            self._trial_started_at = None
+
+
+class ResilientStorage(BaseStorage):
+
+    # Wraps any storage: calls are limited by a timeout, failures of «retry_exceptions» are retried
+    # with exponential backoff and full jitter, and a circuit breaker fails calls fast while the backend is down.
+    # States are handled by magazines of the wrapper, so their loads and commits are retried one by one.
+
+    def __init__(self, storage: BaseStorage, *,
+                 retries: int = 2,
+                 retry_exceptions: Tuple[Type[BaseException], ...] = DEFAULT_RETRY_EXCEPTIONS,
+                 backoff_base: float = 0.05,
+                 backoff_max: float = 1.0,
+                 call_timeout: Optional[float] = 5.0,
+                 max_concurrency: Optional[int] = None,
+                 circuit_breaker: Optional[CircuitBreaker] = None):
+
+        self._storage = storage
+        self._retries = retries
+        self._retry_exceptions = retry_exceptions
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._call_timeout = call_timeout
+        self._max_concurrency = max_concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._circuit_breaker = circuit_breaker or CircuitBreaker()
+        self._metrics = StorageMetrics()
+
+    @property
+    def storage(self) -> BaseStorage:
+
+        return self._storage
+
+    @property
+    def circuit_breaker(self) -> CircuitBreaker:
+
+        return self._circuit_breaker
+
+    @property
+    def metrics(self) -> StorageMetrics:
+
+        return self._metrics
+
+    @property
+    def saturation(self) -> Optional[float]:
+
+        # share of busy slots, above 1 when calls are waiting (None if the concurrency is not limited)
+        if self._max_concurrency is None:
+            return None
+        return (self._metrics.in_flight + self._metrics.waiting) / self._max_concurrency
+
+    @property
+    def scope(self) -> FSMScope:
+
+        return self._storage.scope
+
+    def resolve_scope_address(self, *, chat: Union[str, int, None] = None,
+                              user: Union[str, int, None] = None) -> Tuple[Union[str, int], Union[str, int]]:
+
+        return self._storage.resolve_scope_address(chat=chat, user=user)
+
+    async def get_state(self, *, chat: Union[str, int, None] = None,
+                        user: Union[str, int, None] = None,
+                        default: Optional[str] = None) -> Optional[str]:
+
+        chat, user = self.resolve_scope_address(chat=chat, user=user)
+        magazine = self.get_magazine(user=user, chat=chat)
+        await magazine.load()
+        return magazine.current_state
+
+    async def set_state(self, *, chat: Union[str, int, None] = None,
+                        user: Union[str, int, None] = None,
+                        state: Optional[AnyStr] = None):
+
+        chat, user = self.resolve_scope_address(chat=chat, user=user)
+        magazine = self.get_magazine(chat=chat, user=user)
+        await magazine.push(state)
+
+    async def get_data(self, *, chat: Union[str, int, None] = None,
+                       user: Union[str, int, None] = None,
+                       default: Optional[Dict] = None) -> Dict:
+
+        return await self._call(self._storage.get_data, chat=chat, user=user, default=default)
+
+    async def set_data(self, *, chat: Union[str, int, None] = None,
+                       user: Union[str, int, None] = None,
+                       data: Optional[Dict] = None):
+
+        await self._call(self._storage.set_data, chat=chat, user=user, data=data)
+
+    async def update_data(self, *, chat: Union[str, int, None] = None,
+                          user: Union[str, int, None] = None,
+                          data: Optional[Dict] = None,
+                          **kwargs):
+
+        await self._call(self._storage.update_data, chat=chat, user=user, data=data, **kwargs)
+
+    def has_bucket(self) -> bool:
+
+        return self._storage.has_bucket()
+
+    async def get_bucket(self, *, chat: Union[str, int, None] = None,
+                         user: Union[str, int, None] = None,
+                         default: Optional[Dict] = None) -> Dict:
+
+        return await self._call(self._storage.get_bucket, chat=chat, user=user, default=default)
+
+    async def set_bucket(self, *, chat: Union[str, int, None] = None,
+                         user: Union[str, int, None] = None,
+                         bucket: Optional[Dict] = None):
+
+        await self._call(self._storage.set_bucket, chat=chat, user=user, bucket=bucket)
+
+    async def update_bucket(self, *, chat: Union[str, int, None] = None,
+                            user: Union[str, int, None] = None,
+                            bucket: Optional[Dict] = None,
+                            **kwargs):
+
+        await self._call(self._storage.update_bucket, chat=chat, user=user, bucket=bucket, **kwargs)
+
+    async def set_magazine_states(self, *, chat: Union[str, int, None] = None,
+                                  user: Union[str, int, None] = None,
+                                  states: List[Optional[str]]) -> int:
+
+        return await self._call(self._storage.set_magazine_states, chat=chat, user=user, states=states)
+
+    async def compare_and_set_magazine_states(self, *, chat: Union[str, int, None] = None,
+                                              user: Union[str, int, None] = None,
+                                              states: List[Optional[str]],
+                                              version: int) -> int:
+
+        # A failed write may still be applied (e.g. its response is lost on timeout), and its blind retry would fail
+        # with a false version conflict. So the record is re-read: the write is treated as done if the version
+        # is incremented to the same states, and retried only if the version is unchanged.
+        attempt = 0
+        while True:
+            try:
+                return await self._call(self._storage.compare_and_set_magazine_states,
+                                        chat=chat, user=user, states=states, version=version, retries=0)
+            except self._retry_exceptions as error:
+                current_states, current_version = await self.get_magazine_record(chat=chat, user=user)
+                if current_version == version + 1 and current_states == states:
+                    logger.debug(f"Magazine write failed ({error!r}) but is applied ({user=}, {chat=})!")
+                    return current_version
+                if current_version != version:
+                    raise exceptions.magazine.MagazineVersionConflictError(
+                        f"magazine version {version} is outdated, current is {current_version} ({user=}, {chat=})!"
+                    ) from error
+                if attempt >= self._retries:
+                    raise
+
+                attempt += 1
+                self._metrics.retries += 1
+                delay = self._get_backoff_delay(attempt)
+                logger.debug(f"Magazine write failed ({error!r}) and is not applied, "
+                             f"retry {attempt} of {self._retries} in {delay:.3f}s!")
+                await asyncio.sleep(delay)
+
+    async def get_magazine_record(self, *, chat: Union[str, int, None] = None,
+                                  user: Union[str, int, None] = None) -> Tuple[List[Optional[str]], int]:
+
+        return await self._call(self._storage.get_magazine_record, chat=chat, user=user)
+
+    async def scan_magazine_records(self, *, cursor: Any = None,
+                                    batch_size: int = 100) -> Tuple[Any, List[MagazineRecord]]:
+
+        return await self._call(self._storage.scan_magazine_records, cursor=cursor, batch_size=batch_size)
+
+    async def write_magazine_records(self, records: List[MagazineRecord]) -> int:
+
+        # A failed batch may be applied partially, so its records are re-read as a failed single write is:
+        # applied ones are counted as written, outdated ones as conflicts, and only unchanged ones are retried.
+        written = 0
+        attempt = 0
+        while True:
+            try:
+                return written + await self._call(self._storage.write_magazine_records, records, retries=0)
+            except self._retry_exceptions as error:
+                current_records = await asyncio.gather(*(self.get_magazine_record(chat=i.chat, user=i.user)
+                                                         for i in records))
+                unchanged_records = []
+                for record, (current_states, current_version) in zip(records, current_records):
+                    if current_version == record.version + 1 and current_states == record.states:
+                        written += 1
+                    elif current_version == record.version:
+                        unchanged_records.append(record)
+                records = unchanged_records
+                if not records:
+                    return written
+                if attempt >= self._retries:
+                    raise
+
+                attempt += 1
+                self._metrics.retries += 1
+                delay = self._get_backoff_delay(attempt)
+                logger.debug(f"Magazines batch write failed ({error!r}), {len(records)} records are not applied, "
+                             f"retry {attempt} of {self._retries} in {delay:.3f}s!")
+                await asyncio.sleep(delay)
+
+    async def get_address_record(self, *, chat: Union[str, int, None] = None,
+                                 user: Union[str, int, None] = None,
+                                 magazine_chat: Union[str, int, None] = None,
+                                 magazine_user: Union[str, int, None] = None) -> AddressRecord:
+
+        return await self._call(self._storage.get_address_record, chat=chat, user=user,
+                                magazine_chat=magazine_chat, magazine_user=magazine_user)
+
+    async def set_address_record(self, *, chat: Union[str, int, None] = None,
+                                 user: Union[str, int, None] = None,
+                                 data: Optional[Dict] = None,
+                                 bucket: Optional[Dict] = None) -> None:
+
+        await self._call(self._storage.set_address_record, chat=chat, user=user, data=data, bucket=bucket)
+
+    async def close(self):
+
+        await self._storage.close()
+
+    async def wait_closed(self):
+
+        await self._storage.wait_closed()
+
+    async def _call(self, method: Callable[..., Awaitable], *args, retries: Optional[int] = None, **kwargs) -> Any:
+
+        retries = self._retries if retries is None else retries
+        self._metrics.calls += 1
+        attempt = 0
+        while True:
+            if not self._circuit_breaker.allow_call():
+                self._metrics.rejections += 1
+                raise exceptions.fsm.StorageUnavailableError(
+                    f"storage is unavailable, «{method.__name__}» call is rejected by the open circuit!"
+                )
+
+            try:
+                result = await self._call_once(method, *args, **kwargs)
+            except self._retry_exceptions as error:
+                self._metrics.failures += 1
+                if isinstance(error, asyncio.TimeoutError):
+                    self._metrics.timeouts += 1
+                self._circuit_breaker.record_failure()
+                if attempt >= retries:
+                    raise
+
+                attempt += 1
+                self._metrics.retries += 1
+                delay = self._get_backoff_delay(attempt)
+                logger.debug(f"Storage call «{method.__name__}» failed ({error!r}), "
+                             f"retry {attempt} of {retries} in {delay:.3f}s!")
+                await asyncio.sleep(delay)
+            except Exception:
+                self._circuit_breaker.record_success()  # the backend has answered, e.g. with a version conflict
+                raise
+            else:
+                self._circuit_breaker.record_success()
+                return result
+
+    def _get_backoff_delay(self, attempt: int) -> float:
+
+        return random.uniform(0, min(self._backoff_max, self._backoff_base * 2 ** attempt))
+
+    async def _call_once(self, method: Callable[..., Awaitable], *args, **kwargs) -> Any:
+
+        if self._max_concurrency is None:
+            return await self._wait_for(method(*args, **kwargs))
+
+        if self._semaphore is None:  # created lazily to be bound to the running loop
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+
+        self._metrics.waiting += 1
+        started_at = time.monotonic()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._metrics.waiting -= 1
+            self._metrics.total_wait_time += time.monotonic() - started_at
+
+        try:
+            return await self._wait_for(method(*args, **kwargs))
+        finally:
+            self._semaphore.release()
+
+    async def _wait_for(self, awaitable: Awaitable) -> Any:
+
+        self._metrics.in_flight += 1
+        self._metrics.max_in_flight = max(self._metrics.max_in_flight, self._metrics.in_flight)
+        try:
+            if self._call_timeout is None:
+                return await awaitable
+            return await asyncio.wait_for(awaitable, self._call_timeout)
+        finally:
+            self._metrics.in_flight -= 1
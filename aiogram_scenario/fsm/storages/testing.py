@@ -0,0 +1,420 @@
+from typing import Union, List, Optional, Tuple, Any, Dict, Callable, NamedTuple, Awaitable
+import asyncio
+import inspect
+import logging
+import random
+import time
+import uuid
+
+from aiogram_scenario.fsm.storages.memory import MemoryStorage
+from aiogram_scenario.fsm.storages.base import BaseStorage, Magazine, MagazineRecord
+from aiogram_scenario.fsm.scope import FSMScope
+from aiogram_scenario import exceptions
+
+
+logger = logging.getLogger(__name__)
+
+
+class FaultInjectingStorage(MemoryStorage):
+
+    # In-process storage for testing of bots and storage wrappers against an unreliable backend:
+    # calls are delayed by «latency» (plus a random «latency_jitter») and fail with «failure_rate» probability,
+    # «fail_next» fails a few next calls and «set_down» simulates an outage. Faults happen before the call,
+    # so a failed call never changes the stored records, except for writes of «lose_next_responses»: they are
+    # applied, but fail as if their responses were lost. States are read and written through magazines,
+    # so their faults are injected by the magazine methods.
+
+    def __init__(self, *,
+                 failure_rate: float = 0.0,
+                 latency: float = 0.0,
+                 latency_jitter: float = 0.0,
+                 error_factory: Callable[[str], BaseException] = ConnectionError,
+                 seed: Optional[int] = None,
+                 scope: FSMScope = FSMScope.USER_IN_CHAT):
+
+        super().__init__(scope=scope)
+        self.failure_rate = failure_rate
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self._error_factory = error_factory
+        self._random = random.Random(seed)
+        self._failures_left = 0
+        self._lost_responses_left = 0
+        self._is_down = False
+        self.calls = 0
+        self.injected_failures = 0
+
+    def fail_next(self, calls: int = 1) -> None:
+
+        self._failures_left += calls
+
+    def lose_next_responses(self, writes: int = 1) -> None:
+
+        self._lost_responses_left += writes
+
+    def set_down(self, is_down: bool = True) -> None:
+
+        self._is_down = is_down
+
+    async def get_data(self, *, chat: Union[str, int, None] = None,
+                       user: Union[str, int, None] = None,
+                       default: Optional[Dict] = None) -> Dict:
+
+        await self._inject_fault("get_data")
+        return await super().get_data(chat=chat, user=user, default=default)
+
+    async def set_data(self, *, chat: Union[str, int, None] = None,
+                       user: Union[str, int, None] = None,
+                       data: Optional[Dict] = None):
+
+        await self._inject_fault("set_data")
+        await super().set_data(chat=chat, user=user, data=data)
+        self._lose_response("set_data")
+
+    async def update_data(self, *, chat: Union[str, int, None] = None,
+                          user: Union[str, int, None] = None,
+                          data: Optional[Dict] = None,
+                          **kwargs):
+
+        await self._inject_fault("update_data")
+        await super().update_data(chat=chat, user=user, data=data, **kwargs)
+        self._lose_response("update_data")
+
+    async def get_bucket(self, *, chat: Union[str, int, None] = None,
+                         user: Union[str, int, None] = None,
+                         default: Optional[Dict] = None) -> Dict:
+
+        await self._inject_fault("get_bucket")
+        return await super().get_bucket(chat=chat, user=user, default=default)
+
+    async def set_bucket(self, *, chat: Union[str, int, None] = None,
+                         user: Union[str, int, None] = None,
+                         bucket: Optional[Dict] = None):
+
+        await self._inject_fault("set_bucket")
+        await super().set_bucket(chat=chat, user=user, bucket=bucket)
+        self._lose_response("set_bucket")
+
+    async def set_magazine_states(self, *, chat: Union[str, int, None] = None,
+                                  user: Union[str, int, None] = None,
+                                  states: List[Optional[str]]) -> int:
+
+        await self._inject_fault("set_magazine_states")
+        version = await super().set_magazine_states(chat=chat, user=user, states=states)
+        self._lose_response("set_magazine_states")
+        return version
+
+    async def compare_and_set_magazine_states(self, *, chat: Union[str, int, None] = None,
+                                              user: Union[str, int, None] = None,
+                                              states: List[Optional[str]],
+                                              version: int) -> int:
+
+        await self._inject_fault("compare_and_set_magazine_states")
+        version = await super().compare_and_set_magazine_states(chat=chat, user=user, states=states, version=version)
+        self._lose_response("compare_and_set_magazine_states")
+        return version
+
+    async def get_magazine_record(self, *, chat: Union[str, int, None] = None,
+                                  user: Union[str, int, None] = None) -> Tuple[List[Optional[str]], int]:
+
+        await self._inject_fault("get_magazine_record")
+        return await super().get_magazine_record(chat=chat, user=user)
+
+    async def scan_magazine_records(self, *, cursor: Any = None,
+                                    batch_size: int = 100) -> Tuple[Any, List[MagazineRecord]]:
+
+        await self._inject_fault("scan_magazine_records")
+        return await super().scan_magazine_records(cursor=cursor, batch_size=batch_size)
+
+    async def _inject_fault(self, method_name: str) -> None:
+
+        self.calls += 1
+        delay = self.latency + (self._random.uniform(0, self.latency_jitter) if self.latency_jitter else 0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if self._is_down:
+            reason = "storage is down"
+        elif self._failures_left > 0:
+            self._failures_left -= 1
+            reason = "failure is forced"
+        elif self.failure_rate and self._random.random() < self.failure_rate:
+            reason = "random failure"
+        else:
+            return
+
+        self.injected_failures += 1
+        raise self._error_factory(f"«{method_name}» call failed: {reason}!")
+
+
+    def _lose_response(self, method_name: str) -> None:
+
+        if self._lost_responses_left > 0:
+            self._lost_responses_left -= 1
+            self.injected_failures += 1
+            raise self._error_factory(f"«{method_name}» call failed: response is lost!")
+
+
+class ConformanceCheckResult(NamedTuple):
+
+    name: str
+    status: str  # «passed», «failed» or «skipped» (the storage does not support the feature)
+    details: str = ""
+    duration: float = 0.0
+
+
+class ThroughputStats(NamedTuple):
+
+    operations: int
+    seconds: float
+
+    @property
+    def per_second(self) -> float:
+
+        return self.operations / self.seconds if self.seconds else float("inf")
+
+
+class StorageConformanceKit:
+
+    # Runs the same magazine semantics against any storage, so a backend (or a refactoring of it) can be checked
+    # before use. Each check gets a fresh storage from the factory, which may be a coroutine function,
+    # and is run on its own addresses, so a shared backend can be used as well.
+
+    PASSED = "passed"
+    FAILED = "failed"
+    SKIPPED = "skipped"
+
+    def __init__(self, storage_factory: Callable[[], Union[BaseStorage, Awaitable[BaseStorage]]], *,
+                 stress_users: int = 100,
+                 stress_pushes: int = 20):
+
+        self._storage_factory = storage_factory
+        self._stress_users = stress_users
+        self._stress_pushes = stress_pushes
+        self._address_prefix = f"conformance-{uuid.uuid4().hex[:8]}"
+        self._addresses_number = 0
+
+    @property
+    def checks(self) -> List[Callable[[BaseStorage], Awaitable[None]]]:
+
+        return [self.check_initial_magazine, self.check_push, self.check_truncate_on_revisit,
+                self.check_back_transition, self.check_chronology, self.check_version_conflict,
+                self.check_addresses_isolation, self.check_address_record, self.check_scan_and_write,
+                self.check_concurrent_compare_and_set, self.check_concurrent_addresses]
+
+    async def run(self) -> List[ConformanceCheckResult]:
+
+        results = []
+        for check in self.checks:
+            name = check.__name__
+            started_at = time.perf_counter()
+            storage = await self._create_storage()
+            try:
+                await check(storage)
+            except NotImplementedError as error:
+                result = ConformanceCheckResult(name, self.SKIPPED, str(error))
+            except Exception as error:
+                result = ConformanceCheckResult(name, self.FAILED, f"{error.__class__.__name__}: {error}")
+            else:
+                result = ConformanceCheckResult(name, self.PASSED)
+            finally:
+                await storage.close()
+                await storage.wait_closed()
+
+            results.append(result._replace(duration=time.perf_counter() - started_at))
+            logger.debug(f"Conformance check «{name}» is {result.status}!")
+
+        return results
+
+    async def measure_throughput(self, *, users: int = 100, pushes: int = 10) -> ThroughputStats:
+
+        # every push is a load and a compare-and-set commit of a magazine, users run concurrently
+        storage = await self._create_storage()
+        addresses = [self._get_address() for _ in range(users)]
+
+        async def push_states(chat: str, user: str) -> None:
+
+            for index in range(pushes):
+                magazine = storage.get_magazine(chat=chat, user=user)
+                await magazine.push(f"state_{index}", compare_version=True)
+
+        try:
+            started_at = time.perf_counter()
+            await asyncio.gather(*(push_states(chat, user) for chat, user in addresses))
+            seconds = time.perf_counter() - started_at
+        finally:
+            await storage.close()
+            await storage.wait_closed()
+
+        return ThroughputStats(operations=users * pushes, seconds=seconds)
+
+    async def check_initial_magazine(self, storage: BaseStorage) -> None:
+
+        chat, user = self._get_address()
+        states, version = await storage.get_magazine_record(chat=chat, user=user)
+        self._assert_equal(states, [None], "states of a new magazine")
+        self._assert_equal(version, 0, "version of a new magazine")
+        self._assert_equal(await storage.get_state(chat=chat, user=user), None, "state of a new address")
+
+    async def check_push(self, storage: BaseStorage) -> None:
+
+        chat, user = self._get_address()
+        magazine = await self._push_states(storage, chat, user, ["a", "b"])
+        self._assert_equal(await storage.get_magazine_states(chat=chat, user=user), [None, "a", "b"],
+                           "states after pushes")
+        self._assert_equal(magazine.version, 2, "version after pushes")
+        self._assert_equal(await storage.get_state(chat=chat, user=user), "b", "current state")
+
+    async def check_truncate_on_revisit(self, storage: BaseStorage) -> None:
+
+        chat, user = self._get_address()
+        await self._push_states(storage, chat, user, ["a", "b", "c", "a"])
+        self._assert_equal(await storage.get_magazine_states(chat=chat, user=user), [None, "a"],
+                           "states after revisiting")
+
+    async def check_back_transition(self, storage: BaseStorage) -> None:
+
+        chat, user = self._get_address()
+        await self._push_states(storage, chat, user, ["a", "b"])
+        magazine = storage.get_magazine(chat=chat, user=user)
+        await magazine.load()
+        self._assert_equal(magazine.penultimate_state, "a", "penultimate state")
+        await magazine.push(magazine.penultimate_state, compare_version=True)
+        self._assert_equal(await storage.get_magazine_states(chat=chat, user=user), [None, "a"],
+                           "states after going back")
+
+    async def check_chronology(self, storage: BaseStorage) -> None:
+
+        chat, user = self._get_address()
+        magazine = storage.get_magazine(chat=chat, user=user)
+        await magazine.load()
+        magazine.replace([None, "a", "b", "c", "b", "d"])
+        await magazine.commit(compare_version=True)
+        self._assert_equal(await storage.get_magazine_states(chat=chat, user=user), [None, "a", "b", "d"],
+                           "states after setting a chronology")
+
+    async def check_version_conflict(self, storage: BaseStorage) -> None:
+
+        chat, user = self._get_address()
+        first_magazine = storage.get_magazine(chat=chat, user=user)
+        second_magazine = storage.get_magazine(chat=chat, user=user)
+        await first_magazine.load()
+        await second_magazine.load()
+        await first_magazine.push("a", compare_version=True)
+        try:
+            await second_magazine.push("b", compare_version=True)
+        except exceptions.magazine.MagazineVersionConflictError:
+            pass
+        else:
+            raise AssertionError("an outdated magazine was committed!")
+        self._assert_equal(await storage.get_magazine_states(chat=chat, user=user), [None, "a"],
+                           "states after a conflict")
+
+    async def check_addresses_isolation(self, storage: BaseStorage) -> None:
+
+        first_chat, first_user = self._get_address()
+        second_chat, second_user = self._get_address()
+        await self._push_states(storage, first_chat, first_user, ["a"])
+        await self._push_states(storage, second_chat, second_user, ["b"])
+        await self._push_states(storage, first_chat, second_user, ["c"])
+        self._assert_equal(await storage.get_magazine_states(chat=first_chat, user=first_user), [None, "a"],
+                           "states of the first address")
+        self._assert_equal(await storage.get_magazine_states(chat=second_chat, user=second_user), [None, "b"],
+                           "states of the second address")
+        self._assert_equal(await storage.get_magazine_states(chat=first_chat, user=second_user), [None, "c"],
+                           "states of the mixed address")
+
+    async def check_address_record(self, storage: BaseStorage) -> None:
+
+        chat, user = self._get_address()
+        await self._push_states(storage, chat, user, ["a"])
+        bucket = {"calls": 1} if storage.has_bucket() else None
+        await storage.set_address_record(chat=chat, user=user, data={"key": "value"}, bucket=bucket)
+        record = await storage.get_address_record(chat=chat, user=user)
+        self._assert_equal(record.states, [None, "a"], "states of the address record")
+        self._assert_equal(record.version, 1, "version of the address record")
+        self._assert_equal(record.data, {"key": "value"}, "data of the address record")
+        if bucket is not None:
+            self._assert_equal(record.bucket, bucket, "bucket of the address record")
+
+    async def check_scan_and_write(self, storage: BaseStorage) -> None:
+
+        addresses = [self._get_address() for _ in range(5)]
+        for chat, user in addresses:
+            await self._push_states(storage, chat, user, ["a"])
+
+        expected = {(str(chat), str(user)) for chat, user in addresses}
+        records = []
+        cursor = None
+        while True:
+            cursor, batch = await storage.scan_magazine_records(cursor=cursor, batch_size=2)
+            records.extend(record for record in batch if (str(record.chat), str(record.user)) in expected)
+            if cursor is None:
+                break
+        self._assert_equal({(str(record.chat), str(record.user)) for record in records}, expected,
+                           "scanned addresses")
+
+        renamed_records = [record._replace(states=[None, "renamed"]) for record in records]
+        outdated_record = renamed_records[0]._replace(version=renamed_records[0].version - 1)
+        written = await storage.write_magazine_records([*renamed_records[1:], outdated_record])
+        self._assert_equal(written, len(records) - 1, "number of written records")
+
+    async def check_concurrent_compare_and_set(self, storage: BaseStorage) -> None:
+
+        # concurrent writers of one address retry on conflicts, so no push may be lost
+        chat, user = self._get_address()
+
+        async def push_state(state: str) -> None:
+
+            while True:
+                magazine = storage.get_magazine(chat=chat, user=user)
+                await magazine.load()
+                magazine.set(state)
+                try:
+                    await magazine.commit(compare_version=True)
+                except exceptions.magazine.MagazineVersionConflictError:
+                    continue
+                return
+
+        await asyncio.gather(*(push_state(f"state_{index}") for index in range(self._stress_pushes)))
+        states, version = await storage.get_magazine_record(chat=chat, user=user)
+        self._assert_equal(version, self._stress_pushes, "version after concurrent pushes")
+        self._assert_equal(sorted(states[1:]), sorted(f"state_{index}" for index in range(self._stress_pushes)),
+                           "states after concurrent pushes")
+
+    async def check_concurrent_addresses(self, storage: BaseStorage) -> None:
+
+        addresses = [self._get_address() for _ in range(self._stress_users)]
+        states = [f"state_{index}" for index in range(self._stress_pushes)]
+        await asyncio.gather(*(self._push_states(storage, chat, user, states) for chat, user in addresses))
+        for chat, user in addresses:
+            self._assert_equal(await storage.get_magazine_states(chat=chat, user=user), [None, *states],
+                               f"states of the address ({chat}, {user})")
+
+    async def _create_storage(self) -> BaseStorage:
+
+        storage = self._storage_factory()
+        if inspect.isawaitable(storage):
+            storage = await storage
+
+        return storage
+
+    def _get_address(self) -> Tuple[str, str]:
+
+        self._addresses_number += 1
+        return f"{self._address_prefix}-chat-{self._addresses_number}", f"user-{self._addresses_number}"
+
+    @staticmethod
+    async def _push_states(storage: BaseStorage, chat: str, user: str, states: List[str]) -> Magazine:
+
+        magazine = storage.get_magazine(chat=chat, user=user)
+        for state in states:
+            await magazine.push(state, compare_version=True)
+
+        return magazine
+
+    @staticmethod
+    def _assert_equal(actual: Any, expected: Any, subject: str) -> None:
+
+        if actual != expected:
+            raise AssertionError(f"unexpected {subject}: {actual!r} (expected {expected!r})!")
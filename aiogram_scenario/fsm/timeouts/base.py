@@ -0,0 +1,51 @@
+from abc import ABC, abstractmethod
+from typing import Union, List, Optional, Tuple
+from dataclasses import dataclass
+
+
+ADDRESS_TYPE = Tuple[Union[str, int], Union[str, int]]  # chat, user (already resolved by the scope)
+
+
+@dataclass(frozen=True)
+class StateTimeout:
+
+    # passed to the state hooks instead of a Telegram event when the user is moved by a timeout
+    chat_id: Union[str, int]
+    user_id: Union[str, int]
+    state: str
+
+
+class BaseTimeoutsScheduler(ABC):
+
+    @abstractmethod
+    async def schedule(self, *, chat: Union[str, int], user: Union[str, int], timeout: float) -> None:
+
+        pass
+
+    @abstractmethod
+    async def cancel(self, *, chat: Union[str, int], user: Union[str, int]) -> None:
+
+        pass
+
+    @abstractmethod
+    async def touch(self, *, chat: Union[str, int], user: Union[str, int]) -> None:
+
+        # postpones an existing deadline by its timeout, nothing is done for addresses without a deadline
+        pass
+
+    @abstractmethod
+    async def reschedule(self, *, chat: Union[str, int], user: Union[str, int], timeout: float) -> None:
+
+        # returns a popped address whose processing failed, unless a deadline has been scheduled for it meanwhile
+        pass
+
+    @abstractmethod
+    async def pop_expired(self, *, limit: int) -> List[ADDRESS_TYPE]:
+
+        # expired addresses are removed from the scheduler, so each of them is returned only once
+        pass
+
+    @abstractmethod
+    async def get_next_deadline(self) -> Optional[float]:
+
+        pass
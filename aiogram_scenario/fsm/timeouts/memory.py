@@ -0,0 +1,68 @@
+from typing import Union, List, Optional, Dict, Tuple
+import heapq
+import time
+
+from .base import BaseTimeoutsScheduler, ADDRESS_TYPE
+
+
+class MemoryTimeoutsScheduler(BaseTimeoutsScheduler):
+
+    # The heap keeps at most a few entries per address: postponed deadlines are only updated
+    # in the mapping, and an outdated heap entry is pushed back with the actual deadline when it is popped.
+
+    def __init__(self):
+
+        self._deadlines: Dict[ADDRESS_TYPE, Tuple[float, float]] = {}  # address: (deadline, timeout)
+        self._heap: List[Tuple[float, ADDRESS_TYPE]] = []
+
+    async def schedule(self, *, chat: Union[str, int], user: Union[str, int], timeout: float) -> None:
+
+        address = (chat, user)
+        deadline = time.time() + timeout
+        current = self._deadlines.get(address)
+        self._deadlines[address] = (deadline, timeout)
+        if current is None or deadline < current[0]:
+            heapq.heappush(self._heap, (deadline, address))
+
+    async def reschedule(self, *, chat: Union[str, int], user: Union[str, int], timeout: float) -> None:
+
+        if (chat, user) not in self._deadlines:
+            await self.schedule(chat=chat, user=user, timeout=timeout)
+
+    async def cancel(self, *, chat: Union[str, int], user: Union[str, int]) -> None:
+
+        self._deadlines.pop((chat, user), None)
+
+    async def touch(self, *, chat: Union[str, int], user: Union[str, int]) -> None:
+
+        address = (chat, user)
+        current = self._deadlines.get(address)
+        if current is not None:
+            _, timeout = current
+            self._deadlines[address] = (time.time() + timeout, timeout)
+
+    async def pop_expired(self, *, limit: int) -> List[ADDRESS_TYPE]:
+
+        now = time.time()
+        expired = []
+        while self._heap and self._heap[0][0] <= now and len(expired) < limit:
+            _, address = heapq.heappop(self._heap)
+            current = self._deadlines.get(address)
+            if current is None:  # cancelled
+                continue
+
+            deadline, _ = current
+            if deadline <= now:
+                del self._deadlines[address]
+                expired.append(address)
+            else:  # postponed
+                heapq.heappush(self._heap, (deadline, address))
+
+        return expired
+
+    async def get_next_deadline(self) -> Optional[float]:
+
+        while self._heap and self._heap[0][1] not in self._deadlines:
+            heapq.heappop(self._heap)
+
+        return self._heap[0][0] if self._heap else None
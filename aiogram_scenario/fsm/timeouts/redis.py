@@ -0,0 +1,109 @@
+from typing import Union, List, Optional
+import time
+
+from aiogram.contrib.fsm_storage import redis
+
+from .base import BaseTimeoutsScheduler, ADDRESS_TYPE
+
+
+# the hash tag keeps both keys in one slot of Redis Cluster, as the scripts use them together
+TIMEOUTS_KEY = "{timeouts}"
+TIMEOUTS_DEADLINES_KEY = "deadlines"
+TIMEOUTS_DURATIONS_KEY = "durations"
+
+# KEYS: deadlines key, durations key; ARGV: member, now
+TOUCH_TIMEOUT_SCRIPT = """
+local timeout = redis.call('HGET', KEYS[2], ARGV[1])
+if timeout then
+    redis.call('ZADD', KEYS[1], 'XX', tonumber(ARGV[2]) + tonumber(timeout), ARGV[1])
+end
+return 0
+"""
+
+# KEYS: deadlines key, durations key; ARGV: now, limit
+POP_EXPIRED_TIMEOUTS_SCRIPT = """
+local members = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #members > 0 then
+    redis.call('ZREM', KEYS[1], unpack(members))
+    redis.call('HDEL', KEYS[2], unpack(members))
+end
+return members
+"""
+
+
+def _parse_address_part(part: str) -> Union[str, int]:
+
+    try:
+        return int(part)
+    except ValueError:
+        return part
+
+
+class RedisTimeoutsScheduler(BaseTimeoutsScheduler):
+
+    # Deadlines are kept in a sorted set shared by all workers; expired members are claimed
+    # atomically by a script, so each timeout is processed by exactly one worker.
+
+    def __init__(self, storage: redis.RedisStorage2):
+
+        self._storage = storage
+        self._keys = [storage.generate_key(TIMEOUTS_KEY, TIMEOUTS_DEADLINES_KEY),
+                      storage.generate_key(TIMEOUTS_KEY, TIMEOUTS_DURATIONS_KEY)]
+
+    async def schedule(self, *, chat: Union[str, int], user: Union[str, int], timeout: float) -> None:
+
+        member = self._get_member(chat, user)
+        redis_ = await self._storage.redis()
+        transaction = redis_.multi_exec()
+        transaction.zadd(self._keys[0], time.time() + timeout, member)
+        transaction.hset(self._keys[1], member, timeout)
+        await transaction.execute()
+
+    async def reschedule(self, *, chat: Union[str, int], user: Union[str, int], timeout: float) -> None:
+
+        member = self._get_member(chat, user)
+        redis_ = await self._storage.redis()
+        transaction = redis_.multi_exec()
+        transaction.zadd(self._keys[0], time.time() + timeout, member, exist=redis_.ZSET_IF_NOT_EXIST)
+        transaction.hsetnx(self._keys[1], member, timeout)
+        await transaction.execute()
+
+    async def cancel(self, *, chat: Union[str, int], user: Union[str, int]) -> None:
+
+        member = self._get_member(chat, user)
+        redis_ = await self._storage.redis()
+        transaction = redis_.multi_exec()
+        transaction.zrem(self._keys[0], member)
+        transaction.hdel(self._keys[1], member)
+        await transaction.execute()
+
+    async def touch(self, *, chat: Union[str, int], user: Union[str, int]) -> None:
+
+        redis_ = await self._storage.redis()
+        await redis_.eval(TOUCH_TIMEOUT_SCRIPT, keys=self._keys, args=[self._get_member(chat, user), time.time()])
+
+    async def pop_expired(self, *, limit: int) -> List[ADDRESS_TYPE]:
+
+        redis_ = await self._storage.redis()
+        members = await redis_.eval(POP_EXPIRED_TIMEOUTS_SCRIPT, keys=self._keys, args=[time.time(), limit])
+
+        addresses = []
+        for member in members:
+            if isinstance(member, bytes):
+                member = member.decode()
+            chat, user = member.split(":", 1)
+            addresses.append((_parse_address_part(chat), _parse_address_part(user)))
+
+        return addresses
+
+    async def get_next_deadline(self) -> Optional[float]:
+
+        redis_ = await self._storage.redis()
+        members = await redis_.zrange(self._keys[0], 0, 0, withscores=True)
+
+        return float(members[0][1]) if members else None
+
+    @staticmethod
+    def _get_member(chat: Union[str, int], user: Union[str, int]) -> str:
+
+        return f"{chat}:{user}"
@@ -0,0 +1,222 @@
+from typing import Dict, List, Optional, Sequence, Set, Tuple, Hashable, NamedTuple, Callable, Union
+from collections import deque
+from array import array
+
+from .keeper import TransitionsKeeper, get_trigger_name
+
+
+class TransitionsDiff(NamedTuple):
+
+    added_states: Set[str]
+    removed_states: Set[str]
+    added_transitions: Set[Tuple[str, str, str]]
+    removed_transitions: Set[Tuple[str, str, str]]
+    changed_transitions: Set[Tuple[str, str, str, str]]  # source, trigger, old destination, new destination
+
+
+class TransitionsGraph:
+
+    # adjacency is stored in CSR form: outgoing edges of the state with index i
+    # are targets[offsets[i]:offsets[i + 1]] (triggers are aligned with targets)
+
+    def __init__(self, transitions: Dict[Hashable, Dict[Union[Callable, str], Hashable]]):
+
+        states: Dict[Hashable, int] = {}
+        for source_state, destinations in transitions.items():
+            states.setdefault(source_state, len(states))
+            for destination_state in destinations.values():
+                states.setdefault(destination_state, len(states))
+
+        self._states: List[Hashable] = list(states.keys())
+        self._indexes = states
+        self._offsets = array("I", [0])
+        self._targets = array("I")
+        self._triggers: List[Union[Callable, str]] = []
+        for state in self._states:
+            for trigger_func, destination_state in transitions.get(state, {}).items():
+                self._targets.append(states[destination_state])
+                self._triggers.append(trigger_func)
+            self._offsets.append(len(self._targets))
+
+        self._edges: Set[Tuple[int, int]] = {
+            (source_index, self._targets[position])
+            for source_index in range(len(self._states))
+            for position in range(self._offsets[source_index], self._offsets[source_index + 1])
+        }
+
+    @classmethod
+    def from_keeper(cls, keeper: TransitionsKeeper) -> "TransitionsGraph":
+
+        return cls(keeper.transitions)
+
+    @property
+    def states(self) -> List[Hashable]:
+
+        return list(self._states)
+
+    @property
+    def transitions_number(self) -> int:
+
+        return len(self._targets)
+
+    def get_successors(self, state: Hashable) -> List[Hashable]:
+
+        index = self._indexes[state]
+
+        return [self._states[i] for i in self._targets[self._offsets[index]:self._offsets[index + 1]]]
+
+    def has_transition(self, source_state: Hashable, destination_state: Hashable) -> bool:
+
+        source_index = self._indexes.get(source_state)
+        destination_index = self._indexes.get(destination_state)
+        if source_index is None or destination_index is None:
+            return False
+
+        return (source_index, destination_index) in self._edges
+
+    def check_path(self, states: Sequence[Hashable]) -> Optional[int]:
+
+        # index of the first state that cannot be reached from the previous one, None for a valid path
+        for index in range(1, len(states)):
+            if not self.has_transition(states[index - 1], states[index]):
+                return index
+
+        return None
+
+    def get_distances(self, state: Hashable) -> Dict[Hashable, int]:
+
+        distances, _ = self._search(self._indexes[state])
+
+        return {self._states[index]: distance for index, distance in enumerate(distances) if distance >= 0}
+
+    def get_reachable_states(self, state: Hashable) -> Set[Hashable]:
+
+        return set(self.get_distances(state).keys())
+
+    def get_unreachable_states(self, initial_state: Hashable) -> Set[Hashable]:
+
+        return set(self._states) - self.get_reachable_states(initial_state)
+
+    def get_dead_ends(self) -> Set[Hashable]:
+
+        return {state for index, state in enumerate(self._states)
+                if self._offsets[index] == self._offsets[index + 1]}
+
+    def get_shortest_path(self, source_state: Hashable, destination_state: Hashable) -> Optional[List[Hashable]]:
+
+        destination_index = self._indexes.get(destination_state)
+        if destination_index is None:
+            return None
+
+        distances, parents = self._search(self._indexes[source_state], destination_index)
+        if distances[destination_index] < 0:
+            return None
+
+        path = [destination_index]
+        while path[-1] != parents[path[-1]]:
+            path.append(parents[path[-1]])
+
+        return [self._states[index] for index in reversed(path)]
+
+    def get_strongly_connected_components(self) -> List[List[Hashable]]:
+
+        # iterative Tarjan's algorithm, so deep graphs do not hit the recursion limit
+        states_number = len(self._states)
+        indexes = [-1] * states_number
+        low_links = [0] * states_number
+        on_stack = [False] * states_number
+        stack = []
+        components = []
+        counter = 0
+
+        for root in range(states_number):
+            if indexes[root] != -1:
+                continue
+
+            indexes[root] = low_links[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = True
+            work = [(root, self._offsets[root])]
+            while work:
+                vertex, position = work[-1]
+                if position < self._offsets[vertex + 1]:
+                    work[-1] = (vertex, position + 1)
+                    successor = self._targets[position]
+                    if indexes[successor] == -1:
+                        indexes[successor] = low_links[successor] = counter
+                        counter += 1
+                        stack.append(successor)
+                        on_stack[successor] = True
+                        work.append((successor, self._offsets[successor]))
+                    elif on_stack[successor]:
+                        low_links[vertex] = min(low_links[vertex], indexes[successor])
+                    continue
+
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low_links[parent] = min(low_links[parent], low_links[vertex])
+                if low_links[vertex] == indexes[vertex]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component.append(self._states[member])
+                        if member == vertex:
+                            break
+                    components.append(component)
+
+        return components
+
+    def get_cycles(self) -> List[List[Hashable]]:
+
+        # self-transitions are forbidden, so only components of several states contain cycles
+        return [i for i in self.get_strongly_connected_components() if len(i) > 1]
+
+    def get_serialized_transitions(self) -> Dict[Tuple[str, str], str]:
+
+        return {
+            (str(self._states[source_index]), get_trigger_name(self._triggers[position])):
+                str(self._states[self._targets[position]])
+            for source_index in range(len(self._states))
+            for position in range(self._offsets[source_index], self._offsets[source_index + 1])
+        }
+
+    def diff(self, other: "TransitionsGraph") -> TransitionsDiff:
+
+        # graphs are compared by names, so versions built from different objects can be compared
+        old_transitions = self.get_serialized_transitions()
+        new_transitions = other.get_serialized_transitions()
+        old_states = {str(i) for i in self._states}
+        new_states = {str(i) for i in other.states}
+
+        return TransitionsDiff(
+            added_states=new_states - old_states,
+            removed_states=old_states - new_states,
+            added_transitions={(*key, new_transitions[key]) for key in new_transitions.keys() - old_transitions.keys()},
+            removed_transitions={(*key, old_transitions[key])
+                                 for key in old_transitions.keys() - new_transitions.keys()},
+            changed_transitions={(*key, old_transitions[key], new_transitions[key])
+                                 for key in old_transitions.keys() & new_transitions.keys()
+                                 if old_transitions[key] != new_transitions[key]}
+        )
+
+    def _search(self, source_index: int, destination_index: Optional[int] = None) -> Tuple[List[int], List[int]]:
+
+        distances = [-1] * len(self._states)
+        parents = [-1] * len(self._states)
+        distances[source_index] = 0
+        parents[source_index] = source_index
+        queue = deque((source_index,))
+        while queue:
+            vertex = queue.popleft()
+            if vertex == destination_index:
+                break
+            for successor in self._targets[self._offsets[vertex]:self._offsets[vertex + 1]]:
+                if distances[successor] == -1:
+                    distances[successor] = distances[vertex] + 1
+                    parents[successor] = vertex
+                    queue.append(successor)
+
+        return distances, parents
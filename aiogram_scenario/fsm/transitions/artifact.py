@@ -0,0 +1,137 @@
+from typing import Dict, List, Optional, Collection, NamedTuple, Tuple
+from collections import deque
+import struct
+import mmap
+
+from aiogram_scenario import exceptions
+from aiogram_scenario.transitions_storages.base import AbstractTransitionsStorage
+
+
+MAGIC = b"AGSC"
+FORMAT_VERSION = 1
+# magic, format version, number of states, triggers and transitions, index of initial state
+HEADER = struct.Struct("<4sHIIII")
+STRING_LENGTH = struct.Struct("<H")
+TRANSITION = struct.Struct("<III")  # source state index, trigger index, destination state index
+
+
+class ScenarioGraph(NamedTuple):
+
+    initial_state: str
+    states: List[str]
+    triggers: List[str]
+    transitions: List[Tuple[int, int, int]]
+
+
+def validate_transitions(transitions: Dict[str, Dict[str, str]], *,
+                         initial_state: str,
+                         states_names: Optional[Collection[str]] = None,
+                         triggers_names: Optional[Collection[str]] = None) -> None:
+
+    errors = []
+    graph_states = set(transitions.keys())
+    for destinations in transitions.values():
+        graph_states.update(destinations.values())
+
+    if initial_state not in graph_states:
+        errors.append(f"initial state '{initial_state}' is not in the graph")
+    if states_names is not None:
+        errors.extend(f"state '{i}' is not defined" for i in sorted(graph_states - set(states_names)))
+    if triggers_names is not None:
+        triggers_names = set(triggers_names)
+
+    for source_state, destinations in transitions.items():
+        for trigger, destination_state in destinations.items():
+            if source_state == destination_state:
+                errors.append(f"transition from '{source_state}' by '{trigger}' leads to the same state")
+            if triggers_names is not None and trigger not in triggers_names:
+                errors.append(f"trigger '{trigger}' of state '{source_state}' is not defined")
+
+    if initial_state in graph_states:
+        reached = {initial_state}
+        queue = deque((initial_state,))
+        while queue:
+            for destination_state in transitions.get(queue.popleft(), {}).values():
+                if destination_state not in reached:
+                    reached.add(destination_state)
+                    queue.append(destination_state)
+        errors.extend(f"state '{i}' is unreachable from the initial state" for i in sorted(graph_states - reached))
+
+    if errors:
+        raise exceptions.fsm.ScenarioValidationError("scenario graph is invalid:\n" + "\n".join(errors))
+
+
+def build_scenario_artifact(storage: AbstractTransitionsStorage, filename: str, *,
+                            initial_state: str,
+                            states_names: Optional[Collection[str]] = None,
+                            triggers_names: Optional[Collection[str]] = None) -> None:
+
+    transitions = storage.read()
+    validate_transitions(transitions, initial_state=initial_state,
+                         states_names=states_names, triggers_names=triggers_names)
+
+    states_indexes: Dict[str, int] = {initial_state: 0}
+    triggers_indexes: Dict[str, int] = {}
+    packed_transitions = []
+    for source_state, destinations in transitions.items():
+        for trigger, destination_state in destinations.items():
+            packed_transitions.append(TRANSITION.pack(
+                states_indexes.setdefault(source_state, len(states_indexes)),
+                triggers_indexes.setdefault(trigger, len(triggers_indexes)),
+                states_indexes.setdefault(destination_state, len(states_indexes))
+            ))
+
+    with open(filename, "wb") as artifact_file:
+        artifact_file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(states_indexes),
+                                        len(triggers_indexes), len(packed_transitions), 0))
+        for name in (*states_indexes, *triggers_indexes):
+            encoded_name = name.encode("UTF-8")
+            artifact_file.write(STRING_LENGTH.pack(len(encoded_name)))
+            artifact_file.write(encoded_name)
+        artifact_file.write(b"".join(packed_transitions))
+
+
+def read_scenario_artifact(filename: str) -> ScenarioGraph:
+
+    with open(filename, "rb") as artifact_file:
+        try:
+            buffer = mmap.mmap(artifact_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            raise exceptions.fsm.ScenarioArtifactError(f"'{filename}' is not a scenario artifact!")
+
+    with buffer:
+        try:
+            magic, version, states_count, triggers_count, transitions_count, initial_index = \
+                HEADER.unpack_from(buffer, 0)
+        except struct.error:  # truncated file
+            raise exceptions.fsm.ScenarioArtifactError(f"'{filename}' is not a scenario artifact!")
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise exceptions.fsm.ScenarioArtifactError(f"'{filename}' is not a scenario artifact "
+                                                       f"of version {FORMAT_VERSION}!")
+
+        try:
+            offset = HEADER.size
+            names = []
+            for _ in range(states_count + triggers_count):
+                (length,) = STRING_LENGTH.unpack_from(buffer, offset)
+                offset += STRING_LENGTH.size
+                if offset + length > len(buffer):
+                    raise struct.error("name is truncated")
+                names.append(buffer[offset:offset + length].decode("UTF-8"))
+                offset += length
+
+            transitions_end = offset + TRANSITION.size * transitions_count
+            if transitions_end > len(buffer):
+                raise struct.error("transitions are truncated")
+            transitions = list(TRANSITION.iter_unpack(buffer[offset:transitions_end]))
+            for source_index, trigger_index, destination_index in transitions:
+                if max(source_index, destination_index) >= states_count or trigger_index >= triggers_count:
+                    raise IndexError(f"transition {(source_index, trigger_index, destination_index)} "
+                                     f"refers to a missing state or trigger")
+            states = names[:states_count]
+            initial_state = states[initial_index]
+        except (struct.error, IndexError, UnicodeDecodeError) as e:  # truncated or corrupted file
+            raise exceptions.fsm.ScenarioArtifactError(f"scenario artifact '{filename}' is corrupted: {e}!") from e
+
+    return ScenarioGraph(initial_state=initial_state, states=states,
+                         triggers=names[states_count:], transitions=transitions)
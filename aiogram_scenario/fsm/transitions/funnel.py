@@ -0,0 +1,302 @@
+from abc import ABC, abstractmethod
+from typing import Optional, List, Dict, Tuple, Union, Sequence
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from array import array
+import asyncio
+import bisect
+import logging
+import copy
+import json
+
+from aiogram_scenario.fsm.transitions.journal import TransitionRecord, CHRONOLOGY_TRIGGER
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DWELL_BUCKETS = (1, 5, 15, 60, 300, 900, 3600, 6 * 3600, 24 * 3600)  # upper bounds in seconds
+FUNNEL_KEY = "{funnel}"
+FUNNEL_EDGES_KEY = "edges"
+FUNNEL_DWELL_KEY = "dwell"
+
+EDGE_TYPE = Tuple[Optional[str], Optional[str]]  # source state, destination state
+
+
+@dataclass()
+class FunnelSnapshot:
+
+    # counters by state names, so snapshots of different processes (with different states ids) can be merged
+    dwell_buckets: Tuple[float, ...] = DEFAULT_DWELL_BUCKETS
+    edges: Dict[EDGE_TYPE, int] = field(default_factory=dict)
+    dwell: Dict[Optional[str], List[int]] = field(default_factory=dict)  # the last bucket is unbounded
+
+    def merge(self, other: "FunnelSnapshot") -> "FunnelSnapshot":
+
+        if tuple(self.dwell_buckets) != tuple(other.dwell_buckets):
+            raise ValueError(f"snapshots with different dwell buckets cannot be merged "
+                             f"({self.dwell_buckets} and {other.dwell_buckets})!")
+
+        edges = self.edges.copy()
+        for edge, count in other.edges.items():
+            edges[edge] = edges.get(edge, 0) + count
+        dwell = {state: counts.copy() for state, counts in self.dwell.items()}
+        for state, counts in other.dwell.items():
+            if state in dwell:
+                dwell[state] = [i + j for i, j in zip(dwell[state], counts)]
+            else:
+                dwell[state] = counts.copy()
+
+        return FunnelSnapshot(dwell_buckets=self.dwell_buckets, edges=edges, dwell=dwell)
+
+    def get_entries_number(self, state: Optional[str]) -> int:
+
+        return sum(count for (_, destination), count in self.edges.items() if destination == state)
+
+    def get_exits_number(self, state: Optional[str]) -> int:
+
+        return sum(count for (source, _), count in self.edges.items() if source == state)
+
+    def get_conversion_rates(self, source_state: Optional[str]) -> Dict[Optional[str], float]:
+
+        # shares of exits from the state by destinations
+        exits_number = self.get_exits_number(source_state)
+        if not exits_number:
+            return {}
+
+        return {destination: count / exits_number
+                for (source, destination), count in self.edges.items() if source == source_state}
+
+    def get_funnel(self, states: Sequence[Optional[str]]) -> List[float]:
+
+        # conversion of each step of the funnel into the next one (by direct transitions),
+        # a step that is never entered (e.g. the initial state) is counted by its exits
+        conversions = []
+        for state, next_state in zip(states, states[1:]):
+            passed_number = self.get_entries_number(state) or self.get_exits_number(state)
+            converted_number = self.edges.get((state, next_state), 0)
+            conversions.append(converted_number / passed_number if passed_number else 0.0)
+
+        return conversions
+
+    def to_dict(self) -> Dict:
+
+        return {
+            "dwell_buckets": list(self.dwell_buckets),
+            "edges": [[source, destination, count] for (source, destination), count in self.edges.items()],
+            "dwell": [[state, counts] for state, counts in self.dwell.items()]
+        }
+
+    @classmethod
+    def from_dict(cls, snapshot: Dict) -> "FunnelSnapshot":
+
+        return cls(dwell_buckets=tuple(snapshot["dwell_buckets"]),
+                   edges={(source, destination): count for source, destination, count in snapshot["edges"]},
+                   dwell={state: list(counts) for state, counts in snapshot["dwell"]})
+
+
+class FunnelAggregator:
+
+    # Counters are kept in flat arrays indexed by states ids: edges in a «capacity x capacity» matrix,
+    # dwell times in a histogram row per state. The time of entering a state is tracked per address
+    # by this process only, so a dwell is counted when the same process sees both transitions.
+
+    def __init__(self, *, dwell_buckets: Sequence[float] = DEFAULT_DWELL_BUCKETS,
+                 max_tracked_addresses: int = 100000):
+
+        self._dwell_buckets = tuple(dwell_buckets)
+        self._max_tracked_addresses = max_tracked_addresses
+        self._states_ids: Dict[Optional[str], int] = {}
+        self._states: List[Optional[str]] = []
+        self._capacity = 0
+        self._edges = array("Q")
+        self._dwell = array("Q")
+        self._entered_states: "OrderedDict[Tuple, Tuple[int, float]]" = OrderedDict()  # address: (state id, time)
+
+    @property
+    def dwell_buckets(self) -> Tuple[float, ...]:
+
+        return self._dwell_buckets
+
+    def record(self, record: TransitionRecord) -> None:
+
+        source_id = self._get_state_id(record.source)
+        destination_id = self._get_state_id(record.destination)
+        if record.trigger != CHRONOLOGY_TRIGGER:  # a chronology is set by the code, not passed by the user
+            self._edges[source_id * self._capacity + destination_id] += 1
+
+        address = (record.chat, record.user)
+        entered_state = self._entered_states.pop(address, None)
+        if entered_state is not None and entered_state[0] == source_id:
+            bucket_index = bisect.bisect_left(self._dwell_buckets, record.timestamp - entered_state[1])
+            self._dwell[source_id * (len(self._dwell_buckets) + 1) + bucket_index] += 1
+
+        self._entered_states[address] = (destination_id, record.timestamp)
+        if len(self._entered_states) > self._max_tracked_addresses:
+            self._entered_states.popitem(last=False)
+
+    def get_snapshot(self, *, reset: bool = False) -> FunnelSnapshot:
+
+        row_size = len(self._dwell_buckets) + 1
+        edges = {}
+        dwell = {}
+        for source_id, source in enumerate(self._states):
+            offset = source_id * self._capacity
+            for destination_id, destination in enumerate(self._states):
+                count = self._edges[offset + destination_id]
+                if count:
+                    edges[(source, destination)] = count
+            counts = self._dwell[source_id * row_size:(source_id + 1) * row_size]
+            if any(counts):
+                dwell[source] = counts.tolist()
+
+        if reset:  # states ids and entered states remain, so dwell times keep being tracked
+            self._edges = array("Q", [0]) * len(self._edges)
+            self._dwell = array("Q", [0]) * len(self._dwell)
+
+        return FunnelSnapshot(dwell_buckets=self._dwell_buckets, edges=edges, dwell=dwell)
+
+    async def flush(self, store: "BaseFunnelStore") -> None:
+
+        snapshot = self.get_snapshot(reset=True)
+        if not snapshot.edges and not snapshot.dwell:
+            return
+
+        try:
+            await store.add(snapshot)
+        except Exception:
+            self.restore(snapshot)  # counters are not lost, they are flushed next time
+            raise
+
+        logger.debug(f"Funnel counters flushed: {sum(snapshot.edges.values())} transitions!")
+
+    def restore(self, snapshot: FunnelSnapshot) -> None:
+
+        row_size = len(self._dwell_buckets) + 1
+        for (source, destination), count in snapshot.edges.items():
+            source_id, destination_id = self._get_state_id(source), self._get_state_id(destination)
+            self._edges[source_id * self._capacity + destination_id] += count
+        for state, counts in snapshot.dwell.items():
+            offset = self._get_state_id(state) * row_size
+            for bucket_index, count in enumerate(counts):
+                self._dwell[offset + bucket_index] += count
+
+    async def run_flusher(self, store: "BaseFunnelStore", *, interval: float = 60.0) -> None:
+
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush(store)
+            except Exception:  # noqa, the flusher must survive temporary failures of the store
+                logger.exception("Flushing of funnel counters failed!")
+
+    def _get_state_id(self, state: Optional[str]) -> int:
+
+        state_id = self._states_ids.get(state)
+        if state_id is not None:
+            return state_id
+
+        state_id = len(self._states)
+        if state_id == self._capacity:
+            self._grow(max(self._capacity * 2, 8))
+        self._states_ids[state] = state_id
+        self._states.append(state)
+
+        return state_id
+
+    def _grow(self, capacity: int) -> None:
+
+        edges = array("Q", [0]) * (capacity * capacity)
+        for source_id in range(self._capacity):
+            old_offset, new_offset = source_id * self._capacity, source_id * capacity
+            edges[new_offset:new_offset + self._capacity] = self._edges[old_offset:old_offset + self._capacity]
+        self._edges = edges
+        self._dwell.extend(array("Q", [0]) * ((capacity - self._capacity) * (len(self._dwell_buckets) + 1)))
+        self._capacity = capacity
+
+
+class BaseFunnelStore(ABC):
+
+    @abstractmethod
+    async def add(self, snapshot: FunnelSnapshot) -> None:
+
+        # counters are added to the stored ones, so any number of processes can flush into one store
+        pass
+
+    @abstractmethod
+    async def load(self) -> FunnelSnapshot:
+
+        pass
+
+
+class MemoryFunnelStore(BaseFunnelStore):
+
+    def __init__(self, *, dwell_buckets: Sequence[float] = DEFAULT_DWELL_BUCKETS):
+
+        self._snapshot = FunnelSnapshot(dwell_buckets=tuple(dwell_buckets))
+
+    async def add(self, snapshot: FunnelSnapshot) -> None:
+
+        self._snapshot = self._snapshot.merge(snapshot)
+
+    async def load(self) -> FunnelSnapshot:
+
+        return copy.deepcopy(self._snapshot)
+
+
+class RedisFunnelStore(BaseFunnelStore):
+
+    # counters are kept in two hashes and increased by «HINCRBY», which merges flushes of all processes
+
+    def __init__(self, storage, *, dwell_buckets: Sequence[float] = DEFAULT_DWELL_BUCKETS):
+
+        self._storage = storage
+        self._dwell_buckets = tuple(dwell_buckets)
+        self._edges_key = storage.generate_key(FUNNEL_KEY, FUNNEL_EDGES_KEY)
+        self._dwell_key = storage.generate_key(FUNNEL_KEY, FUNNEL_DWELL_KEY)
+
+    async def add(self, snapshot: FunnelSnapshot) -> None:
+
+        if tuple(snapshot.dwell_buckets) != self._dwell_buckets:
+            raise ValueError(f"snapshot dwell buckets differ from the store ones "
+                             f"({snapshot.dwell_buckets} and {self._dwell_buckets})!")
+
+        redis_ = await self._storage.redis()
+        transaction = redis_.multi_exec()
+        for (source, destination), count in snapshot.edges.items():
+            transaction.hincrby(self._edges_key, json.dumps([source, destination]), count)
+        for state, counts in snapshot.dwell.items():
+            for bucket_index, count in enumerate(counts):
+                if count:
+                    transaction.hincrby(self._dwell_key, json.dumps([state, bucket_index]), count)
+        await transaction.execute()
+
+    async def load(self) -> FunnelSnapshot:
+
+        redis_ = await self._storage.redis()
+        raw_edges, raw_dwell = await asyncio.gather(redis_.hgetall(self._edges_key, encoding="utf8"),
+                                                    redis_.hgetall(self._dwell_key, encoding="utf8"))
+
+        snapshot = FunnelSnapshot(dwell_buckets=self._dwell_buckets)
+        for raw_edge, count in raw_edges.items():
+            source, destination = json.loads(raw_edge)
+            snapshot.edges[(source, destination)] = int(count)
+        for raw_bucket, count in raw_dwell.items():
+            state, bucket_index = json.loads(raw_bucket)
+            counts = snapshot.dwell.setdefault(state, [0] * (len(self._dwell_buckets) + 1))
+            counts[bucket_index] = int(count)
+
+        return snapshot
+
+
+def merge_snapshots(snapshots: Sequence[Union[FunnelSnapshot, Dict]]) -> FunnelSnapshot:
+
+    # e.g. snapshots dumped by different processes with «FunnelSnapshot.to_dict»
+    snapshots = [FunnelSnapshot.from_dict(i) if isinstance(i, dict) else i for i in snapshots]
+    if not snapshots:
+        return FunnelSnapshot()
+
+    merged_snapshot = snapshots[0]
+    for snapshot in snapshots[1:]:
+        merged_snapshot = merged_snapshot.merge(snapshot)
+
+    return merged_snapshot
@@ -0,0 +1,330 @@
+from abc import ABC, abstractmethod
+from typing import Optional, List, Dict, Tuple, Union, NamedTuple, Iterable, Iterator, AsyncIterator
+from pathlib import Path
+import contextlib
+import threading
+import asyncio
+import logging
+import gzip
+import json
+import time
+import os
+
+from aiogram_scenario.fsm.storages.base import BaseStorage
+
+
+logger = logging.getLogger(__name__)
+
+BACK_TRIGGER = "back"
+TIMEOUT_TRIGGER = "timeout"
+CHRONOLOGY_TRIGGER = "chronology"  # records of one chronology share a timestamp and replace the whole magazine
+JOURNAL_STREAM_KEY = "transitions_journal"
+
+
+class TransitionRecord(NamedTuple):
+
+    timestamp: float
+    chat: Union[str, int]
+    user: Union[str, int]
+    source: Optional[str]
+    destination: Optional[str]
+    trigger: Optional[str]
+
+    def to_dict(self) -> Dict:
+
+        return self._asdict()
+
+    @classmethod
+    def from_dict(cls, record: Dict) -> "TransitionRecord":
+
+        return cls(**{field: record.get(field) for field in cls._fields})
+
+
+class BaseJournalWriter(ABC):
+
+    @abstractmethod
+    async def write(self, records: List[TransitionRecord]) -> None:
+
+        pass
+
+    async def close(self) -> None:
+
+        pass
+
+
+class FileJournalWriter(BaseJournalWriter):
+
+    # Records are appended as JSON lines, a file bigger than «max_bytes» is renamed with a timestamp suffix
+    # and optionally gzipped; only «backups» newest rotated files are kept. File operations are done
+    # in the default executor, so the event loop is not blocked.
+
+    def __init__(self, filename: Union[str, Path], *,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 backups: int = 10,
+                 compress: bool = True):
+
+        self._path = Path(filename)
+        self._max_bytes = max_bytes
+        self._backups = backups
+        self._compress = compress
+        self._lock = threading.Lock()  # a write cancelled in the loop still finishes in its thread
+
+    @property
+    def filename(self) -> Path:
+
+        return self._path
+
+    def get_files(self) -> List[Path]:
+
+        # rotated files come first, from the oldest one, the current file is the last one
+        rotated_files = sorted(self._path.parent.glob(f"{self._path.name}.*"), key=_get_rotation_number)
+        return [*rotated_files, self._path] if self._path.exists() else rotated_files
+
+    async def write(self, records: List[TransitionRecord]) -> None:
+
+        lines = "".join(json.dumps(record.to_dict(), ensure_ascii=False) + "\n" for record in records)
+        await asyncio.get_event_loop().run_in_executor(None, self._write_lines, lines)
+
+    def _write_lines(self, lines: str) -> None:
+
+        with self._lock:
+            with self._path.open("a", encoding="utf-8") as file:
+                file.write(lines)
+                size = file.tell()
+
+            if size >= self._max_bytes:
+                self._rotate()
+
+    def _rotate(self) -> None:
+
+        rotated_path = self._path.with_name(f"{self._path.name}.{time.time_ns()}")
+        os.replace(self._path, rotated_path)
+        if self._compress:
+            compressed_path = rotated_path.with_name(rotated_path.name + ".gz")
+            with rotated_path.open("rb") as source, gzip.open(compressed_path, "wb") as destination:
+                while True:
+                    chunk = source.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    destination.write(chunk)
+            rotated_path.unlink()
+
+        rotated_paths = [path for path in self.get_files() if path != self._path]
+        for old_path in rotated_paths[:max(len(rotated_paths) - self._backups, 0)]:
+            old_path.unlink()
+
+        logger.debug(f"Transitions journal '{self._path}' is rotated!")
+
+
+class RedisStreamJournalWriter(BaseJournalWriter):
+
+    def __init__(self, storage, *,
+                 stream_key: str = JOURNAL_STREAM_KEY,
+                 max_length: Optional[int] = None):
+
+        self._storage = storage
+        self._stream_key = storage.generate_key(stream_key)
+        self._max_length = max_length  # the stream is trimmed approximately, which is cheap for Redis
+
+    async def write(self, records: List[TransitionRecord]) -> None:
+
+        redis_ = await self._storage.redis()
+        pipeline = redis_.pipeline()
+        for record in records:
+            pipeline.xadd(self._stream_key, {"record": json.dumps(record.to_dict(), ensure_ascii=False)},
+                          max_len=self._max_length, exact_len=False)
+        await pipeline.execute()
+
+
+class TransitionsJournal:
+
+    # The machine only puts records to a bounded queue, the writer gets them in batches from «run»,
+    # so the journal never slows transitions down: when the queue is full, records are dropped and counted.
+
+    def __init__(self, writer: BaseJournalWriter, *,
+                 max_queue_size: int = 10000,
+                 batch_size: int = 500,
+                 flush_interval: float = 1.0):
+
+        self._writer = writer
+        self._max_queue_size = max_queue_size
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.dropped_records = 0
+        self.written_records = 0
+
+    @property
+    def writer(self) -> BaseJournalWriter:
+
+        return self._writer
+
+    def record(self, record: TransitionRecord) -> None:
+
+        try:
+            self._get_queue().put_nowait(record)
+        except asyncio.QueueFull:
+            self.dropped_records += 1
+            if self.dropped_records == 1 or self.dropped_records % 1000 == 0:
+                logger.warning(f"Transitions journal queue is full, {self.dropped_records} records dropped!")
+
+    def start(self) -> asyncio.Task:
+
+        # «run» in the background, «close» stops it
+        self._task = asyncio.ensure_future(self.run())
+        return self._task
+
+    async def run(self) -> None:
+
+        queue = self._get_queue()
+        while True:
+            batch = [await queue.get()]
+            try:
+                await self._fill_batch(queue, batch)
+            finally:  # records already taken from the queue are written even when the journal is stopped
+                write_task = asyncio.ensure_future(self._write(batch))
+                try:
+                    await asyncio.shield(write_task)
+                except asyncio.CancelledError:
+                    await write_task
+                    raise
+
+    async def flush(self) -> None:
+
+        queue = self._get_queue()
+        while not queue.empty():
+            batch = [queue.get_nowait() for _ in range(min(self._batch_size, queue.qsize()))]
+            await self._write(batch)
+
+    async def close(self) -> None:
+
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        await self.flush()
+        await self._writer.close()
+
+    async def _fill_batch(self, queue: asyncio.Queue, batch: List[TransitionRecord]) -> None:
+
+        # a full batch is written at once, a partial one waits for more records until the flush interval passes;
+        # «wait_for» on «get» is not used, as it may lose a record on timeout
+        deadline = time.monotonic() + self._flush_interval
+        while len(batch) < self._batch_size:
+            if queue.empty():
+                delay = deadline - time.monotonic()
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+                if queue.empty():
+                    break
+            batch.append(queue.get_nowait())
+
+    async def _write(self, batch: List[TransitionRecord]) -> None:
+
+        try:
+            await self._writer.write(batch)
+        except Exception:  # noqa, the journal must survive temporary failures of its backend
+            self.dropped_records += len(batch)
+            logger.exception(f"Transitions journal failed to write {len(batch)} records!")
+        else:
+            self.written_records += len(batch)
+
+    def _get_queue(self) -> asyncio.Queue:
+
+        # created lazily to be bound to the running loop
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self._max_queue_size)
+
+        return self._queue
+
+
+def iter_journal_files(filenames: Iterable[Union[str, Path]]) -> Iterator[TransitionRecord]:
+
+    for filename in filenames:
+        path = Path(filename)
+        opener = gzip.open if path.suffix == ".gz" else open
+        with opener(path, "rt", encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    yield TransitionRecord.from_dict(json.loads(line))
+
+
+def replay_magazines(records: Iterable[TransitionRecord]) -> Dict[Tuple[Union[str, int], Union[str, int]],
+                                                                  List[Optional[str]]]:
+
+    # states are set the same way as «Magazine.set» does, records must be in the journal order
+    magazines = {}
+    chronologies = {}  # address: timestamp of the chronology being replayed
+    for record in records:
+        address = (record.chat, record.user)
+        states = magazines.get(address)
+        if record.trigger == CHRONOLOGY_TRIGGER:
+            if chronologies.get(address) != record.timestamp:
+                chronologies[address] = record.timestamp
+                states = []
+        else:
+            chronologies.pop(address, None)
+        if states is None:
+            states = [None]
+
+        try:
+            del states[states.index(record.destination) + 1:]
+        except ValueError:
+            states.append(record.destination)
+        magazines[address] = states
+
+    return magazines
+
+
+def compact_records(records: Iterable[TransitionRecord]) -> List[TransitionRecord]:
+
+    # the journal is reduced to one chronology per address, replaying it gives the same magazines
+    records = list(records)
+    magazines = replay_magazines(records)
+    timestamps = {(record.chat, record.user): record.timestamp for record in records}
+
+    compacted_records = []
+    for (chat, user), states in magazines.items():
+        for source, destination in zip([None, *states], states):
+            compacted_records.append(TransitionRecord(timestamp=timestamps[(chat, user)], chat=chat, user=user,
+                                                      source=source, destination=destination,
+                                                      trigger=CHRONOLOGY_TRIGGER))
+
+    return compacted_records
+
+
+async def iter_journal_stream(storage, *,
+                              stream_key: str = JOURNAL_STREAM_KEY,
+                              batch_size: int = 1000) -> AsyncIterator[TransitionRecord]:
+
+    redis_ = await storage.redis()
+    key = storage.generate_key(stream_key)
+    start = "-"
+    while True:
+        entries = await redis_.xrange(key, start=start, stop="+", count=batch_size)
+        for _, fields in entries:
+            raw_record = fields.get(b"record", fields.get("record"))
+            yield TransitionRecord.from_dict(json.loads(raw_record))
+        if len(entries) < batch_size:
+            break
+        last_id = entries[-1][0]
+        start = "(" + (last_id.decode() if isinstance(last_id, bytes) else last_id)  # exclusive since Redis 6.2
+
+
+async def restore_magazines(storage: BaseStorage,
+                            magazines: Dict[Tuple[Union[str, int], Union[str, int]], List[Optional[str]]]) -> None:
+
+    for (chat, user), states in magazines.items():
+        await storage.set_magazine_states(chat=chat, user=user, states=states)
+
+    logger.info(f"{len(magazines)} magazines are restored from the transitions journal!")
+
+
+def _get_rotation_number(path: Path) -> int:
+
+    suffix = path.name.rsplit(".", 2)
+    number = suffix[-2] if suffix[-1] == "gz" else suffix[-1]
+    return int(number) if number.isdigit() else 0
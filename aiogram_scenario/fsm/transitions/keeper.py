@@ -1,4 +1,4 @@
-from typing import Dict, Callable, Set
+from typing import Dict, Callable, Set, Union, FrozenSet
 import logging
 
 from aiogram_scenario.fsm.state import AbstractState
@@ -16,13 +16,22 @@ def _check_equivalent_states(source_state: AbstractState, destination_state: Abs
         )
 
 
+def get_trigger_name(trigger_func: Union[Callable, str], qualified: bool = False) -> str:
+
+    if isinstance(trigger_func, str):  # trigger func is referred by name (lazy loading of states)
+        return trigger_func
+
+    return trigger_func.__qualname__ if qualified else trigger_func.__name__
+
+
 class TransitionsKeeper:
 
     def __init__(self):
 
-        self._transitions: Dict[AbstractState, Dict[Callable, AbstractState]] = {}
+        self._transitions: Dict[AbstractState, Dict[Union[Callable, str], AbstractState]] = {}
         self._states: Set[AbstractState] = set()
         self._source_states: Set[AbstractState] = set()
+        self._successors: Dict[AbstractState, FrozenSet[AbstractState]] = {}  # built on demand
 
     def __getitem__(self, item):
 
@@ -31,18 +40,24 @@ class TransitionsKeeper:
     def __setitem__(self, key, value):
 
         self._transitions[key] = value
+        self._successors.pop(key, None)
 
     @property
     def serialized_transitions(self) -> Dict[str, Dict[str, str]]:
 
         return {
             str(source_state): {
-                trigger_func.__name__: str(destination_state)
+                get_trigger_name(trigger_func): str(destination_state)
                 for trigger_func, destination_state in self._transitions[source_state].items()
             }
             for source_state in self._transitions.keys()
         }
 
+    @property
+    def transitions(self) -> Dict[AbstractState, Dict[Union[Callable, str], AbstractState]]:
+
+        return self._transitions
+
     @property
     def source_states(self) -> Set[AbstractState]:
 
@@ -53,8 +68,33 @@ class TransitionsKeeper:
 
         return self._states
 
+    def get_successors(self, source_state: AbstractState) -> FrozenSet[AbstractState]:
+
+        successors = self._successors.get(source_state)
+        if successors is None:
+            successors = frozenset(self._transitions.get(source_state, {}).values())
+            self._successors[source_state] = successors
+
+        return successors
+
+    def has_transition(self, source_state: AbstractState, destination_state: AbstractState) -> bool:
+
+        return destination_state in self.get_successors(source_state)
+
+    def load_transitions(self, transitions: Dict[AbstractState, Dict[Union[Callable, str], AbstractState]]) -> None:
+
+        # transitions are expected to be validated in advance (see the scenario artifact)
+        self._transitions = transitions
+        self._successors.clear()
+        self._source_states = set(transitions.keys())
+        self._states = set(self._source_states)
+        for destinations in transitions.values():
+            self._states.update(destinations.values())
+
+        logger.debug(f"Loaded transitions of {len(self._states)} states!")
+
     def add_transition(self, source_state: AbstractState,
-                       trigger_func: Callable,
+                       trigger_func: Union[Callable, str],
                        destination_state: AbstractState) -> None:
 
         _check_equivalent_states(source_state, destination_state)
@@ -63,26 +103,28 @@ class TransitionsKeeper:
             self._transitions[source_state] = {trigger_func: destination_state}
         elif self._transitions[source_state].get(trigger_func) is not None:
             raise exceptions.fsm.TransitionAddingError(
-                f"transition for trigger func '{trigger_func.__qualname__}' is "
+                f"transition for trigger func '{get_trigger_name(trigger_func, qualified=True)}' is "
                 f"already defined in '{source_state}' state!"
             )
         else:
             self._transitions[source_state][trigger_func] = destination_state
 
         self._source_states.add(source_state)
+        self._successors.pop(source_state, None)
         for state in (source_state, destination_state):
             self._states.add(state)
 
         logger.debug(f"Added transition from '{source_state}' "
-                     f"('{trigger_func.__qualname__}') to '{destination_state}'!")
+                     f"('{get_trigger_name(trigger_func, qualified=True)}') to '{destination_state}'!")
 
     def remove_transition(self, source_state: AbstractState,
-                          trigger_func: Callable,
+                          trigger_func: Union[Callable, str],
                           destination_state: AbstractState) -> None:
 
         _check_equivalent_states(source_state, destination_state)
 
         del self._transitions[source_state][trigger_func]
+        self._successors.pop(source_state, None)
         if not self._transitions[source_state]:
             del self._transitions[source_state]
             self._source_states.remove(source_state)
@@ -97,4 +139,4 @@ class TransitionsKeeper:
                 self._states.remove(state)
 
         logger.debug(f"Removed transition from '{source_state}' "
-                     f"('{trigger_func.__qualname__}') to '{destination_state}'!")
+                     f"('{get_trigger_name(trigger_func, qualified=True)}') to '{destination_state}'!")
@@ -119,20 +119,20 @@ class TransitionsLocksStorage:
         elif user_id is not None and chat_id is None:
             chat_id = user_id
 
-        return user_id, chat_id
+        return chat_id, user_id
 
     def _set_lock(self, *, user_id: Optional[int], chat_id: Optional[int]) -> None:
 
-        user_id, chat_id = self._resolve_address(user_id=user_id, chat_id=chat_id)
+        chat_id, user_id = self._resolve_address(user_id=user_id, chat_id=chat_id)
 
         try:
-            self._locks[chat_id].add_transition(user_id)
+            self._locks[chat_id].add(user_id)
         except KeyError:
             self._locks[chat_id] = {user_id}
 
     def _unset_lock(self, *, user_id: Optional[int], chat_id: Optional[int]) -> None:
 
-        user_id, chat_id = self._resolve_address(user_id=user_id, chat_id=chat_id)
+        chat_id, user_id = self._resolve_address(user_id=user_id, chat_id=chat_id)
 
         chat_users_ids: set = self._locks[chat_id]
         chat_users_ids.remove(user_id)
@@ -141,7 +141,7 @@ class TransitionsLocksStorage:
 
     def _check_locking(self, *, user_id: Optional[int] = None, chat_id: Optional[int] = None) -> bool:
 
-        user_id, chat_id = self._resolve_address(user_id=user_id, chat_id=chat_id)
+        chat_id, user_id = self._resolve_address(user_id=user_id, chat_id=chat_id)
 
         try:
             chat_users_ids: set = self._locks[chat_id]
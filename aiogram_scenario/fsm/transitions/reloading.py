@@ -0,0 +1,105 @@
+from typing import Optional, Collection, Callable, Tuple
+import asyncio
+import logging
+import os
+
+from aiogram.contrib.fsm_storage import redis
+
+from aiogram_scenario.fsm.fsm import FiniteStateMachine
+from aiogram_scenario.fsm.state import AbstractState
+from aiogram_scenario.transitions_storages.base import AbstractTransitionsStorage
+
+
+logger = logging.getLogger(__name__)
+RELOAD_CHANNEL = "transitions_reload"
+
+
+class TransitionsReloader:
+
+    def __init__(self, fsm: FiniteStateMachine, storage: AbstractTransitionsStorage, *,
+                 states: Collection[AbstractState],
+                 triggers_funcs: Optional[Collection[Callable]] = None):
+
+        self._fsm = fsm
+        self._storage = storage
+        self._states = states
+        self._triggers_funcs = triggers_funcs
+
+    def reload(self) -> bool:
+
+        try:
+            self._fsm.reload_transitions(self._storage, states=self._states, triggers_funcs=self._triggers_funcs)
+        except Exception:  # noqa, a broken scenario file must not stop the workers
+            logger.exception(f"Transitions from '{self._storage.filename}' are not reloaded, "
+                             f"the current ones remain!")
+            return False
+
+        return True
+
+
+class TransitionsFileWatcher(TransitionsReloader):
+
+    # the file is polled, so no extra dependencies are needed and it works on any file system
+
+    def __init__(self, fsm: FiniteStateMachine, storage: AbstractTransitionsStorage, *,
+                 states: Collection[AbstractState],
+                 triggers_funcs: Optional[Collection[Callable]] = None,
+                 interval: float = 1.0):
+
+        super().__init__(fsm, storage, states=states, triggers_funcs=triggers_funcs)
+        self._interval = interval
+        self._file_signature = self._get_file_signature()
+
+    async def run(self) -> None:
+
+        while True:
+            await asyncio.sleep(self._interval)
+            file_signature = self._get_file_signature()
+            if file_signature is None or file_signature == self._file_signature:
+                continue
+
+            logger.debug(f"File '{self._storage.filename}' is changed, transitions are being reloaded...")
+            self._file_signature = file_signature
+            self.reload()
+
+    def _get_file_signature(self) -> Optional[Tuple[int, int]]:
+
+        try:
+            stat = os.stat(self._storage.filename)
+        except FileNotFoundError:  # the file may be replaced right now
+            return None
+
+        return stat.st_mtime_ns, stat.st_size
+
+
+class RedisTransitionsReloader(TransitionsReloader):
+
+    # every worker subscribes to the channel, a message published once reloads all of them
+
+    def __init__(self, fsm: FiniteStateMachine, storage: AbstractTransitionsStorage, *,
+                 states: Collection[AbstractState],
+                 redis_storage: redis.RedisStorage2,
+                 triggers_funcs: Optional[Collection[Callable]] = None,
+                 channel: str = RELOAD_CHANNEL):
+
+        super().__init__(fsm, storage, states=states, triggers_funcs=triggers_funcs)
+        self._redis_storage = redis_storage
+        self._channel = redis_storage.generate_key(channel)
+
+    async def run(self) -> None:
+
+        redis_ = await self._redis_storage.redis()
+        channel, = await redis_.subscribe(self._channel)
+        try:
+            while await channel.wait_message():
+                await channel.get()
+                logger.debug(f"Reload message is received from '{self._channel}', transitions are being reloaded...")
+                self.reload()
+        finally:
+            await redis_.unsubscribe(self._channel)
+
+    async def publish_reload(self) -> int:
+
+        redis_ = await self._redis_storage.redis()
+
+        return await redis_.publish(self._channel, "reload")
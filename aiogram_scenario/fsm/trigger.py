@@ -1,15 +1,20 @@
 from typing import Optional
+import functools
 import logging
 
 from aiogram.dispatcher.handler import current_handler, ctx_data
 from aiogram.types import Update, User, Chat
 
 from .fsm import FiniteStateMachine
+from .scope import resolve_address
+from .rate_limits.limiter import TransitionsRateLimiter
+from .unit_of_work import get_current_unit_of_work
 from aiogram_scenario.helpers import EVENT_UNION_TYPE
+from aiogram_scenario.fsm.transitions.journal import BACK_TRIGGER
 
 
 logger = logging.getLogger(__name__)
-_UPDATE_TYPES = (
+UPDATE_TYPES = (
     "message",
     "callback_query",
     "inline_query",
@@ -20,7 +25,10 @@ _UPDATE_TYPES = (
     "shipping_query",
     "pre_checkout_query",
     "poll",
-    "poll_answer"
+    "poll_answer",
+    "my_chat_member",
+    "chat_member",
+    "chat_join_request"
 )
 
 
@@ -41,7 +49,7 @@ def get_current_chat_id() -> Optional[int]:
 def get_current_event() -> EVENT_UNION_TYPE:
 
     update = Update.get_current()
-    for event_type_attr in _UPDATE_TYPES:
+    for event_type_attr in UPDATE_TYPES:
         event = getattr(update, event_type_attr)
         if event is not None:
             return event
@@ -51,11 +59,13 @@ def get_current_event() -> EVENT_UNION_TYPE:
 
 class FSMTrigger:
 
-    __slots__ = ("_fsm",)
+    __slots__ = ("_fsm", "_rate_limiter")
 
-    def __init__(self, fsm: FiniteStateMachine):
+    def __init__(self, fsm: FiniteStateMachine, *,
+                 rate_limiter: Optional[TransitionsRateLimiter] = None):
 
         self._fsm = fsm
+        self._rate_limiter = rate_limiter
 
     async def go_next(self) -> None:
 
@@ -65,14 +75,19 @@ class FSMTrigger:
         logger.debug("FSM received a request to move to next state "
                      f"({user_id=}, {chat_id=})...")
 
-        await self._fsm.execute_next_transition(
-            trigger_func=current_handler.get(),
+        trigger_func = current_handler.get()
+        context_kwargs = ctx_data.get()
+        transition = functools.partial(
+            self._fsm.execute_next_transition,
+            trigger_func=trigger_func,
             event=get_current_event(),
-            context_kwargs=ctx_data.get(),
+            context_kwargs=context_kwargs,
             user_id=user_id,
             chat_id=chat_id
         )
 
+        await self._execute(transition, trigger=trigger_func.__name__, user_id=user_id, chat_id=chat_id)
+
     async def go_back(self) -> None:
 
         user_id = get_current_user_id()
@@ -81,9 +96,33 @@ class FSMTrigger:
         logger.debug("FSM received a request to move to previous state "
                      f"({user_id=}, {chat_id=})...")
 
-        await self._fsm.execute_back_transition(
+        context_kwargs = ctx_data.get()
+        transition = functools.partial(
+            self._fsm.execute_back_transition,
             event=get_current_event(),
-            context_kwargs=ctx_data.get(),
+            context_kwargs=context_kwargs,
             user_id=user_id,
             chat_id=chat_id
         )
+
+        await self._execute(transition, trigger=BACK_TRIGGER, user_id=user_id, chat_id=chat_id)
+
+    async def _execute(self, transition: functools.partial, *,
+                       trigger: str,
+                       user_id: Optional[int],
+                       chat_id: Optional[int]) -> None:
+
+        if self._rate_limiter is None:
+            return await transition()
+
+        chat_id, user_id = resolve_address(self._fsm.scope, chat_id=chat_id, user_id=user_id)
+        # the state is read from the magazine, as not every handler gets it from a state filter;
+        # the one of the unit of work is read once per update (with data and bucket)
+        state = None
+        if self._rate_limiter.is_state_dependent(trigger):
+            unit_of_work = get_current_unit_of_work()
+            if unit_of_work is not None:
+                state = (await unit_of_work.get_magazine()).current_state
+            else:
+                state = await self._fsm.storage.get_state(chat=chat_id, user=user_id)
+        await self._rate_limiter.execute(transition, chat=chat_id, user=user_id, trigger=trigger, state=state)
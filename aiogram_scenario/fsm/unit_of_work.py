@@ -0,0 +1,118 @@
+from typing import Union, Optional, Dict
+import contextvars
+import asyncio
+import logging
+import copy
+
+from aiogram_scenario.fsm.storages.base import BaseStorage, Magazine
+
+
+logger = logging.getLogger(__name__)
+_current_unit_of_work = contextvars.ContextVar("current_unit_of_work", default=None)
+
+
+def get_current_unit_of_work() -> Optional["FSMUnitOfWork"]:
+
+    # set by «FSMMiddleware» for the update being processed
+    return _current_unit_of_work.get()
+
+
+class FSMUnitOfWork:
+
+    # Magazine, data and bucket of the address are read together on first access, changes of data and bucket
+    # are written together on commit. The magazine is only read here: transitions commit it by themselves.
+    # Only the magazine is shared by the FSM scope, data and bucket stay per (chat, user) as in FSMContext.
+
+    def __init__(self, storage: BaseStorage, *,
+                 chat: Union[str, int, None] = None,
+                 user: Union[str, int, None] = None):
+
+        self._storage = storage
+        self._chat, self._user = storage.check_address(chat=chat, user=user)
+        self._magazine_chat, self._magazine_user = storage.resolve_scope_address(chat=chat, user=user)
+        self._load_lock = asyncio.Lock()
+        self._magazine: Optional[Magazine] = None
+        self._data: Optional[Dict] = None
+        self._bucket: Optional[Dict] = None
+        self._committed_data: Optional[Dict] = None
+        self._committed_bucket: Optional[Dict] = None
+
+    @property
+    def is_loaded(self) -> bool:
+
+        return self._magazine is not None
+
+    @property
+    def is_dirty(self) -> bool:
+
+        # in-place changes of the returned dicts are detected as well
+        return self.is_loaded and (self._data != self._committed_data or self._bucket != self._committed_bucket)
+
+    async def load(self) -> None:
+
+        async with self._load_lock:
+            if self.is_loaded:
+                return
+
+            record = await self._storage.get_address_record(chat=self._chat, user=self._user,
+                                                            magazine_chat=self._magazine_chat,
+                                                            magazine_user=self._magazine_user)
+            magazine = self._storage.get_magazine(chat=self._magazine_chat, user=self._magazine_user)
+            magazine.set_record(record.states, record.version)
+            self._data, self._bucket = record.data, record.bucket
+            self._committed_data, self._committed_bucket = copy.deepcopy(record.data), copy.deepcopy(record.bucket)
+            self._magazine = magazine
+
+    async def get_magazine(self) -> Magazine:
+
+        await self.load()
+        return self._magazine
+
+    async def get_data(self) -> Dict:
+
+        await self.load()
+        return self._data
+
+    async def set_data(self, data: Dict) -> None:
+
+        await self.load()
+        self._data = dict(data)
+
+    async def update_data(self, data: Optional[Dict] = None, **kwargs) -> None:
+
+        await self.load()
+        self._data.update(data or {}, **kwargs)
+
+    async def get_bucket(self) -> Dict:
+
+        await self.load()
+        return self._bucket
+
+    async def set_bucket(self, bucket: Dict) -> None:
+
+        await self.load()
+        self._bucket = dict(bucket)
+
+    async def update_bucket(self, bucket: Optional[Dict] = None, **kwargs) -> None:
+
+        await self.load()
+        self._bucket.update(bucket or {}, **kwargs)
+
+    async def commit(self) -> None:
+
+        if not self.is_dirty:
+            return
+
+        data = self._data if self._data != self._committed_data else None
+        bucket = self._bucket if self._bucket != self._committed_bucket else None
+        await self._storage.set_address_record(chat=self._chat, user=self._user, data=data, bucket=bucket)
+        self._committed_data, self._committed_bucket = copy.deepcopy(self._data), copy.deepcopy(self._bucket)
+
+        changed_fields = [name for name, value in (("data", data), ("bucket", bucket)) if value is not None]
+        logger.debug(f"Unit of work committed changes of {', '.join(changed_fields)} "
+                     f"(user_id={self._user}, chat_id={self._chat})!")
+
+    def rollback(self) -> None:
+
+        if self.is_loaded:
+            self._data, self._bucket = copy.deepcopy(self._committed_data), copy.deepcopy(self._committed_bucket)
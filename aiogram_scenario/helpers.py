@@ -1,12 +1,49 @@
+import importlib
 import inspect
-from typing import Callable, Union
+from typing import Callable, Dict, Optional, Union
 
-from aiogram.types.update import (Message, CallbackQuery, InlineQuery, ChosenInlineResult,
-                                  ShippingQuery, PreCheckoutQuery, Poll, PollAnswer)
 
+def make_lazy_module(namespace: dict, lazy_attrs: Dict[str, Optional[str]]) -> None:
 
-EVENT_UNION_TYPE = Union[Message, CallbackQuery, InlineQuery, ChosenInlineResult,
-                         ShippingQuery, PreCheckoutQuery, Poll, PollAnswer]
+    # Public names of a package are imported on its first access to them, «lazy_attrs» maps each name
+    # to the module it is taken from (None - the name is a submodule itself).
+    package_name = namespace["__name__"]
+
+    def __getattr__(name: str):
+
+        try:
+            module_name = lazy_attrs[name]
+        except KeyError:
+            raise AttributeError(f"module '{package_name}' has no attribute '{name}'")
+
+        if module_name is None:
+            value = importlib.import_module(f".{name}", package_name)
+        else:
+            value = getattr(importlib.import_module(module_name, package_name), name)
+        namespace[name] = value
+
+        return value
+
+    def __dir__():
+
+        return [*namespace, *lazy_attrs]
+
+    namespace.update(__getattr__=__getattr__, __dir__=__dir__)
+
+
+def __getattr__(name: str):
+
+    # the packages use this module to be lazy, so aiogram types are imported only when they are needed
+    if name != "EVENT_UNION_TYPE":
+        raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+    from aiogram.types.update import (Message, CallbackQuery, InlineQuery, ChosenInlineResult,
+                                      ShippingQuery, PreCheckoutQuery, Poll, PollAnswer)
+
+    value = globals()[name] = Union[Message, CallbackQuery, InlineQuery, ChosenInlineResult,
+                                    ShippingQuery, PreCheckoutQuery, Poll, PollAnswer]
+
+    return value
 
 
 def get_existing_kwargs(callback: Callable,
@@ -14,6 +51,13 @@ def get_existing_kwargs(callback: Callable,
                         **kwargs: dict) -> dict:
 
     spec = inspect.getfullargspec(callback)
+    return filter_kwargs_by_spec(spec, kwargs, check_varkw=check_varkw)
+
+
+def filter_kwargs_by_spec(spec: inspect.FullArgSpec,
+                          kwargs: dict,
+                          check_varkw: bool = False) -> dict:
+
     if check_varkw and (spec.varkw is not None):
         return kwargs
 
@@ -1,11 +1,15 @@
-from typing import Callable, Collection, List
+from typing import Callable, Collection, List, Optional
 import logging
 import functools
+import time
 
 from aiogram import Dispatcher
 
 from . import helpers
-from aiogram_scenario.fsm.state import AbstractState
+from aiogram_scenario import exceptions
+from aiogram_scenario.fsm.state import AbstractState, LazyState
+from aiogram_scenario.routing import StatesRouter
+from aiogram_scenario.registration_plan import RegistrationPlan, RegistrationRecorder, get_plan_fingerprint
 
 
 logger = logging.getLogger(__name__)
@@ -23,10 +27,12 @@ def _log_registration_handler(callback: Callable, handler_type: str) -> None:
 
 class Registrar:
 
-    def __init__(self, dispatcher: Dispatcher, state: AbstractState):
+    def __init__(self, dispatcher: Dispatcher, state: AbstractState, *,
+                 router: Optional[StatesRouter] = None):
 
         self._dispatcher = dispatcher
         self._state = state
+        self._registry = router if router is not None else dispatcher
 
     def register_message_handler(self, callback: Callable,
                                  *custom_filters,
@@ -36,9 +42,9 @@ class Registrar:
                                  run_task=None,
                                  **kwargs) -> None:
 
-        self._dispatcher.register_message_handler(callback, *custom_filters, commands=commands, regexp=regexp,
-                                                  content_types=content_types, state=self._state.raw_value,
-                                                  run_task=run_task, **kwargs)
+        self._registry.register_message_handler(callback, *custom_filters, commands=commands, regexp=regexp,
+                                                content_types=content_types, state=self._state.raw_value,
+                                                run_task=run_task, **kwargs)
         _log_registration_handler_on_state(callback, "message", self._state)
 
     def register_callback_query_handler(self, callback: Callable,
@@ -46,8 +52,8 @@ class Registrar:
                                         run_task=None,
                                         **kwargs) -> None:
 
-        self._dispatcher.register_callback_query_handler(callback, *custom_filters, state=self._state.raw_value,
-                                                         run_task=run_task, **kwargs)
+        self._registry.register_callback_query_handler(callback, *custom_filters, state=self._state.raw_value,
+                                                       run_task=run_task, **kwargs)
         _log_registration_handler_on_state(callback, "callback_query", self._state)
 
     def register_channel_post_handler(self, callback: Callable,
@@ -58,9 +64,9 @@ class Registrar:
                                       run_task=None,
                                       **kwargs) -> None:
 
-        self._dispatcher.register_channel_post_handler(callback, *custom_filters, commands=commands, regexp=regexp,
-                                                       content_types=content_types, state=self._state.raw_value,
-                                                       run_task=run_task, **kwargs)
+        self._registry.register_channel_post_handler(callback, *custom_filters, commands=commands, regexp=regexp,
+                                                     content_types=content_types, state=self._state.raw_value,
+                                                     run_task=run_task, **kwargs)
         _log_registration_handler_on_state(callback, "channel_post", self._state)
 
     def register_chosen_inline_handler(self, callback: Callable,
@@ -68,8 +74,8 @@ class Registrar:
                                        run_task=None,
                                        **kwargs) -> None:
 
-        self._dispatcher.register_chosen_inline_handler(callback, *custom_filters, state=self._state.raw_value,
-                                                        run_task=run_task, **kwargs)
+        self._registry.register_chosen_inline_handler(callback, *custom_filters, state=self._state.raw_value,
+                                                      run_task=run_task, **kwargs)
         _log_registration_handler_on_state(callback, "chosen_inline", self._state)
 
     def register_edited_channel_post_handler(self, callback: Callable,
@@ -80,9 +86,9 @@ class Registrar:
                                              run_task=None,
                                              **kwargs) -> None:
 
-        self._dispatcher.register_edited_channel_post_handler(callback, *custom_filters, commands=commands,
-                                                              regexp=regexp, content_types=content_types,
-                                                              state=self._state.raw_value, run_task=run_task, **kwargs)
+        self._registry.register_edited_channel_post_handler(callback, *custom_filters, commands=commands,
+                                                            regexp=regexp, content_types=content_types,
+                                                            state=self._state.raw_value, run_task=run_task, **kwargs)
         _log_registration_handler_on_state(callback, "edited_channel_post", self._state)
 
     def register_edited_message_handler(self, callback: Callable,
@@ -93,9 +99,9 @@ class Registrar:
                                         run_task=None,
                                         **kwargs) -> None:
 
-        self._dispatcher.register_edited_message_handler(callback, *custom_filters, commands=commands, regexp=regexp,
-                                                         content_types=content_types, state=self._state.raw_value,
-                                                         run_task=run_task, **kwargs)
+        self._registry.register_edited_message_handler(callback, *custom_filters, commands=commands, regexp=regexp,
+                                                       content_types=content_types, state=self._state.raw_value,
+                                                       run_task=run_task, **kwargs)
         _log_registration_handler_on_state(callback, "edited_message", self._state)
 
     def register_inline_handler(self, callback: Callable,
@@ -103,8 +109,8 @@ class Registrar:
                                 run_task=None,
                                 **kwargs) -> None:
 
-        self._dispatcher.register_inline_handler(callback, *custom_filters, state=self._state.raw_value,
-                                                 run_task=run_task, **kwargs)
+        self._registry.register_inline_handler(callback, *custom_filters, state=self._state.raw_value,
+                                               run_task=run_task, **kwargs)
         _log_registration_handler_on_state(callback, "inline", self._state)
 
     def register_pre_checkout_query_handler(self, callback: Callable,
@@ -112,8 +118,8 @@ class Registrar:
                                             run_task=None,
                                             **kwargs) -> None:
 
-        self._dispatcher.register_pre_checkout_query_handler(callback, *custom_filters, state=self._state.raw_value,
-                                                             run_task=run_task, **kwargs)
+        self._registry.register_pre_checkout_query_handler(callback, *custom_filters, state=self._state.raw_value,
+                                                           run_task=run_task, **kwargs)
         _log_registration_handler_on_state(callback, "pre_checkout_query", self._state)
 
     def register_shipping_query_handler(self, callback: Callable,
@@ -121,24 +127,93 @@ class Registrar:
                                         run_task=None,
                                         **kwargs) -> None:
 
-        self._dispatcher.register_shipping_query_handler(callback, *custom_filters, state=self._state.raw_value,
-                                                         run_task=run_task, **kwargs)
+        self._registry.register_shipping_query_handler(callback, *custom_filters, state=self._state.raw_value,
+                                                       run_task=run_task, **kwargs)
         _log_registration_handler_on_state(callback, "shipping_query", self._state)
 
 
 class MainRegistrar:
 
-    def __init__(self, dispatcher: Dispatcher):
+    def __init__(self, dispatcher: Dispatcher, *, router: Optional[StatesRouter] = None):
 
         self._dispatcher = dispatcher
+        self._router = router
+        self._registry = router if router is not None else dispatcher
 
     def register_fsm_handlers(self, states: Collection[AbstractState],
                               **reg_kwargs) -> None:
 
         for state in states:
-            registrar = Registrar(self._dispatcher, state=state)
+            if isinstance(state, LazyState) and (self._router is not None) and (not state.is_loaded):
+                self._router.defer_state(state.raw_value,
+                                         functools.partial(self._register_state_handlers, state, reg_kwargs))
+            else:
+                self._register_state_handlers(state, reg_kwargs)
+
+    def compile_fsm_handlers(self, states: Collection[AbstractState],
+                             **reg_kwargs) -> RegistrationPlan:
+
+        recorder = RegistrationRecorder()
+        kwargs_time = 0.0
+        handlers_time = 0.0
+        for state in states:
+            started_at = time.perf_counter()
+            registrar = Registrar(self._dispatcher, state=state, router=recorder)
+            if isinstance(state, LazyState):
+                state = state.state
             state_reg_kwargs = helpers.get_existing_kwargs(state.register_handlers, **reg_kwargs)
+            kwargs_time += time.perf_counter() - started_at
+
+            started_at = time.perf_counter()
             state.register_handlers(registrar, **state_reg_kwargs)
+            handlers_time += time.perf_counter() - started_at
+
+        recorder.plan.states = [str(state) for state in states]
+        recorder.plan.timings.update(kwargs_resolution=kwargs_time, handlers_collection=handlers_time)
+        logger.debug(f"Registration plan compiled: {len(recorder.plan.handlers)} handlers of {len(states)} states "
+                     f"(kwargs resolution: {kwargs_time:.4f}s, handlers collection: {handlers_time:.4f}s)!")
+
+        return recorder.plan
+
+    def register_plan(self, plan: RegistrationPlan) -> None:
+
+        started_at = time.perf_counter()
+        plan.replay(self._registry)
+        plan.timings["replay"] = time.perf_counter() - started_at
+
+        logger.debug(f"Registration plan replayed: {len(plan.handlers)} handlers "
+                     f"(replay: {plan.timings['replay']:.4f}s)!")
+
+    def register_fsm_handlers_cached(self, states: Collection[AbstractState],
+                                     filename: str,
+                                     **reg_kwargs) -> RegistrationPlan:
+
+        # Replaying a plan imports the module of every callback, so lazy states are loaded anyway;
+        # «register_fsm_handlers» with a router keeps them deferred.
+        try:
+            started_at = time.perf_counter()
+            plan = RegistrationPlan.load(filename)
+            plan.timings["loading"] = time.perf_counter() - started_at
+        except FileNotFoundError:
+            plan = None
+        except exceptions.registration.RegistrationPlanError as e:
+            logger.warning(f"Registration plan will be recompiled, as it is invalid: {e}")
+            plan = None
+
+        fingerprint = get_plan_fingerprint(states, reg_kwargs)
+        if plan is None or plan.states != [str(state) for state in states] or plan.fingerprint != fingerprint:
+            plan = self.compile_fsm_handlers(states, **reg_kwargs)
+            plan.fingerprint = fingerprint
+            try:
+                plan.dump(filename)
+            except exceptions.registration.RegistrationPlanError as e:  # the handlers are registered without a file
+                logger.warning(f"Registration plan isn't saved: {e}")
+            else:
+                logger.debug(f"Registration plan saved to '{filename}'!")
+
+        self.register_plan(plan)
+
+        return plan
 
     def register_message_handler(self, callback: Callable,
                                  states: List[AbstractState],
@@ -149,7 +224,7 @@ class MainRegistrar:
                                  run_task=None,
                                  **kwargs) -> None:
 
-        reg_partial = functools.partial(self._dispatcher.register_message_handler, callback, *custom_filters,
+        reg_partial = functools.partial(self._registry.register_message_handler, callback, *custom_filters,
                                         commands=commands, regexp=regexp, content_types=content_types,
                                         run_task=run_task, **kwargs)
         self._register_handler_on_states(states, reg_partial)
@@ -160,7 +235,7 @@ class MainRegistrar:
                                         run_task=None,
                                         **kwargs) -> None:
 
-        reg_partial = functools.partial(self._dispatcher.register_callback_query_handler, callback, *custom_filters,
+        reg_partial = functools.partial(self._registry.register_callback_query_handler, callback, *custom_filters,
                                         run_task=run_task, **kwargs)
         self._register_handler_on_states(states, reg_partial)
 
@@ -173,7 +248,7 @@ class MainRegistrar:
                                       run_task=None,
                                       **kwargs) -> None:
 
-        reg_partial = functools.partial(self._dispatcher.register_channel_post_handler, callback, *custom_filters,
+        reg_partial = functools.partial(self._registry.register_channel_post_handler, callback, *custom_filters,
                                         commands=commands, regexp=regexp, content_types=content_types,
                                         run_task=run_task, **kwargs)
         self._register_handler_on_states(states, reg_partial)
@@ -184,7 +259,7 @@ class MainRegistrar:
                                        run_task=None,
                                        **kwargs) -> None:
 
-        reg_partial = functools.partial(self._dispatcher.register_chosen_inline_handler, callback, *custom_filters,
+        reg_partial = functools.partial(self._registry.register_chosen_inline_handler, callback, *custom_filters,
                                         run_task=run_task, **kwargs)
         self._register_handler_on_states(states, reg_partial)
 
@@ -197,7 +272,7 @@ class MainRegistrar:
                                              run_task=None,
                                              **kwargs) -> None:
 
-        reg_partial = functools.partial(self.register_edited_channel_post_handler, callback, *custom_filters,
+        reg_partial = functools.partial(self._registry.register_edited_channel_post_handler, callback, *custom_filters,
                                         commands=commands, regexp=regexp, content_types=content_types,
                                         run_task=run_task, **kwargs)
         self._register_handler_on_states(states, reg_partial)
@@ -211,7 +286,7 @@ class MainRegistrar:
                                         run_task=None,
                                         **kwargs) -> None:
 
-        reg_partial = functools.partial(self.register_edited_message_handler, callback, *custom_filters,
+        reg_partial = functools.partial(self._registry.register_edited_message_handler, callback, *custom_filters,
                                         commands=commands, regexp=regexp, content_types=content_types,
                                         run_task=run_task, **kwargs)
         self._register_handler_on_states(states, reg_partial)
@@ -222,7 +297,7 @@ class MainRegistrar:
                                 run_task=None,
                                 **kwargs) -> None:
 
-        reg_partial = functools.partial(self._dispatcher.register_inline_handler, callback, *custom_filters,
+        reg_partial = functools.partial(self._registry.register_inline_handler, callback, *custom_filters,
                                         run_task=run_task, **kwargs)
         self._register_handler_on_states(states, reg_partial)
 
@@ -232,7 +307,7 @@ class MainRegistrar:
                                             run_task=None,
                                             **kwargs) -> None:
 
-        reg_partial = functools.partial(self._dispatcher.register_pre_checkout_query_handler, callback, *custom_filters,
+        reg_partial = functools.partial(self._registry.register_pre_checkout_query_handler, callback, *custom_filters,
                                         run_task=run_task, **kwargs)
         self._register_handler_on_states(states, reg_partial)
 
@@ -242,7 +317,7 @@ class MainRegistrar:
                                         run_task=None,
                                         **kwargs) -> None:
 
-        reg_partial = functools.partial(self._dispatcher.register_shipping_query_handler, callback, *custom_filters,
+        reg_partial = functools.partial(self._registry.register_shipping_query_handler, callback, *custom_filters,
                                         run_task=run_task, **kwargs)
         self._register_handler_on_states(states, reg_partial)
 
@@ -272,11 +347,18 @@ class MainRegistrar:
         self._dispatcher.register_poll_handler(callback, *custom_filters, run_task=run_task, **kwargs)
         _log_registration_handler(callback, "poll")
 
+    def _register_state_handlers(self, state: AbstractState, reg_kwargs: dict) -> None:
+
+        registrar = Registrar(self._dispatcher, state=state, router=self._router)
+        if isinstance(state, LazyState):
+            state = state.state
+        state_reg_kwargs = helpers.get_existing_kwargs(state.register_handlers, **reg_kwargs)
+        state.register_handlers(registrar, **state_reg_kwargs)
+
     @staticmethod
     def _register_handler_on_states(states: List[AbstractState], reg_partial: functools.partial) -> None:
 
-        for state in states:
-            reg_partial(state=state.raw_value)
+        reg_partial(state=[state.raw_value for state in states])
 
         handler_type = reg_partial.func.__name__.replace("register_", "", 1).replace("_handler", "", 1)
         callback_name = reg_partial.args[0].__qualname__
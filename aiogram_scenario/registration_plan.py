@@ -0,0 +1,188 @@
+from typing import Callable, Collection, Dict, List, Optional, Any
+from dataclasses import dataclass, field
+import importlib.util
+import importlib
+import hashlib
+import inspect
+import json
+import logging
+
+import aiogram
+
+from aiogram_scenario import exceptions, __version__
+from aiogram_scenario.fsm.state import AbstractState, LazyState
+
+
+logger = logging.getLogger(__name__)
+_JSON_TYPES = (str, int, float, bool, type(None))
+
+
+@dataclass()
+class PlannedHandler:
+
+    handler_type: str
+    state: Optional[str]
+    callback: Callable
+    custom_filters: tuple
+    kwargs: dict
+
+
+@dataclass()
+class RegistrationPlan:
+
+    handlers: List[PlannedHandler] = field(default_factory=list)
+    states: List[str] = field(default_factory=list)
+    timings: Dict[str, float] = field(default_factory=dict)
+    fingerprint: Optional[str] = None  # of the plan inputs, a plan with another one is stale
+
+    def replay(self, registry) -> None:
+
+        for planned_handler in self.handlers:
+            register = getattr(registry, f"register_{planned_handler.handler_type}_handler")
+            register(planned_handler.callback, *planned_handler.custom_filters,
+                     state=planned_handler.state, **planned_handler.kwargs)
+
+    def dump(self, filename: str) -> None:
+
+        serialized_handlers = [
+            {
+                "type": i.handler_type,
+                "state": i.state,
+                "callback": _get_reference(i.callback),
+                "custom_filters": [_get_reference(j) for j in i.custom_filters],
+                "kwargs": _check_serializable(i.kwargs, i.callback)
+            }
+            for i in self.handlers
+        ]
+        with open(filename, "w") as json_file:
+            json.dump({"states": self.states, "fingerprint": self.fingerprint, "handlers": serialized_handlers},
+                      json_file)
+
+    @classmethod
+    def load(cls, filename: str) -> "RegistrationPlan":
+
+        with open(filename) as json_file:
+            try:
+                serialized_plan = json.load(json_file)
+                handlers = [
+                    PlannedHandler(
+                        handler_type=i["type"],
+                        state=i["state"],
+                        callback=_resolve_reference(i["callback"]),
+                        custom_filters=tuple(_resolve_reference(j) for j in i["custom_filters"]),
+                        kwargs=i["kwargs"]
+                    )
+                    for i in serialized_plan["handlers"]
+                ]
+                states = serialized_plan["states"]
+                fingerprint = serialized_plan.get("fingerprint")
+            except (ValueError, KeyError, TypeError, ImportError, AttributeError) as e:  # corrupted or stale plan
+                raise exceptions.registration.RegistrationPlanError(
+                    f"registration plan '{filename}' can't be loaded: {e!r}!"
+                ) from e
+
+        return cls(handlers=handlers, states=states, fingerprint=fingerprint)
+
+
+def get_plan_fingerprint(states: Collection[AbstractState], reg_kwargs: Dict[str, Any]) -> str:
+
+    # Handlers and their filters are declared in «register_handlers», so the sources of the modules
+    # of the states stand for them; lazy states are not imported, only their modules are found.
+    fingerprint = hashlib.sha256(f"aiogram_scenario={__version__};aiogram={aiogram.__version__}".encode())
+    for state in states:
+        fingerprint.update(f";state={state}:".encode())
+        fingerprint.update(_get_state_source(state))
+    for name, value in sorted(reg_kwargs.items()):
+        # an arbitrary object has no stable representation between runs, only its type is taken
+        value = repr(value) if isinstance(value, _JSON_TYPES) else type(value).__qualname__
+        fingerprint.update(f";{name}={value}".encode())
+
+    return fingerprint.hexdigest()
+
+
+def _get_state_source(state: AbstractState) -> bytes:
+
+    if isinstance(state, LazyState) and not state.is_loaded:
+        module_name = state.reference.rsplit(":", 1)[0]
+        spec = importlib.util.find_spec(importlib.util.resolve_name(module_name, state.package))
+        filename = spec.origin if spec is not None else None
+    else:
+        if isinstance(state, LazyState):
+            state = state.state
+        filename = inspect.getsourcefile(type(state))
+
+    if filename is None:
+        return b""
+    try:
+        with open(filename, "rb") as source_file:
+            return source_file.read()
+    except OSError:
+        return b""
+
+
+def _get_reference(obj: Callable) -> str:
+
+    # Bound methods, partials and callable instances are rebuilt by name without their owner or arguments,
+    # so only plain functions and classes are referenced.
+    module_name = getattr(obj, "__module__", None)
+    qualname = getattr(obj, "__qualname__", None)
+    if not (inspect.isfunction(obj) or inspect.isclass(obj)) or \
+            module_name is None or qualname is None or "<" in qualname:  # lambdas, local functions
+        raise exceptions.registration.RegistrationPlanError(
+            f"'{obj!r}' can't be serialized into the registration plan, it must be importable by name!"
+        )
+
+    return f"{module_name}:{qualname}"
+
+
+def _resolve_reference(reference: str) -> Any:
+
+    module_name, qualname = reference.split(":", 1)
+    obj = importlib.import_module(module_name)
+    for attr in qualname.split("."):
+        obj = getattr(obj, attr)
+
+    return obj
+
+
+def _check_serializable(value, callback: Callable):
+
+    if isinstance(value, dict):
+        return {k: _check_serializable(v, callback) for k, v in value.items()}
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        return [_check_serializable(i, callback) for i in value]
+    elif isinstance(value, _JSON_TYPES):
+        return value
+
+    raise exceptions.registration.RegistrationPlanError(
+        f"filter value '{value!r}' of handler '{callback.__qualname__}' can't be serialized into the plan!"
+    )
+
+
+def _make_recording_method(handler_type: str) -> Callable:
+
+    def register(self, callback: Callable, *custom_filters, state=None, **kwargs) -> None:
+
+        self.plan.handlers.append(PlannedHandler(handler_type=handler_type, state=state, callback=callback,
+                                                 custom_filters=custom_filters, kwargs=kwargs))
+
+    register.__name__ = f"register_{handler_type}_handler"
+    return register
+
+
+# Takes the place of a dispatcher (or router) in Registrar and records registrations into a plan.
+class RegistrationRecorder:
+
+    register_message_handler = _make_recording_method("message")
+    register_callback_query_handler = _make_recording_method("callback_query")
+    register_channel_post_handler = _make_recording_method("channel_post")
+    register_chosen_inline_handler = _make_recording_method("chosen_inline")
+    register_edited_channel_post_handler = _make_recording_method("edited_channel_post")
+    register_edited_message_handler = _make_recording_method("edited_message")
+    register_inline_handler = _make_recording_method("inline")
+    register_pre_checkout_query_handler = _make_recording_method("pre_checkout_query")
+    register_shipping_query_handler = _make_recording_method("shipping_query")
+
+    def __init__(self, plan: Optional[RegistrationPlan] = None):
+
+        self.plan = plan if plan is not None else RegistrationPlan()
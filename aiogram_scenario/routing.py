@@ -0,0 +1,180 @@
+from typing import Callable, Dict, List, Optional, Collection, Union
+from dataclasses import dataclass
+import itertools
+import inspect
+import heapq
+import logging
+
+from aiogram import Dispatcher
+from aiogram.dispatcher.filters import check_filters, get_filters_spec, FilterNotPassed
+from aiogram.dispatcher.handler import Handler, SkipHandler, current_handler, ctx_data
+
+from . import helpers
+
+
+logger = logging.getLogger(__name__)
+HANDLERS_ATTRS = (
+    "message_handlers",
+    "callback_query_handlers",
+    "channel_post_handlers",
+    "chosen_inline_result_handlers",
+    "edited_channel_post_handlers",
+    "edited_message_handlers",
+    "inline_query_handlers",
+    "pre_checkout_query_handlers",
+    "shipping_query_handlers"
+)
+
+
+@dataclass()
+class RoutedHandler:
+
+    callback: Callable
+    handler: Callable  # callback, possibly wrapped to run as task
+    spec: inspect.FullArgSpec
+    filters: list
+    order: int  # of the registration, handlers of a state and of any state ("*") are checked in this order
+
+
+# A single dispatcher handler is registered per update type: the current state is read once
+# per update and only handlers indexed by this state or by "*" are checked.
+class StatesRouter:
+
+    def __init__(self, dispatcher: Dispatcher):
+
+        self._dispatcher = dispatcher
+        self._routes: Dict[str, Dict[Optional[str], List[RoutedHandler]]] = {}
+        self._deferred_registrations: Dict[Optional[str], Callable[[], None]] = {}
+        self._registrations_counter = itertools.count()
+
+    def defer_state(self, state: Optional[str], registration_func: Callable[[], None]) -> None:
+
+        # handlers of the state are registered on the first update in it, whatever its type
+        for handlers_attr in HANDLERS_ATTRS:
+            self._add_route(handlers_attr)
+        self._deferred_registrations[state] = registration_func
+
+        logger.debug(f"Handlers registration is deferred for state '{state}'!")
+
+    def register_message_handler(self, callback: Callable, *custom_filters,
+                                 state=None, run_task=None, **kwargs) -> None:
+
+        self._register("message_handlers", callback, custom_filters, state, run_task, kwargs)
+
+    def register_callback_query_handler(self, callback: Callable, *custom_filters,
+                                        state=None, run_task=None, **kwargs) -> None:
+
+        self._register("callback_query_handlers", callback, custom_filters, state, run_task, kwargs)
+
+    def register_channel_post_handler(self, callback: Callable, *custom_filters,
+                                      state=None, run_task=None, **kwargs) -> None:
+
+        self._register("channel_post_handlers", callback, custom_filters, state, run_task, kwargs)
+
+    def register_chosen_inline_handler(self, callback: Callable, *custom_filters,
+                                       state=None, run_task=None, **kwargs) -> None:
+
+        self._register("chosen_inline_result_handlers", callback, custom_filters, state, run_task, kwargs)
+
+    def register_edited_channel_post_handler(self, callback: Callable, *custom_filters,
+                                             state=None, run_task=None, **kwargs) -> None:
+
+        self._register("edited_channel_post_handlers", callback, custom_filters, state, run_task, kwargs)
+
+    def register_edited_message_handler(self, callback: Callable, *custom_filters,
+                                        state=None, run_task=None, **kwargs) -> None:
+
+        self._register("edited_message_handlers", callback, custom_filters, state, run_task, kwargs)
+
+    def register_inline_handler(self, callback: Callable, *custom_filters,
+                                state=None, run_task=None, **kwargs) -> None:
+
+        self._register("inline_query_handlers", callback, custom_filters, state, run_task, kwargs)
+
+    def register_pre_checkout_query_handler(self, callback: Callable, *custom_filters,
+                                            state=None, run_task=None, **kwargs) -> None:
+
+        self._register("pre_checkout_query_handlers", callback, custom_filters, state, run_task, kwargs)
+
+    def register_shipping_query_handler(self, callback: Callable, *custom_filters,
+                                        state=None, run_task=None, **kwargs) -> None:
+
+        self._register("shipping_query_handlers", callback, custom_filters, state, run_task, kwargs)
+
+    def _register(self, handlers_attr: str,
+                  callback: Callable,
+                  custom_filters: Collection,
+                  state: Union[Optional[str], Collection[Optional[str]]],
+                  run_task: Optional[bool],
+                  filters_config: dict) -> None:
+
+        event_handlers: Handler = getattr(self._dispatcher, handlers_attr)
+        # the state is already matched by the index, "*" only provides the FSM context to the handler,
+        # «raw_state» is put to the handler data by the router itself
+        filters_set = self._dispatcher.filters_factory.resolve(event_handlers, *custom_filters,
+                                                               state="*", **filters_config)
+        if run_task is None:
+            run_task = self._dispatcher.run_tasks_by_default
+        routed_handler = RoutedHandler(
+            callback=callback,
+            handler=self._dispatcher.async_task(callback) if run_task else callback,
+            spec=inspect.getfullargspec(inspect.unwrap(callback)),
+            filters=get_filters_spec(self._dispatcher, filters_set),
+            order=next(self._registrations_counter)
+        )
+
+        self._add_route(handlers_attr)
+        states = state if isinstance(state, (list, tuple, set, frozenset)) else (state,)
+        for state_ in states:
+            self._routes[handlers_attr].setdefault(state_, []).append(routed_handler)
+
+    def _add_route(self, handlers_attr: str) -> None:
+
+        if handlers_attr in self._routes:
+            return
+
+        self._routes[handlers_attr] = {}
+        event_handlers: Handler = getattr(self._dispatcher, handlers_attr)
+        event_handlers.register(self._make_route_handler(self._routes[handlers_attr]))
+        logger.debug(f"Router is registered for '{handlers_attr}'!")
+
+    def _make_route_handler(self, routes: Dict[Optional[str], List[RoutedHandler]]) -> Callable:
+
+        dispatcher = self._dispatcher
+        deferred_registrations = self._deferred_registrations
+
+        async def route(*args, **_):
+
+            state = await dispatcher.current_state().get_state()
+            if state in deferred_registrations:
+                deferred_registrations.pop(state)()
+            state_handlers = routes.get(state)
+            any_state_handlers = routes.get("*")
+            if state_handlers and any_state_handlers:
+                state_handlers = heapq.merge(state_handlers, any_state_handlers, key=lambda h: h.order)
+            elif not state_handlers:
+                state_handlers = any_state_handlers
+            if not state_handlers:
+                raise SkipHandler()
+
+            data = ctx_data.get()
+            data["raw_state"] = state
+            for routed_handler in state_handlers:
+                try:
+                    data.update(await check_filters(routed_handler.filters, args))
+                except FilterNotPassed:
+                    continue
+
+                ctx_token = current_handler.set(routed_handler.callback)
+                try:
+                    return await routed_handler.handler(
+                        *args, **helpers.filter_kwargs_by_spec(routed_handler.spec, data, check_varkw=True)
+                    )
+                except SkipHandler:
+                    continue
+                finally:
+                    current_handler.reset(ctx_token)
+
+            raise SkipHandler()
+
+        return route
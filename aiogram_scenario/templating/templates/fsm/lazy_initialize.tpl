@@ -0,0 +1,12 @@
+from aiogram_scenario import FiniteStateMachine
+from aiogram_scenario.transitions_storages.base import AbstractTransitionsStorage
+
+from .states_group import StatesGroup
+
+
+def initialize_fsm(fsm: FiniteStateMachine, storage: AbstractTransitionsStorage) -> None:
+    fsm.set_initial_state(StatesGroup.{initial_state})
+    fsm.import_transitions(  # states modules are loaded lazily, so trigger funcs are matched by names
+        storage=storage,
+        states=StatesGroup.select()
+    )
@@ -0,0 +1,6 @@
+from aiogram_scenario import BaseStatesGroup, LazyState
+
+
+class StatesGroup(BaseStatesGroup):
+
+    {states_defining}
@@ -1,6 +1,10 @@
-from typing import List, Dict
+from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
+import hashlib
 import shutil
+import json
 
 from aiogram_scenario.transitions_storages.base import AbstractTransitionsStorage
 
@@ -15,50 +19,59 @@ INITIAL_STATE_TEMPLATE_PATH = TEMPLATES_FSM_STATES_DIR / "initial_state.tpl"
 STATE_TEMPLATE_PATH = TEMPLATES_FSM_STATES_DIR / "state.tpl"
 INIT_STATES_TEMPLATE_PATH = TEMPLATES_FSM_STATES_DIR / "__init__.tpl"
 STATES_GROUP_TEMPLATE_PATH = TEMPLATES_FSM_DIR / "states_group.tpl"
+LAZY_STATES_GROUP_TEMPLATE_PATH = TEMPLATES_FSM_DIR / "lazy_states_group.tpl"
 INITIALIZE_FSM_TEMPLATE_PATH = TEMPLATES_FSM_DIR / "initialize.tpl"
+LAZY_INITIALIZE_FSM_TEMPLATE_PATH = TEMPLATES_FSM_DIR / "lazy_initialize.tpl"
 INIT_FSM_TEMPLATE_PATH = TEMPLATES_FSM_DIR / "__init__.tpl"
 COMMON_HANDLERS_TEMPLATE_PATH = TEMPLATES_HANDLERS_DIR / "common.tpl"
 REGISTRATION_HANDLERS_TEMPLATE_PATH = TEMPLATES_HANDLERS_DIR / "registration.tpl"
 INIT_HANDLERS_TEMPLATE_PATH = TEMPLATES_HANDLERS_DIR / "__init__.tpl"
 
+# hashes of the generated modules, used for incremental regeneration
+MANIFEST_FILENAME = ".scenario_manifest.json"
 
+
+@lru_cache(maxsize=None)
 def _get_module_name_by_state_name(state_name: str, name_only: bool = False) -> str:
 
     if state_name.lower().endswith("state"):
         state_name = state_name[:-5]
 
-    module_name = ""
+    last_index = len(state_name) - 1
+    chars = []
     for index, letter in enumerate(state_name):
-        module_name += letter.lower()
-        if index == (len(state_name) - 1):
-            if not name_only:
-                module_name += ".py"
+        chars.append(letter.lower())
+        if index == last_index:
             break
 
         if ((letter.islower() and state_name[index + 1].isupper())
                 or
-                (((index + 2) <= (len(state_name) - 1)) and state_name[index + 1:index + 3].istitle())):
-            module_name += "_"
+                (((index + 2) <= last_index) and state_name[index + 1:index + 3].istitle())):
+            chars.append("_")
+
+    if not name_only:
+        chars.append(".py")
 
-    return module_name
+    return "".join(chars)
 
 
-def _make_fsm_dirs(fsm_dir: Path, fsm_states_dir: Path, handlers_dir: Path):
+def _make_fsm_dirs(fsm_dir: Path, fsm_states_dir: Path, handlers_dir: Path, exist_ok: bool = False):
 
-    fsm_dir.mkdir()
-    fsm_states_dir.mkdir()
-    handlers_dir.mkdir()
+    fsm_dir.mkdir(exist_ok=exist_ok)
+    fsm_states_dir.mkdir(exist_ok=exist_ok)
+    handlers_dir.mkdir(exist_ok=exist_ok)
 
 
 def _create_fsm_folders(app_dir: Path,
                         fsm_dir: Path,
                         fsm_states_dir: Path,
                         handlers_dir: Path,
-                        rewrite: bool) -> None:
+                        rewrite: bool,
+                        incremental: bool = False) -> None:
 
     app_dir.mkdir(exist_ok=True)
     try:
-        _make_fsm_dirs(fsm_dir, fsm_states_dir, handlers_dir)
+        _make_fsm_dirs(fsm_dir, fsm_states_dir, handlers_dir, exist_ok=incremental)
     except FileExistsError:
         if rewrite:
             shutil.rmtree(str(fsm_dir))
@@ -74,6 +87,7 @@ def _create_module(path: Path, content: str):
         file.write(content)
 
 
+@lru_cache(maxsize=None)
 def _get_template_content(template_path: Path) -> str:
 
     with open(str(template_path)) as file:
@@ -82,29 +96,23 @@ def _get_template_content(template_path: Path) -> str:
     return template_content
 
 
-def _create_state_module(path: Path, state: str, handlers: List[str], template_path: Path):
+def _get_content_hash(content: str) -> str:
+
+    return hashlib.sha256(content.encode("UTF-8")).hexdigest()
+
+
+def _render_state_module(state: str, handlers: List[str], template_path: Path) -> str:
 
     template_content = _get_template_content(template_path)
 
-    rendered_template = template_content.format(
+    return template_content.format(
         handlers="\n\n\n".join(["""async def {name}(event, fsm: FSMTrigger):\n    ...""".format(name=name)
                                 for name in handlers]),
         state_name=state
     )
 
-    state_path = path / _get_module_name_by_state_name(state)
-    _create_module(state_path, rendered_template)
-
 
-def _create_init_module(path: Path, template_path: Path):
-
-    template_content = _get_template_content(template_path)
-
-    init_module_path = path / "__init__.py"
-    _create_module(init_module_path, template_content)
-
-
-def _create_states_group_module(path: Path, initial_state: str, states: List[str], states_mapping):
+def _render_states_group_module(initial_state: str, states: List[str], states_mapping: Dict[str, str]) -> str:
 
     template_content = _get_template_content(STATES_GROUP_TEMPLATE_PATH)
 
@@ -112,30 +120,40 @@ def _create_states_group_module(path: Path, initial_state: str, states: List[str
     states_defining = "\n    ".join(
         [f"{states_mapping[i].upper()} = {i}({'is_initial=True' if initial_state == i else ''})" for i in states]
     )
-    rendered_template = template_content.format(
+
+    return template_content.format(
         states_imports=states_imports,
         states_defining=states_defining
     )
 
-    states_group_module_path = path / "states_group.py"
-    _create_module(states_group_module_path, rendered_template)
 
+def _render_lazy_states_group_module(initial_state: str, states: List[str], states_mapping: Dict[str, str]) -> str:
 
-def _create_initialize_module(path: Path,
-                              initial_state: str,
+    template_content = _get_template_content(LAZY_STATES_GROUP_TEMPLATE_PATH)
+
+    states_defining = "\n    ".join(
+        [f"{states_mapping[i].upper()} = LazyState(\".states.{states_mapping[i]}:{i}\", package=__package__"
+         f"{', is_initial=True' if initial_state == i else ''})" for i in states]
+    )
+
+    return template_content.format(states_defining=states_defining)
+
+
+def _render_initialize_module(initial_state: str,
                               states_handlers: Dict[str, List[str]],
-                              states_mapping: Dict[str, str]):
+                              states_mapping: Dict[str, str]) -> str:
 
     template_content = _get_template_content(INITIALIZE_FSM_TEMPLATE_PATH)
 
     handlers_rows = []
     for state, handlers in states_handlers.items():
+        if handlers_rows:
+            handlers_rows.append("")
         handlers_rows.append(f"# {states_mapping[state].upper()}")
         for handler in handlers:
             handlers_rows.append(f"{states_mapping[state]}.{handler},")
-        if state != list(states_handlers.keys())[-1]:
-            handlers_rows.append("")
-    rendered_template = template_content.format(
+
+    return template_content.format(
         states_modules_imports="from .states import (\n    " + ",\n    ".join(
             [states_mapping[i] for i in states_handlers.keys()]
         ) + ",\n)",
@@ -143,70 +161,137 @@ def _create_initialize_module(path: Path,
         handlers="\n            ".join(handlers_rows)
     )
 
-    initialize_module_path = path / "initialize.py"
-    _create_module(initialize_module_path, rendered_template)
-
 
-def _create_handlers_common_module(path: Path):
+def _render_lazy_initialize_module(initial_state: str, states_mapping: Dict[str, str]) -> str:
 
-    template_content = _get_template_content(COMMON_HANDLERS_TEMPLATE_PATH)
+    template_content = _get_template_content(LAZY_INITIALIZE_FSM_TEMPLATE_PATH)
 
-    common_module_path = path / "common.py"
-    _create_module(common_module_path, template_content)
-
-
-def _create_handlers_registration_module(path: Path):
-
-    template_content = _get_template_content(REGISTRATION_HANDLERS_TEMPLATE_PATH)
-
-    registration_module_path = path / "registration.py"
-    _create_module(registration_module_path, template_content)
+    return template_content.format(initial_state=states_mapping[initial_state].upper())
 
 
 def _get_states(transitions):
 
-    states = []
-    for source_state in transitions.keys():
-        if source_state not in states:
-            states.append(source_state)
-        for destination_state in transitions[source_state].values():
-            if destination_state not in states:
-                states.append(destination_state)
+    states = dict.fromkeys(transitions.keys())
+    for destinations in transitions.values():
+        states.update(dict.fromkeys(destinations.values()))
 
-    return states
+    return list(states)
 
 
-def create_fsm_structure(storage: AbstractTransitionsStorage,
-                         initial_state: str,
-                         path: str = ".", *,
-                         app_name: str = "app",
-                         rewrite: bool = False):
-
-    transitions = storage.read()
+def _render_fsm_structure(transitions: Dict[str, Dict[str, str]],
+                          initial_state: str,
+                          app_dir: Path,
+                          lazy: bool) -> Dict[Path, str]:
 
-    path = Path(path)
-    app_dir = path / app_name
     fsm_dir = app_dir / "fsm"
     fsm_states_dir = fsm_dir / "states"
     handlers_dir = app_dir / "handlers"
 
-    _create_fsm_folders(app_dir, fsm_dir, fsm_states_dir, handlers_dir, rewrite)
-
     states = _get_states(transitions)
     states_mapping = {state: _get_module_name_by_state_name(state, name_only=True) for state in states}
     states_handlers = {state: list(transitions[state].keys()) for state in transitions.keys()}
 
-    _create_init_module(app_dir, INIT_APP_TEMPLATE_PATH)
+    modules = {app_dir / "__init__.py": _get_template_content(INIT_APP_TEMPLATE_PATH)}
     for state in states:
         if state == initial_state:
             template_path = INITIAL_STATE_TEMPLATE_PATH
         else:
             template_path = STATE_TEMPLATE_PATH
-        _create_state_module(fsm_states_dir, state, list(transitions[state].keys()), template_path)
-    _create_init_module(fsm_states_dir, INIT_STATES_TEMPLATE_PATH)
-    _create_states_group_module(fsm_dir, initial_state, states, states_mapping)
-    _create_initialize_module(fsm_dir, initial_state, states_handlers, states_mapping)
-    _create_init_module(fsm_dir, INIT_FSM_TEMPLATE_PATH)
-    _create_handlers_common_module(handlers_dir)
-    _create_handlers_registration_module(handlers_dir)
-    _create_init_module(handlers_dir, INIT_HANDLERS_TEMPLATE_PATH)
+        modules[fsm_states_dir / _get_module_name_by_state_name(state)] = _render_state_module(
+            state, list(transitions.get(state, {}).keys()), template_path
+        )
+    modules[fsm_states_dir / "__init__.py"] = _get_template_content(INIT_STATES_TEMPLATE_PATH)
+    if lazy:
+        modules[fsm_dir / "states_group.py"] = _render_lazy_states_group_module(initial_state, states, states_mapping)
+        modules[fsm_dir / "initialize.py"] = _render_lazy_initialize_module(initial_state, states_mapping)
+    else:
+        modules[fsm_dir / "states_group.py"] = _render_states_group_module(initial_state, states, states_mapping)
+        modules[fsm_dir / "initialize.py"] = _render_initialize_module(initial_state, states_handlers,
+                                                                       states_mapping)
+    modules[fsm_dir / "__init__.py"] = _get_template_content(INIT_FSM_TEMPLATE_PATH)
+    modules[handlers_dir / "common.py"] = _get_template_content(COMMON_HANDLERS_TEMPLATE_PATH)
+    modules[handlers_dir / "registration.py"] = _get_template_content(REGISTRATION_HANDLERS_TEMPLATE_PATH)
+    modules[handlers_dir / "__init__.py"] = _get_template_content(INIT_HANDLERS_TEMPLATE_PATH)
+
+    return modules
+
+
+def _read_manifest(app_dir: Path) -> Dict[str, str]:
+
+    try:
+        with open(str(app_dir / MANIFEST_FILENAME)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def _is_module_outdated(path: Path, content_hash: str, generated_hash: Optional[str]) -> bool:
+
+    if not path.exists():
+        return True
+    if generated_hash == content_hash:  # already up to date
+        return False
+
+    current_hash = _get_content_hash(path.read_text())
+    if generated_hash is None:  # not in the manifest, e.g. generated without it
+        return current_hash != content_hash
+
+    # a module that was changed after generation is left untouched
+    return current_hash == generated_hash
+
+
+def _remove_orphan_modules(app_dir: Path, manifest: Dict[str, str], modules_paths: List[Path]) -> None:
+
+    # modules generated before but no longer rendered (e.g. of removed states), unless they were changed
+    rendered_paths = {str(module_path.relative_to(app_dir)) for module_path in modules_paths}
+    for relative_path, generated_hash in manifest.items():
+        module_path = app_dir / relative_path
+        if relative_path in rendered_paths or not module_path.is_file():
+            continue
+        if _get_content_hash(module_path.read_text()) == generated_hash:
+            module_path.unlink()
+
+
+def create_fsm_structure(storage: AbstractTransitionsStorage,
+                         initial_state: str,
+                         path: str = ".", *,
+                         app_name: str = "app",
+                         rewrite: bool = False,
+                         lazy: bool = False,
+                         dry_run: bool = False,
+                         incremental: bool = False,
+                         max_workers: Optional[int] = None) -> Dict[Path, str]:
+
+    transitions = storage.read()
+
+    path = Path(path)
+    app_dir = path / app_name
+    modules = _render_fsm_structure(transitions, initial_state, app_dir, lazy)
+    if dry_run:
+        return modules
+
+    fsm_dir = app_dir / "fsm"
+    _create_fsm_folders(app_dir, fsm_dir, fsm_dir / "states", app_dir / "handlers", rewrite, incremental)
+
+    hashes = {module_path: _get_content_hash(content) for module_path, content in modules.items()}
+    if incremental:
+        manifest = _read_manifest(app_dir)
+        generated_hashes = {module_path: manifest.get(str(module_path.relative_to(app_dir)))
+                            for module_path in modules.keys()}
+        _remove_orphan_modules(app_dir, manifest, list(modules.keys()))
+        modules = {module_path: content for module_path, content in modules.items()
+                   if _is_module_outdated(module_path, hashes[module_path], generated_hashes[module_path])}
+        # skipped modules keep the hashes they were generated with, the ones missing from the manifest match the render
+        hashes = {module_path: (content_hash if module_path in modules or generated_hashes[module_path] is None
+                                else generated_hashes[module_path])
+                  for module_path, content_hash in hashes.items()}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for _ in executor.map(lambda item: _create_module(*item), modules.items()):
+            pass
+
+    # rewritten by every run, so a later incremental one never compares with the hashes of an older structure
+    manifest = {str(module_path.relative_to(app_dir)): content_hash for module_path, content_hash in hashes.items()}
+    _create_module(app_dir / MANIFEST_FILENAME, json.dumps(manifest, indent=4, sort_keys=True))
+
+    return modules
@@ -1,2 +1,3 @@
 from .csv import CSVTransitionsStorage
 from .json import JSONTransitionsStorage
+from .jsonl import JSONLinesTransitionsStorage
@@ -8,6 +8,11 @@ class AbstractTransitionsStorage(ABC):
 
         self._filename = filename
 
+    @property
+    def filename(self) -> str:
+
+        return self._filename
+
     @abstractmethod
     def read(self) -> Dict[str, Dict[str, str]]:
 
@@ -1,47 +1,94 @@
-from typing import Dict
+from typing import Dict, Iterator, List, Tuple
 import csv
 
 from .base import AbstractTransitionsStorage
 
 
+LONG_FORMAT_HEADER = ("source", "trigger", "destination")
+
+
 class CSVTransitionsStorage(AbstractTransitionsStorage):
 
+    def __init__(self, filename: str, *, long_format: bool = False):
+
+        super().__init__(filename)
+        self._long_format = long_format
+
+    @property
+    def long_format(self) -> bool:
+
+        return self._long_format
+
     def read(self) -> Dict[str, Dict[str, str]]:
 
+        transitions = {}
         with open(self._filename, newline="") as csv_fp:
             reader = csv.reader(csv_fp)
-            rows = list(reader)
+            if self._long_format:
+                rows = self._iter_long_rows(reader)
+            else:
+                source_states = next(reader, [""])[1:]
+                transitions.update((source_state, {}) for source_state in source_states)
+                rows = self._iter_matrix_rows(reader, source_states)
 
-        source_states = rows[0][1:]
-        transitions = {source_state: {} for source_state in source_states}
-        for row in rows[1:]:
-            trigger_func = row[0]
-            for index, destination_state in enumerate(row[1:]):
-                if destination_state:
-                    source_state = source_states[index]
-                    transitions[source_state][trigger_func] = destination_state
+            for source_state, trigger_func, destination_state in rows:
+                transitions.setdefault(source_state, {})[trigger_func] = destination_state
 
         return transitions
 
-    def write(self, transitions: Dict[str, Dict[str, str]]) -> None:
+    def iter_transitions(self) -> Iterator[Tuple[str, str, str]]:
 
-        triggers_funcs = []
-        for funcs in (i.keys() for i in transitions.values()):
-            for func in funcs:
-                if func not in triggers_funcs:
-                    triggers_funcs.append(func)
+        with open(self._filename, newline="") as csv_fp:
+            reader = csv.reader(csv_fp)
+            if self._long_format:
+                yield from self._iter_long_rows(reader)
+            else:
+                yield from self._iter_matrix_rows(reader, next(reader, [""])[1:])
 
-        rows = [["", *transitions.keys()]]
-        for trigger_func in triggers_funcs:
-            destination_states = []
-            for source_state in transitions.keys():
-                destination_state = transitions[source_state].get(trigger_func)
-                if destination_state is None:
-                    destination_states.append("")
-                else:
-                    destination_states.append(destination_state)
-            rows.append([trigger_func, *destination_states])
+    def write(self, transitions: Dict[str, Dict[str, str]]) -> None:
 
         with open(self._filename, "w", newline="") as csv_fp:
             writer = csv.writer(csv_fp)
-            writer.writerows(rows)
+            if self._long_format:
+                writer.writerow(LONG_FORMAT_HEADER)
+                for source_state, source_transitions in transitions.items():
+                    for trigger_func, destination_state in source_transitions.items():
+                        writer.writerow((source_state, trigger_func, destination_state))
+            else:
+                self._write_matrix_rows(writer, transitions)
+
+    @staticmethod
+    def _iter_long_rows(reader) -> Iterator[Tuple[str, str, str]]:
+
+        for row in reader:
+            if not row or tuple(row) == LONG_FORMAT_HEADER:
+                continue
+            source_state, trigger_func, destination_state = row
+            yield source_state, trigger_func, destination_state
+
+    @staticmethod
+    def _iter_matrix_rows(reader, source_states: List[str]) -> Iterator[Tuple[str, str, str]]:
+
+        for row in reader:
+            if not row:
+                continue
+            trigger_func = row[0]
+            for source_state, destination_state in zip(source_states, row[1:]):
+                if destination_state:
+                    yield source_state, trigger_func, destination_state
+
+    @staticmethod
+    def _write_matrix_rows(writer, transitions: Dict[str, Dict[str, str]]) -> None:
+
+        # dict keys are used as an ordered set, so duplicates are dropped in O(1)
+        triggers_funcs = dict.fromkeys(
+            trigger_func for source_transitions in transitions.values() for trigger_func in source_transitions
+        )
+
+        source_states = tuple(transitions.keys())
+        writer.writerow(("", *source_states))
+        for trigger_func in triggers_funcs:
+            writer.writerow((
+                trigger_func,
+                *(transitions[source_state].get(trigger_func, "") for source_state in source_states)
+            ))
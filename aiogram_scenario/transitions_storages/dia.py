@@ -1,5 +1,7 @@
-from typing import Dict, Optional
+from typing import Dict, Optional, Iterator, Tuple
 from collections import namedtuple
+import math
+import gzip
 
 try:
     import lxml.etree  # noqa
@@ -9,94 +11,191 @@ except ImportError:
 from .base import AbstractTransitionsStorage
 
 
+DIA_NAMESPACE = "http://www.lysator.liu.se/~alla/dia/"
+GZIP_MAGIC = b"\x1f\x8b"
+STATE_OBJECT_TYPE = "UML - State"
+TRANSITION_OBJECT_TYPE = "UML - Transition"
+GRID_STEP = 8.0
+
 StateObject = namedtuple("StateObject", ("id", "name"))
 TransitionObject = namedtuple("TransitionObject", ("id", "trigger", "connections"))
 
 
+def _get_local_name(tag) -> str:
+
+    if not isinstance(tag, str):  # comments and processing instructions
+        return ""
+
+    return tag.rpartition("}")[2]
+
+
+def _get_dia_tag(name: str) -> str:
+
+    return f"{{{DIA_NAMESPACE}}}{name}"
+
+
+def _get_string_value(element) -> Optional[str]:
+
+    for child in element:
+        if _get_local_name(child.tag) == "string" and child.text is not None:
+            return child.text.strip("#")
+
+
 def _parse_state_element(element, element_id) -> Optional[StateObject]:
 
-    for element_attr in element.getchildren():
+    for element_attr in element:
         if element_attr.get("name") == "text":
-            for composite in element_attr.getchildren():
+            for composite in element_attr:
                 if composite.get("type") == "text":
-                    for composite_attr in composite.getchildren():
+                    for composite_attr in composite:
                         if composite_attr.get("name") == "string":
-                            state_name = composite_attr.getchildren()[0].text.strip("#")
-                            state_object = StateObject(id=element_id, name=state_name)
-
-                            return state_object
+                            state_name = _get_string_value(composite_attr)
+                            if state_name is not None:
+                                return StateObject(id=element_id, name=state_name)
 
 
 def _parse_transition_element(element, element_id) -> Optional[TransitionObject]:
 
     transition_trigger = None
     transition_connections = None
-    for element_attr in element.getchildren():
+    for element_attr in element:
         if element_attr.get("name") == "trigger":
-            transition_trigger = element_attr.getchildren()[0].text.strip("#")
-        if element_attr.tag.endswith("connections"):
-            transition_connections = tuple(i.get("to") for i in element_attr.getchildren())
+            transition_trigger = _get_string_value(element_attr)
+        elif _get_local_name(element_attr.tag) == "connections":
+            connections = sorted(element_attr, key=lambda i: int(i.get("handle", 0)))
+            transition_connections = tuple(i.get("to") for i in connections)
             if len(transition_connections) != 2:
-                break
+                return
 
-        if all(i is not None for i in (transition_trigger, transition_connections)):
-            transition_object = TransitionObject(id=element_id, trigger=transition_trigger,
-                                                 connections=transition_connections)
-            return transition_object
+    if all(i is not None for i in (transition_trigger, transition_connections)):
+        return TransitionObject(id=element_id, trigger=transition_trigger, connections=transition_connections)
 
 
 def _get_transitions(states_objects, transitions_objects):
 
+    states_names = {state_object.id: state_object.name for state_object in states_objects}
+
     transitions = {}
     for transition_object in transitions_objects:
-        source_state = None
-        destination_state = None
-        for state_object in states_objects:
-            if state_object.id == transition_object.connections[0]:
-                source_state = state_object.name
-            elif state_object.id == transition_object.connections[1]:
-                destination_state = state_object.name
-            if all(i is not None for i in (source_state, destination_state)):
-                break
-
-        if source_state not in transitions.keys():
-            transitions[source_state] = {transition_object.trigger: destination_state}
-        else:
-            transitions[source_state][transition_object.trigger] = destination_state
+        source_id, destination_id = transition_object.connections
+        source_state = states_names.get(source_id)
+        destination_state = states_names.get(destination_id)
+        if source_state is None or destination_state is None:
+            continue
+
+        transitions.setdefault(source_state, {})[transition_object.trigger] = destination_state
 
     return transitions
 
 
-class DiaTransitionsStorage(AbstractTransitionsStorage):
+def _open_diagram(filename: str):
 
-    def read(self) -> Dict[str, Dict[str, str]]:
+    with open(filename, "rb") as diagram_fp:
+        is_compressed = diagram_fp.read(len(GZIP_MAGIC)) == GZIP_MAGIC
 
-        if lxml is None:
-            raise RuntimeError("parsing structure of the «.dia» file requires the «lxml» library to be installed!\n"
-                               "More details: https://lxml.de/installation.html#installation")
+    if is_compressed:
+        return gzip.open(filename, "rb")
 
-        tree = lxml.etree.parse(self._filename)
-        root = tree.getroot()
-        _, layer = root.getchildren()
+    return open(filename, "rb")
 
-        states_objects = []
-        transitions_objects = []
-        for element in layer:
 
-            if not element.tag.endswith("object"):
-                continue
+def _iter_objects(diagram_fp) -> Iterator:
+
+    for _, element in lxml.etree.iterparse(diagram_fp, events=("end",), tag=_get_dia_tag("object")):
+        yield element
+
+        # already processed elements are dropped so memory does not grow with the diagram size
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+
+def _get_states_positions(states) -> Dict[str, Tuple[float, float]]:
+
+    columns = max(math.ceil(math.sqrt(len(states))), 1)
+
+    return {state: ((index % columns) * GRID_STEP * 2, (index // columns) * GRID_STEP)
+            for index, state in enumerate(states)}
+
+
+def _add_attribute(element, name: str):
+
+    return lxml.etree.SubElement(element, _get_dia_tag("attribute"), name=name)
+
 
-            element_type = element.get("type")
-            element_id = element.get("id")
+def _add_point(element, name: str, x: float, y: float) -> None:
 
-            if element_type == "UML - State":
-                state_object = _parse_state_element(element, element_id)
-                if state_object is not None:
-                    states_objects.append(state_object)
-            elif element_type == "UML - Transition":
-                transition_object = _parse_transition_element(element, element_id)
-                if transition_object is not None:
-                    transitions_objects.append(transition_object)
+    lxml.etree.SubElement(_add_attribute(element, name), _get_dia_tag("point"), val=f"{x},{y}")
+
+
+def _add_string(element, name: str, value: str) -> None:
+
+    lxml.etree.SubElement(_add_attribute(element, name), _get_dia_tag("string")).text = f"#{value}#"
+
+
+def _make_state_element(element_id: str, state: str, position: Tuple[float, float]):
+
+    element = lxml.etree.Element(_get_dia_tag("object"), type=STATE_OBJECT_TYPE, version="0", id=element_id,
+                                 nsmap={"dia": DIA_NAMESPACE})
+    _add_point(element, "obj_pos", *position)
+    _add_point(element, "elem_corner", *position)
+    text = lxml.etree.SubElement(_add_attribute(element, "text"), _get_dia_tag("composite"), type="text")
+    _add_string(text, "string", state)
+    lxml.etree.SubElement(_add_attribute(element, "type"), _get_dia_tag("enum"), val="0")
+
+    return element
+
+
+def _make_transition_element(element_id: str, trigger: str, source_id: str, destination_id: str,
+                             source_position: Tuple[float, float], destination_position: Tuple[float, float]):
+
+    element = lxml.etree.Element(_get_dia_tag("object"), type=TRANSITION_OBJECT_TYPE, version="2", id=element_id,
+                                 nsmap={"dia": DIA_NAMESPACE})
+    _add_string(element, "trigger", trigger)
+
+    (source_x, source_y), (destination_x, destination_y) = source_position, destination_position
+    orth_points = _add_attribute(element, "orth_points")
+    for x, y in ((source_x, source_y), (destination_x, source_y), (destination_x, destination_y)):
+        lxml.etree.SubElement(orth_points, _get_dia_tag("point"), val=f"{x},{y}")
+    orth_orient = _add_attribute(element, "orth_orient")
+    for orient in ("0", "1"):
+        lxml.etree.SubElement(orth_orient, _get_dia_tag("enum"), val=orient)
+    lxml.etree.SubElement(_add_attribute(element, "orth_autoroute"), _get_dia_tag("boolean"), val="true")
+
+    connections = lxml.etree.SubElement(element, _get_dia_tag("connections"))
+    for handle, state_id in enumerate((source_id, destination_id)):
+        lxml.etree.SubElement(connections, _get_dia_tag("connection"), handle=str(handle), to=state_id,
+                              connection="8")
+
+    return element
+
+
+class DiaTransitionsStorage(AbstractTransitionsStorage):
+
+    def __init__(self, filename: str, *, compress: bool = False):
+
+        super().__init__(filename)
+        self._compress = compress
+
+    def read(self) -> Dict[str, Dict[str, str]]:
+
+        self._check_lxml()
+
+        states_objects = []
+        transitions_objects = []
+        with _open_diagram(self._filename) as diagram_fp:
+            for element in _iter_objects(diagram_fp):
+                element_type = element.get("type")
+                element_id = element.get("id")
+
+                if element_type == STATE_OBJECT_TYPE:
+                    state_object = _parse_state_element(element, element_id)
+                    if state_object is not None:
+                        states_objects.append(state_object)
+                elif element_type == TRANSITION_OBJECT_TYPE:
+                    transition_object = _parse_transition_element(element, element_id)
+                    if transition_object is not None:
+                        transitions_objects.append(transition_object)
 
         transitions = _get_transitions(states_objects, transitions_objects)
 
@@ -104,4 +203,40 @@ class DiaTransitionsStorage(AbstractTransitionsStorage):
 
     def write(self, transitions: Dict[str, Dict[str, str]]) -> None:
 
-        raise RuntimeError("the ability to generate Dia schema from source data is not yet available!")
+        self._check_lxml()
+
+        states = dict.fromkeys(transitions.keys())
+        for source_transitions in transitions.values():
+            states.update(dict.fromkeys(source_transitions.values()))
+        states_ids = {state: f"O{index}" for index, state in enumerate(states)}
+        states_positions = _get_states_positions(states)
+
+        if self._compress:
+            diagram_fp = gzip.open(self._filename, "wb")
+        else:
+            diagram_fp = open(self._filename, "wb")
+
+        with diagram_fp, lxml.etree.xmlfile(diagram_fp, encoding="UTF-8") as xml_file:
+            xml_file.write_declaration()
+            with xml_file.element(_get_dia_tag("diagram"), nsmap={"dia": DIA_NAMESPACE}):
+                xml_file.write(lxml.etree.Element(_get_dia_tag("diagramdata"), nsmap={"dia": DIA_NAMESPACE}))
+                with xml_file.element(_get_dia_tag("layer"), name="Background", visible="true", active="true"):
+                    for state, state_id in states_ids.items():
+                        xml_file.write(_make_state_element(state_id, state, states_positions[state]))
+
+                    transition_index = len(states_ids)
+                    for source_state, source_transitions in transitions.items():
+                        for trigger, destination_state in source_transitions.items():
+                            xml_file.write(_make_transition_element(
+                                f"O{transition_index}", trigger,
+                                states_ids[source_state], states_ids[destination_state],
+                                states_positions[source_state], states_positions[destination_state]
+                            ))
+                            transition_index += 1
+
+    @staticmethod
+    def _check_lxml() -> None:
+
+        if lxml is None:
+            raise RuntimeError("processing of the «.dia» file requires the «lxml» library to be installed!\n"
+                               "More details: https://lxml.de/installation.html#installation")
@@ -0,0 +1,117 @@
+from typing import Dict, Optional, Collection, Iterator, Tuple, List
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from aiogram_scenario import exceptions
+from .base import AbstractTransitionsStorage
+
+
+TRANSITION_KEYS = ("source", "trigger", "destination")
+
+
+def _loads(line: bytes):
+
+    if orjson is not None:
+        return orjson.loads(line)
+
+    return json.loads(line)
+
+
+def _dumps(obj) -> bytes:
+
+    if orjson is not None:
+        return orjson.dumps(obj)
+
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("UTF-8")
+
+
+class JSONLinesTransitionsStorage(AbstractTransitionsStorage):
+
+    def __init__(self, filename: str, *,
+                 states_names: Optional[Collection[str]] = None,
+                 triggers_names: Optional[Collection[str]] = None):
+
+        super().__init__(filename)
+        self._states_names = None if states_names is None else frozenset(states_names)
+        self._triggers_names = None if triggers_names is None else frozenset(triggers_names)
+
+    def read(self) -> Dict[str, Dict[str, str]]:
+
+        transitions = {}
+        errors = []
+        for line_number, transition in self._iter_lines():
+            error = self._check_transition(transition)
+            if error is not None:
+                errors.append(f"line {line_number}: {error}")
+                continue
+
+            source_state, trigger_func, destination_state = (transition[i] for i in TRANSITION_KEYS)
+            source_transitions = transitions.setdefault(source_state, {})
+            if trigger_func in source_transitions:
+                errors.append(f"line {line_number}: transition from '{source_state}' "
+                              f"by '{trigger_func}' is duplicated")
+                continue
+            source_transitions[trigger_func] = destination_state
+
+        if errors:
+            raise exceptions.transitions_storage.TransitionsValidationError(
+                f"transitions from '{self._filename}' are invalid:\n" + "\n".join(errors)
+            )
+
+        return transitions
+
+    def iter_transitions(self) -> Iterator[Tuple[str, str, str]]:
+
+        for line_number, transition in self._iter_lines():
+            error = self._check_transition(transition)
+            if error is not None:
+                raise exceptions.transitions_storage.TransitionsValidationError(f"line {line_number}: {error}")
+
+            yield tuple(transition[i] for i in TRANSITION_KEYS)
+
+    def write(self, transitions: Dict[str, Dict[str, str]]) -> None:
+
+        with open(self._filename, "wb") as jsonl_fp:
+            for source_state, source_transitions in transitions.items():
+                for trigger_func, destination_state in source_transitions.items():
+                    jsonl_fp.write(_dumps(dict(zip(TRANSITION_KEYS,
+                                                   (source_state, trigger_func, destination_state)))))
+                    jsonl_fp.write(b"\n")
+
+    def _iter_lines(self) -> Iterator[Tuple[int, Optional[dict]]]:
+
+        with open(self._filename, "rb") as jsonl_fp:
+            for line_number, line in enumerate(jsonl_fp, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    transition = _loads(line)
+                except ValueError:  # both json and orjson decoding errors are subclasses of it
+                    transition = None
+
+                yield line_number, transition
+
+    def _check_transition(self, transition: Optional[dict]) -> Optional[str]:
+
+        if not isinstance(transition, dict):
+            return "line is not a JSON object"
+
+        errors: List[str] = []
+        for key in TRANSITION_KEYS:
+            if not isinstance(transition.get(key), str):
+                errors.append(f"'{key}' must be a string")
+        if errors:
+            return ", ".join(errors)
+
+        if self._states_names is not None:
+            for key in ("source", "destination"):
+                if transition[key] not in self._states_names:
+                    errors.append(f"state '{transition[key]}' is not defined")
+        if self._triggers_names is not None and transition["trigger"] not in self._triggers_names:
+            errors.append(f"trigger '{transition['trigger']}' is not defined")
+
+        return ", ".join(errors) or None
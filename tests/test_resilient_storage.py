@@ -0,0 +1,173 @@
+import asyncio
+import time
+
+import pytest
+
+from aiogram_scenario import exceptions
+from aiogram_scenario.fsm.storages.base import MagazineRecord
+from aiogram_scenario.fsm.storages.resilient import ResilientStorage, CircuitBreaker
+from aiogram_scenario.fsm.storages.testing import FaultInjectingStorage
+
+
+def create_storage(storage: FaultInjectingStorage, **kwargs) -> ResilientStorage:
+
+    kwargs.setdefault("backoff_base", 0.0)
+    return ResilientStorage(storage, **kwargs)
+
+
+def test_failed_calls_are_retried():
+
+    async def main():
+
+        faulty_storage = FaultInjectingStorage()
+        storage = create_storage(faulty_storage, retries=2)
+        faulty_storage.fail_next(2)
+        await storage.set_data(chat=1, user=1, data={"key": "value"})
+
+        assert await faulty_storage.get_data(chat=1, user=1) == {"key": "value"}
+        assert storage.metrics.retries == 2
+        assert storage.metrics.failures == 2
+        assert storage.circuit_breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(main())
+
+
+def test_error_is_raised_when_retries_are_exhausted():
+
+    async def main():
+
+        faulty_storage = FaultInjectingStorage()
+        storage = create_storage(faulty_storage, retries=1)
+        faulty_storage.fail_next(2)
+        with pytest.raises(ConnectionError):
+            await storage.set_data(chat=1, user=1, data={"key": "value"})
+
+        assert await faulty_storage.get_data(chat=1, user=1) == {}
+        assert storage.metrics.retries == 1
+
+    asyncio.run(main())
+
+
+def test_circuit_opens_and_half_opens():
+
+    async def main():
+
+        faulty_storage = FaultInjectingStorage()
+        circuit_breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+        storage = create_storage(faulty_storage, retries=0, circuit_breaker=circuit_breaker)
+        faulty_storage.set_down()
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                await storage.get_data(chat=1, user=1)
+        assert circuit_breaker.state == CircuitBreaker.OPEN
+
+        calls = faulty_storage.calls
+        with pytest.raises(exceptions.fsm.StorageUnavailableError):  # failed fast, the backend is not called
+            await storage.get_data(chat=1, user=1)
+        assert faulty_storage.calls == calls
+        assert storage.metrics.rejections == 1
+
+        await asyncio.sleep(0.05)
+        assert circuit_breaker.state == CircuitBreaker.HALF_OPEN
+        with pytest.raises(ConnectionError):  # the trial call fails, so the circuit is opened again
+            await storage.get_data(chat=1, user=1)
+        assert circuit_breaker.state == CircuitBreaker.OPEN
+
+        faulty_storage.set_down(False)
+        await asyncio.sleep(0.05)
+        assert await storage.get_data(chat=1, user=1) == {}
+        assert circuit_breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(main())
+
+
+def test_only_one_trial_call_is_let_through_half_open_circuit():
+
+    circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    circuit_breaker.record_failure()
+    time.sleep(0.05)
+
+    assert circuit_breaker.allow_call()
+    assert not circuit_breaker.allow_call()
+
+
+def test_slow_calls_time_out():
+
+    async def main():
+
+        storage = create_storage(FaultInjectingStorage(latency=0.2), retries=1, call_timeout=0.01)
+        with pytest.raises(asyncio.TimeoutError):
+            await storage.get_data(chat=1, user=1)
+
+        assert storage.metrics.timeouts == 2
+        assert storage.metrics.retries == 1
+
+    asyncio.run(main())
+
+
+def test_failed_magazine_write_is_retried():
+
+    async def main():
+
+        faulty_storage = FaultInjectingStorage()
+        storage = create_storage(faulty_storage, retries=2)
+        magazine = storage.get_magazine(chat=1, user=1)
+        await magazine.load()
+        faulty_storage.fail_next()
+        await magazine.push("a", compare_version=True)
+
+        assert await faulty_storage.get_magazine_record(chat=1, user=1) == ([None, "a"], 1)
+        assert storage.metrics.retries == 1
+
+    asyncio.run(main())
+
+
+def test_applied_magazine_write_with_lost_response_is_not_retried():
+
+    async def main():
+
+        faulty_storage = FaultInjectingStorage()
+        storage = create_storage(faulty_storage, retries=2)
+        magazine = storage.get_magazine(chat=1, user=1)
+        await magazine.load()
+        faulty_storage.lose_next_responses()
+        await magazine.push("a", compare_version=True)  # no false conflict with its own write
+
+        assert await faulty_storage.get_magazine_record(chat=1, user=1) == ([None, "a"], 1)
+        assert magazine.version == 1
+        assert storage.metrics.retries == 0
+
+    asyncio.run(main())
+
+
+def test_failed_magazine_write_of_outdated_version_is_conflict():
+
+    async def main():
+
+        faulty_storage = FaultInjectingStorage()
+        storage = create_storage(faulty_storage, retries=2)
+        await faulty_storage.set_magazine_states(chat=1, user=1, states=[None, "b"])
+        faulty_storage.fail_next()
+        with pytest.raises(exceptions.magazine.MagazineVersionConflictError):
+            await storage.compare_and_set_magazine_states(chat=1, user=1, states=[None, "a"], version=0)
+
+        assert await faulty_storage.get_magazine_record(chat=1, user=1) == ([None, "b"], 1)
+
+    asyncio.run(main())
+
+
+def test_partially_applied_batch_is_completed():
+
+    async def main():
+
+        faulty_storage = FaultInjectingStorage()
+        storage = create_storage(faulty_storage, retries=2)
+        records = [MagazineRecord(chat=str(i), user=str(i), states=[None, "a"], version=0) for i in range(3)]
+        faulty_storage.lose_next_responses()  # the first record is written, the batch fails
+        written = await storage.write_magazine_records(records)
+
+        assert written == 3
+        for i in range(3):
+            assert await faulty_storage.get_magazine_record(chat=i, user=i) == ([None, "a"], 1)
+
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+import asyncio
+import os
+
+import pytest
+
+from aiogram_scenario.fsm.storages.memory import MemoryStorage
+from aiogram_scenario.fsm.storages.resilient import ResilientStorage
+from aiogram_scenario.fsm.storages.testing import FaultInjectingStorage, StorageConformanceKit
+
+
+# Servers are used only if they are set, e.g. «TEST_REDIS_HOST=localhost TEST_MONGO_URI=mongodb://localhost»;
+# checks run on their own addresses, so the databases may be shared.
+REDIS_HOST = os.getenv("TEST_REDIS_HOST")
+REDIS_PORT = int(os.getenv("TEST_REDIS_PORT", "6379"))
+MONGO_URI = os.getenv("TEST_MONGO_URI")
+
+
+def create_redis_storage():
+
+    from aiogram_scenario.fsm.storages.redis import RedisStorage
+
+    return RedisStorage(host=REDIS_HOST, port=REDIS_PORT, prefix="aiogram_scenario_tests")
+
+
+def create_redis_cluster_storage():
+
+    from aiogram_scenario.fsm.storages.redis_cluster import RedisClusterStorage
+
+    return RedisClusterStorage(host=REDIS_HOST, port=REDIS_PORT, prefix="aiogram_scenario_tests")
+
+
+def create_mongo_storage():
+
+    from aiogram_scenario.fsm.storages.mongo import MongoStorage
+
+    return MongoStorage(uri=MONGO_URI, db_name="aiogram_scenario_tests")
+
+
+requires_redis = pytest.mark.skipif(REDIS_HOST is None, reason="TEST_REDIS_HOST is not set")
+requires_mongo = pytest.mark.skipif(MONGO_URI is None, reason="TEST_MONGO_URI is not set")
+
+
+@pytest.mark.parametrize("storage_factory", [
+    pytest.param(MemoryStorage, id="memory"),
+    pytest.param(FaultInjectingStorage, id="fault-injecting"),
+    pytest.param(lambda: ResilientStorage(MemoryStorage()), id="resilient-memory"),
+    pytest.param(lambda: ResilientStorage(FaultInjectingStorage(failure_rate=0.1, seed=1), retries=10,
+                                          backoff_base=0.0), id="resilient-faulty"),
+    pytest.param(create_redis_storage, id="redis", marks=requires_redis),
+    pytest.param(create_redis_cluster_storage, id="redis-cluster-single-node", marks=requires_redis),
+    pytest.param(create_mongo_storage, id="mongo", marks=requires_mongo)
+])
+def test_storage_conformance(storage_factory):
+
+    kit = StorageConformanceKit(storage_factory, stress_users=20, stress_pushes=10)
+    results = asyncio.run(kit.run())
+
+    failed = [f"{i.name}: {i.details}" for i in results if i.status == StorageConformanceKit.FAILED]
+    assert not failed, "\n".join(failed)
+    assert len(results) == len(kit.checks)
+
+
+def test_failed_check_is_reported():
+
+    class LosingStorage(MemoryStorage):
+
+        async def compare_and_set_magazine_states(self, *, version: int, **kwargs) -> int:
+
+            return version + 1  # nothing is written
+
+    results = asyncio.run(StorageConformanceKit(LosingStorage).run())
+
+    statuses = {i.name: i.status for i in results}
+    assert statuses["check_push"] == StorageConformanceKit.FAILED
+    assert statuses["check_initial_magazine"] == StorageConformanceKit.PASSED
+
+
+def test_throughput_is_measured():
+
+    stats = asyncio.run(StorageConformanceKit(MemoryStorage).measure_throughput(users=5, pushes=4))
+
+    assert stats.operations == 20
+    assert stats.per_second > 0